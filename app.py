@@ -2,9 +2,14 @@ import streamlit as st
 import pandas as pd
 import io
 import os
+import time
 
 # Import modules métier
-from modules import data_processing, eda_visuals, ml_predict, ai_assistant
+from modules import data_processing, eda_visuals, ml_predict, ai_assistant, upload_cache, ingestion, invoice_store, pipeline, warehouse
+from modules.cube import InvoiceCube
+from modules.kpis import DIMENSIONS, KpiEngine
+from utils.utils import as_of_date
+from modules.schema import INVOICE_SCHEMA, merge_invalid_amounts
 
 st.set_page_config(
     page_title="Outil d’Analyse & Prédiction des Retards de Paiement",
@@ -19,25 +24,6 @@ if os.path.exists(css_path):
     with open(css_path) as f:
         st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
 
-# ========== MAPPING AUTOMATIQUE DES COLONNES ==========
-COLUMN_MAPPING = {
-    "Client Name": "Client",
-    "Nom Client": "Client",
-    "Amount TTC": " T.T.C ",
-    "Montant TTC": " T.T.C ",
-    "Days Late": "Jours_Retard",
-    "Retard (jours)": "Jours_Retard",
-    "Due Date": "échéance",
-    "Date d'échéance": "échéance",
-    # Ajoute ici toutes les variantes possibles de tes fichiers historiques
-}
-
-def harmonize_columns(df, mapping):
-    """Renomme automatiquement les colonnes du DataFrame selon le mapping fourni."""
-    cols = [mapping.get(col, col) for col in df.columns]
-    df.columns = cols
-    return df
-
 # Sidebar
 logo_path = os.path.join(BASE_DIR, "assets", "logo.png")
 if os.path.exists(logo_path):
@@ -51,31 +37,171 @@ PAGES = [
 ]
 page = st.sidebar.radio("Aller à", PAGES)
 
+# Date de référence des retards et des features ML (aujourd'hui par défaut) : clé de tous les caches
+as_of = as_of_date(st.sidebar.date_input(
+    "Date de référence", value=as_of_date().date(), format="DD/MM/YYYY", key="as_of"
+))
+
+with st.sidebar.expander("Cache des imports"):
+    # Contenu du cache affiché en tête mais lu après les boutons : à jour dès la purge
+    listing = st.container()
+    if st.button("Vider le cache"):
+        st.success(f"{upload_cache.purge_cache()} entrée(s) supprimée(s).")
+    if st.button("Vider le stock des factures traitées"):
+        invoice_store.clear_store()
+        st.success("Stock vidé : le prochain import sera entièrement retraité.")
+    cache_df = upload_cache.cache_info()
+    with listing:
+        st.write(f"{len(cache_df)} fichier(s), {cache_df['Taille (Mo)'].sum():.1f} Mo")
+        if not cache_df.empty:
+            st.dataframe(cache_df, hide_index=True)
+
+if warehouse.DUCKDB_AVAILABLE:
+    with st.sidebar.expander("Entrepôt DuckDB (historique)"):
+        st.write(f"{warehouse.count()} facture(s) enregistrée(s)")
+        current = st.session_state.get("ml_preds")
+        if current is None:
+            current = st.session_state.get("df_processed")
+        if current is not None and st.button("Ajouter le dataset courant"):
+            total = warehouse.save(current, st.session_state.get("df_as_of"))
+            st.success(f"{len(current)} facture(s) ajoutée(s) ou mises à jour, {total} au total.")
+        if st.button("Vider l'entrepôt"):
+            warehouse.clear()
+            st.success("Entrepôt vidé.")
+
+def dataset_cube(df, key="cube", extra_dimensions=()):
+    """Cube d'agrégats du dataset, construit une fois par dataset (et non à chaque interaction)."""
+    cached = st.session_state.get(key)
+    if cached is None or cached[0] is not df:
+        cached = (df, InvoiceCube.build(df, extra_dimensions))
+        st.session_state[key] = cached
+    return cached[1]
+
+def kpi_engine(df):
+    engine = st.session_state.get("kpi_engine")
+    if engine is None or engine[0] is not df:
+        # Backend Polars : KPIs calculés par Polars, sans cube pandas
+        cube = dataset_cube(df) if data_processing.BACKEND != "polars" else None
+        engine = (df, data_processing.kpi_engine(df, cube))
+        st.session_state["kpi_engine"] = engine
+    return engine[1]
+
 # Initialisation des états
-for k in ["df_raw", "df_processed", "ml_preds"]:
+for k in ["df_raw", "df_processed", "ml_preds", "df_as_of"]:
     if k not in st.session_state:
         st.session_state[k] = None
+if "incremental" not in st.session_state:
+    st.session_state["incremental"] = False
 
 # ======================= PAGE 1 : Vue d'ensemble =======================
 if page == "Vue d'ensemble":
     st.header("Vue d’ensemble")
-    st.write("Importez votre fichier Excel de factures (brut ou déjà nettoyé).")
-    uploaded_file = st.file_uploader("Importer un fichier Excel (.xlsx)", type=["xlsx"])
-    if uploaded_file:
+    st.write("Importez votre fichier de factures (brut ou déjà nettoyé) : Excel, CSV, Parquet ou Feather.")
+    streaming = st.checkbox("Mode streaming (gros fichiers : lecture et traitement par blocs)")
+    incremental = st.checkbox(
+        "Traitement incrémental (seules les factures nouvelles ou modifiées depuis le dernier import sont retraitées)",
+        value=st.session_state["incremental"], disabled=streaming
+    )
+    st.session_state["incremental"] = incremental and not streaming
+    uploaded_files = st.file_uploader(
+        "Importer un ou plusieurs fichiers de factures (ex. un fichier par mois)",
+        type=ingestion.SUPPORTED_FORMATS, accept_multiple_files=True
+    )
+    batch_path = pipeline.output_path(as_of)
+    if os.path.exists(batch_path):
+        # Résultat du traitement batch (python -m modules.pipeline) pour cette date : simple relecture
+        batch_date = time.strftime("%d/%m/%Y %H:%M", time.localtime(os.path.getmtime(batch_path)))
+        if st.button(f"Charger le traitement batch du {as_of:%d/%m/%Y} (calculé le {batch_date})"):
+            df_batch, preds_batch = pipeline.load_results(batch_path)
+            st.session_state["df_raw"] = None
+            st.session_state["df_processed"] = data_processing.compact_frame(df_batch)
+            st.session_state["ml_preds"] = data_processing.compact_frame(preds_batch) if preds_batch is not None else None
+            st.session_state["df_as_of"] = as_of
+            st.success(f"Traitement batch chargé : {len(df_batch)} factures"
+                       + (", prédictions ML incluses." if preds_batch is not None else " (sans prédictions ML)."))
+    if uploaded_files:
         try:
-            df_raw = pd.read_excel(uploaded_file)
-            df_raw = harmonize_columns(df_raw, COLUMN_MAPPING)  # Mapping automatique
-            st.session_state["df_raw"] = df_raw
-            st.success("Fichier importé avec succès ! (colonnes harmonisées)")
-            st.dataframe(df_raw.head(20))
-            st.write(f"**Dimensions** : {df_raw.shape[0]} lignes, {df_raw.shape[1]} colonnes")
-
-            # Pipeline DATA immédiatement après import
-            with st.spinner("Nettoyage et préparation des données..."):
-                df_processed = data_processing.clean_and_prepare(df_raw)
+            names = [f.name for f in uploaded_files]
+            contents = [f.getvalue() for f in uploaded_files]
+            if streaming:
+                # Le classeur brut n'est jamais chargé en entier : seuls les blocs traités sont conservés
+                with st.spinner("Lecture et traitement par blocs..."):
+                    sources = [ingestion.iter_chunks(io.BytesIO(data), name=name, schema=INVOICE_SCHEMA)
+                               for data, name in zip(contents, names)]
+                    # Plusieurs fichiers : N° Facture des lignes brutes relevés avant le nettoyage,
+                    # dédoublonnage identique au mode normal (dernière occurrence brute conservée)
+                    raw_keys = []
+                    chunks = ingestion.numbered_chunks(sources, raw_keys) if len(sources) > 1 else sources[0]
+                    parts = list(data_processing.clean_and_prepare_stream(chunks, as_of))
+                df_processed = pd.DataFrame()
+                if parts:
+                    df_processed = pd.concat(parts)
+                    df_processed.attrs['montants_invalides'] = merge_invalid_amounts(parts)
+                    df_processed.attrs['validation'] = data_processing.ValidationReport.merge(
+                        [data_processing.validation_report(part) for part in parts]
+                    )
+                    if len(sources) > 1:
+                        df_processed = ingestion.keep_last_invoices(df_processed, raw_keys).reset_index(drop=True)
+                st.session_state["df_raw"] = None
+            else:
+                # Fichiers déjà importés : cache ; les autres sont lus en parallèle
+                keys = [upload_cache.cache_key(data) for data in contents]
+                frames, durations = [], []
+                for key in keys:
+                    start = time.perf_counter()
+                    frames.append(upload_cache.get(key))
+                    durations.append(time.perf_counter() - start)
+                missing = [i for i, frame in enumerate(frames) if frame is None]
+                if missing:
+                    with st.spinner(f"Lecture de {len(missing)} fichier(s)..."):
+                        results = ingestion.parse_files(
+                            [contents[i] for i in missing], [names[i] for i in missing], schema=INVOICE_SCHEMA
+                        )
+                    for i, (frame, duration) in zip(missing, results):
+                        frames[i] = upload_cache.put(keys[i], frame)
+                        durations[i] = duration
+                if len(frames) == 1:
+                    df_raw = frames[0]
+                else:
+                    df_raw, report = ingestion.combine(frames, names, durations)
+                    report["Cache"] = ["non" if i in missing else "oui" for i in range(len(frames))]
+                    st.dataframe(report, hide_index=True)
+                    st.caption(f"{report.attrs['doublons_supprimes']} facture(s) en double supprimée(s) (N° Facture).")
+                if len(frames) == 1 and not missing:
+                    st.caption("Fichier déjà importé : chargé depuis le cache.")
+                st.success("Fichier importé avec succès ! (colonnes harmonisées)")
+                st.dataframe(df_raw.head(20))
+                st.write(f"**Dimensions** : {df_raw.shape[0]} lignes, {df_raw.shape[1]} colonnes")
+
+                # Pipeline DATA immédiatement après import
+                with st.spinner("Nettoyage et préparation des données..."):
+                    if incremental:
+                        df_processed, stats = invoice_store.process_incremental(df_raw, as_of=as_of)
+                        st.caption(f"{stats['reprises']} facture(s) reprise(s) du stock, "
+                                   f"{stats['traitees']} (re)traitée(s), "
+                                   f"{len(stats['categorie_changee'])} changement(s) de catégorie en vieillissant.")
+                    else:
+                        # Clé de cache : empreinte des fichiers (pas de hachage du DataFrame)
+                        df_processed = data_processing.clean_and_prepare(df_raw, as_of, dataset_id="+".join(keys))
+                st.session_state["df_raw"] = data_processing.compact_frame(df_raw)
             if isinstance(df_processed, pd.DataFrame) and not df_processed.empty:
+                # Représentation compacte (category + entiers réduits) conservée en session
+                compact = data_processing.compact_frame(df_processed)
+                with st.expander("Empreinte mémoire du dataset traité"):
+                    st.dataframe(data_processing.memory_report(df_processed, compact))
+                df_processed = compact
                 st.session_state["df_processed"] = df_processed
+                st.session_state["df_as_of"] = as_of
                 st.success("Traitement terminé. Dataset prêt !")
+                invalid = {col: n for col, n in df_processed.attrs.get('montants_invalides', {}).items() if n}
+                if invalid:
+                    st.warning("Montants non reconnus (cellules laissées vides) : "
+                               + ", ".join(f"{col.strip()} : {n}" for col, n in invalid.items()))
+                report = data_processing.validation_report(df_processed)
+                if report is not None and report.nb_rejetees:
+                    with st.expander(f"{report.nb_rejetees} ligne(s) rejetée(s) à la validation "
+                                     f"sur {report.nb_lignes} lue(s)"):
+                        st.dataframe(report.to_frame(), hide_index=True)
                 st.dataframe(df_processed.head(20))
                 towrite = io.BytesIO()
                 df_processed.to_excel(towrite, index=False, engine="openpyxl")
@@ -91,11 +217,56 @@ if page == "Vue d'ensemble":
         except Exception as e:
             st.error(f"Erreur lors de l’import ou du traitement du fichier : {e}")
 
-    if st.session_state["df_processed"] is not None:
+    df_as_of = st.session_state["df_as_of"]
+    if st.session_state["df_processed"] is not None and df_as_of is not None and df_as_of != as_of:
+        # Données calculées pour une autre date : seules les factures ouvertes sont vieillies
+        if st.button(f"Mettre à jour les retards au {as_of:%d/%m/%Y} (données au {df_as_of:%d/%m/%Y})"):
+            df_processed = st.session_state["df_processed"].copy()
+            changed = data_processing.reage_open_invoices(df_processed, as_of)
+            st.session_state["df_processed"] = df_processed
+            if st.session_state["ml_preds"] is not None:
+                preds = st.session_state["ml_preds"].copy()
+                data_processing.reage_open_invoices(preds, as_of)
+                st.session_state["ml_preds"] = preds
+            st.session_state["df_as_of"] = as_of
+            st.success(f"Retards mis à jour : {len(changed)} facture(s) changent de catégorie.")
+            if len(changed) and st.session_state["ml_preds"] is not None:
+                st.info("Relancez la prédiction (page Prédictions ML) pour rafraîchir les scores à cette date.")
+
+    source = "Dataset importé"
+    if warehouse.count():
+        source = st.radio("Source des indicateurs", ["Dataset importé", "Entrepôt (historique)"], horizontal=True)
+    if source == "Entrepôt (historique)":
+        # Agrégations SQL sur l'entrepôt : aucune facture chargée en mémoire
+        st.subheader("Indicateurs clés (entrepôt)")
+        st.caption(f"Retards des factures non encaissées recalculés au {as_of:%d/%m/%Y} (date de référence), "
+                   "quelle que soit la date de leur enregistrement.")
+        try:
+            history_cube = warehouse.cube(as_of=as_of)
+            engine = KpiEngine.from_cube(history_cube)
+            st.json(engine.totals().to_dict())
+            dimension = st.selectbox("Découper les indicateurs par", ["(aucun)"] + list(DIMENSIONS))
+            if dimension != "(aucun)":
+                st.dataframe(engine.by(dimension))
+            with st.expander("Analyse des cautions (entrepôt)"):
+                cautions = data_processing.analyze_cautions(None, history_cube)
+                if not cautions.empty:
+                    # Masque Types_Retard -> libellés des catégories de règle
+                    cautions['Types_Retard'] = cautions['Types_Retard'].map(
+                        lambda mask: ", ".join(data_processing.decode_rule_categories(mask))
+                    )
+                st.dataframe(cautions)
+        except Exception as e:
+            st.warning(f"Erreur dans la lecture de l'entrepôt : {e}")
+        st.markdown("---")
+    elif st.session_state["df_processed"] is not None:
         st.subheader("Indicateurs clés (extrait)")
         try:
-            kpi_dict, _ = data_processing.generate_kpis(st.session_state["df_processed"])
-            st.json(kpi_dict)
+            engine = kpi_engine(st.session_state["df_processed"])
+            st.json(engine.totals().to_dict())
+            dimension = st.selectbox("Découper les indicateurs par", ["(aucun)"] + list(DIMENSIONS))
+            if dimension != "(aucun)":
+                st.dataframe(engine.by(dimension))
         except Exception as e:
             st.warning(f"Erreur dans l'extraction des KPIs : {e}")
         st.markdown("---")
@@ -106,7 +277,7 @@ elif page == "Analyse détaillée":
     df = st.session_state.get("df_processed")
     if df is not None and not df.empty:
         try:
-            eda_visuals.display_eda(df)
+            eda_visuals.display_eda(df, dataset_cube(df))
         except Exception as e:
             st.error(f"Erreur dans l’analyse ou la visualisation : {e}")
     else:
@@ -124,7 +295,10 @@ elif page == "Prédictions ML":
         with col1:
             if st.button("🚀 Entraîner le modèle (sur ces données)"):
                 with st.spinner("Entraînement du modèle en cours..."):
-                    ml_predict.train_model(df)
+                    _, _, metrics = ml_predict.train_model(df, as_of)
+                st.success(f"Modèle entraîné avec {metrics['accuracy']:.2%} de précision sur le test.")
+                st.text("Matrice de confusion :\n" + str(metrics['confusion_matrix']))
+                st.text("Rapport de classification :\n" + metrics['classification_report'])
                 st.success("Modèle réentraîné et sauvegardé.")
         with col2:
             predict_clicked = st.button("🔎 Prédire sur ces données")
@@ -132,8 +306,20 @@ elif page == "Prédictions ML":
         # --- OUTPUT PLEINE LARGEUR ---
         if predict_clicked:
             with st.spinner("Prédiction en cours..."):
-                preds = ml_predict.run_prediction(df)
-            if isinstance(preds, pd.DataFrame) and not preds.empty:
+                # Modèle sans prétraitement sauvegardé : NaN remplacés par les médianes du lot
+                # prédit, un score dépend des autres factures du lot -> pas de reprise
+                incremental = st.session_state["incremental"] and ml_predict.load_preprocessor() is not None
+                if incremental:
+                    preds, stats = invoice_store.score_incremental(df, ml_predict.run_prediction, as_of=as_of, features=True)
+                    st.caption(f"{stats['reprises']} prédiction(s) reprise(s) du stock, {stats['scorees']} calculée(s).")
+                else:
+                    if st.session_state["incremental"]:
+                        st.caption("Modèle sans prétraitement sauvegardé (entraîné avant) : toutes les factures sont scorées.")
+                    preds = ml_predict.run_prediction(df, as_of)
+            if isinstance(preds, pd.DataFrame) and 'ML_Prediction' not in preds.columns:
+                st.warning("Modèle non disponible. Merci de l'entraîner d'abord.")
+            elif isinstance(preds, pd.DataFrame) and not preds.empty:
+                preds = data_processing.compact_frame(preds)
                 st.session_state["ml_preds"] = preds
 
                 # --- OUTPUT ML PREDICTION DETAILLÉ ---
@@ -171,7 +357,7 @@ elif page == "Prédictions ML":
                 # Statistiques moyennes par catégorie
                 st.subheader("🔍 Statistiques moyennes par catégorie :")
                 num_stats = {}
-                for cat, group in preds.groupby('ML_Prediction'):
+                for cat, group in preds.groupby('ML_Prediction', observed=True):
                     num_stats[cat] = {
                         "Montant moyen (€)": group[' T.T.C '].mean() if ' T.T.C ' in group else None,
                         "Montant max (€)": group[' T.T.C '].max() if ' T.T.C ' in group else None,
@@ -215,7 +401,9 @@ elif page == "AI Insights & Relances":
     preds = st.session_state.get("ml_preds")
     if df is not None and preds is not None and not preds.empty:
         try:
-            ai_assistant.display_chatbot_interface(df, preds)
+            ai_assistant.display_chatbot_interface(
+                df, preds, dataset_cube(preds, key="ml_cube", extra_dimensions=["ML_Prediction"])
+            )
         except Exception as e:
             st.error(f"Erreur lors du calcul des insights ou de la génération des mails : {e}")
     else:
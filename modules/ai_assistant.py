@@ -2,6 +2,8 @@ import streamlit as st
 import pandas as pd
 import unicodedata
 
+from modules.cube import InvoiceCube
+
 def generate_mail(client_name, classif, client_df=None):
     """
     Génère un mail intelligent et personnalisé selon la classe de risque prédite et le contexte client.
@@ -69,13 +71,13 @@ def generate_mail(client_name, classif, client_df=None):
 
     return f"Objet : {objet}\n\n{texte}"
 
-def display_chatbot_interface(df, preds):
+def display_chatbot_interface(df, preds, cube=None):
     st.subheader("💬 Assistant : Insights & Relances personnalisées")
     tab1, tab2 = st.tabs(["🔎 Insights simples", "📧 Génération de mails clients"])
 
     with tab1:
         st.markdown("Voici quelques insights calculés automatiquement sur vos données :")
-        st.write(insight_summary(df, preds))
+        st.write(insight_summary(df, preds, cube))
 
     with tab2:
         if "Client" in df.columns and "ML_Prediction" in preds.columns:
@@ -101,22 +103,28 @@ def display_chatbot_interface(df, preds):
         else:
             st.warning("Impossible de générer les mails : colonne 'Client' ou prédiction manquante.")
 
-def insight_summary(df, preds):
+def insight_summary(df, preds, cube=None):
+    """
+    - cube : cube.InvoiceCube des prédictions avec la dimension ML_Prediction
+      (construit à partir de preds si absent)
+    """
     try:
-        merged = df.copy()
-        merged["ML_Prediction"] = preds["ML_Prediction"]
-        total = len(merged)
+        if cube is None:
+            cube = InvoiceCube.build(preds, extra_dimensions=["ML_Prediction"])
+        total = int(cube.total("n"))
         def normalize(s):
             if not isinstance(s, str):
                 return ""
             return unicodedata.normalize('NFKD', s).encode('ASCII', 'ignore').decode('utf-8').lower()
-        ml_pred_norm = merged["ML_Prediction"].astype(str).apply(normalize)
-        n_on_time = (ml_pred_norm == "aucun retard (ml)").sum()
-        n_late = (ml_pred_norm == "est en retard (ml)").sum()
-        n_very_late = (ml_pred_norm == "retard exagere (ml)").sum()
+        # Une normalisation par cellule du cube, pas par facture
+        ml_pred_norm = cube.cells["ML_Prediction"].astype(str).apply(normalize)
+        n_by_pred = cube.cells["n"].groupby(ml_pred_norm).sum()
+        n_on_time = n_by_pred.get("aucun retard (ml)", 0)
+        n_late = n_by_pred.get("est en retard (ml)", 0)
+        n_very_late = n_by_pred.get("retard exagere (ml)", 0)
         risk_clients = (
-            merged[ml_pred_norm == "retard exagere (ml)"]["Client"]
-            .value_counts()
+            cube.select(ml_pred_norm == "retard exagere (ml)").aggregate(["Client"])["n"]
+            .sort_values(ascending=False, kind='stable')
             .head(3)
             .to_dict()
         )
@@ -1,7 +1,11 @@
-import pandas as pd
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules.ingestion import load_invoices
 
 EXCEL_PATH = "data/BD_avec_regles_paiement_latest.xlsx"
-df = pd.read_excel(EXCEL_PATH)
+df = load_invoices(EXCEL_PATH)
 
 def check_categorie_regle(df):
     print("\n=== Vérification de la colonne Catégorie_Règle ===")
@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+
+# Dimensions du cube (colonne 'Mois' = mois d'émission)
+CUBE_DIMENSIONS = ['Code Client', 'Client', 'Mois', 'Catégorie_Règle', 'Encaissement']
+# Mesures -> agrégation pour repasser du cube à une vue plus grossière
+CUBE_MEASURES = {
+    'n': 'sum',                 # lignes (factures)
+    'n_factures': 'sum',        # N° Facture renseignés
+    'ttc': 'sum',
+    'ttc_n': 'sum',             # montants TTC renseignés
+    'retard': 'sum',            # somme des Jours_Retard
+    'retard_n': 'sum',
+    'retard_max': 'max',
+    'en_retard': 'sum',         # somme de Est_En_Retard
+    'en_retard_n': 'sum',
+    'retard_exagere': 'sum',    # somme de Est_Retard_Exagéré
+    'premiere_emission': 'min',
+}
+
+
+def _measures(df):
+    n = len(df)
+    m = {'n': np.ones(n, dtype='int64')}
+    m['n_factures'] = df['N° Facture'].notna().to_numpy().astype('int64') if 'N° Facture' in df.columns else m['n']
+    for name, col in ((' T.T.C ', 'ttc'), ('Jours_Retard', 'retard'), ('Est_En_Retard', 'en_retard')):
+        if name in df.columns:
+            values = df[name].to_numpy(dtype=float)
+            m[col] = np.nan_to_num(values)
+            m[f'{col}_n'] = (~np.isnan(values)).astype('int64')
+            if col == 'retard':
+                m['retard_max'] = values
+    if 'Est_Retard_Exagéré' in df.columns:
+        m['retard_exagere'] = np.nan_to_num(df['Est_Retard_Exagéré'].to_numpy(dtype=float))
+    if "Date d'Emission" in df.columns:
+        m['premiere_emission'] = pd.to_datetime(df["Date d'Emission"], errors='coerce').to_numpy()
+    return pd.DataFrame(m, index=df.index)
+
+
+class InvoiceCube:
+    """
+    Agrégats pré-calculés des factures par (Code Client, Client, mois d'émission,
+    Catégorie_Règle, Encaissement) [+ dimensions supplémentaires, ex. ML_Prediction] :
+    nombre de factures, somme / nombre de TTC, somme / nombre / max des retards,
+    nombre de retards et de retards exagérés, première émission.
+    Construit une fois après clean_and_prepare ; KPIs, graphiques et analyse des cautions
+    l'interrogent ensuite (coût proportionnel au cube, pas au nombre de factures).
+    """
+
+    def __init__(self, cells, dimensions, cautions=None):
+        self.cells = cells
+        self.dimensions = dimensions
+        self.cautions = cautions
+
+    @classmethod
+    def build(cls, df, extra_dimensions=()):
+        keys = {}
+        for dim in CUBE_DIMENSIONS + list(extra_dimensions):
+            if dim == 'Mois' and "Date d'Emission" in df.columns:
+                keys[dim] = pd.to_datetime(df["Date d'Emission"], errors='coerce').dt.to_period('M').rename(dim)
+            elif dim in df.columns:
+                keys[dim] = df[dim]
+        measures = _measures(df)
+        if not keys:
+            cells = measures.agg({col: CUBE_MEASURES[col] for col in measures.columns}).to_frame().T
+            return cls(cells, [])
+        aggregations = {col: CUBE_MEASURES[col] for col in measures.columns}
+        cells = measures.groupby(list(keys.values()), observed=True, dropna=False, sort=False).agg(aggregations)
+        cells = cells.reset_index()
+        # Caution du client : première valeur renseignée, dans l'ordre des factures
+        cautions = None
+        if all(col in df.columns for col in ['Code Client', 'Client', ' Caution ']):
+            cautions = df.groupby(['Code Client', 'Client'], observed=True)[' Caution '].first()
+        return cls(cells, list(keys), cautions)
+
+    def __len__(self):
+        return len(self.cells)
+
+    def has(self, *columns):
+        return all(col in self.cells.columns for col in columns)
+
+    def select(self, mask):
+        """Sous-cube (ex. cube.select(cube.cells['Encaissement'] != 'OUI'))."""
+        return InvoiceCube(self.cells[mask], self.dimensions, self.cautions)
+
+    def aggregate(self, by=(), dropna=True):
+        """
+        Ré-agrège le cube sur les dimensions `by` (liste vide : totaux sur tout le cube).
+        Comme un groupby sur les factures, les valeurs manquantes de `by` sont exclues par défaut.
+        """
+        measures = [col for col in CUBE_MEASURES if col in self.cells.columns]
+        aggregations = {col: CUBE_MEASURES[col] for col in measures}
+        if not by:
+            return self.cells[measures].agg(aggregations)
+        return self.cells.groupby(list(by), observed=True, dropna=dropna)[measures].agg(aggregations)
+
+    def total(self, measure):
+        return self.aggregate()[measure]
+
+
+def mean_of(agg, measure):
+    """Moyenne d'une mesure (somme / nombre de valeurs renseignées), NaN si aucune valeur."""
+    count = agg[f'{measure}_n']
+    if np.ndim(count) == 0:
+        # Totaux (cube.aggregate() sans dimension)
+        return agg[measure] / count if count > 0 else np.nan
+    return agg[measure] / count.where(count > 0)
@@ -1,160 +1,447 @@
+import os
+from dataclasses import dataclass
+
 import pandas as pd
 import numpy as np
-import streamlit as st
 
-@st.cache_data(show_spinner="Nettoyage/processing en cours…")
-def clean_and_prepare(df_raw):
-    df = df_raw.copy()
+from modules.cube import mean_of
+from modules.kpis import KpiEngine
+from modules.schema import parse_fr_amounts, record_invalid_amounts
+from utils.utils import as_of_date, cache_data, cache_resource
+
+# Moteur du nettoyage et des KPIs : "pandas" ou "polars" (cf. polars_backend, si installé)
+BACKEND = os.environ.get("DATA_BACKEND", "pandas")
+
+def _polars():
+    if BACKEND != "polars":
+        return None
+    from modules import polars_backend
+    return polars_backend if polars_backend.POLARS_AVAILABLE else None
+
+def clean_and_prepare(df_raw, as_of=None, dataset_id=None):
+    """
+    Nettoyage + règles de retard. as_of : date de référence des retards (défaut : aujourd'hui),
+    résolue avant l'appel du cache pour faire partie de sa clé.
+    - dataset_id : identifiant du contenu de df_raw (ex. empreinte des fichiers importés,
+      cf. upload_cache.cache_key). Fourni, le résultat est conservé pour tout le processus
+      sous la clé (dataset_id, as_of) : df_raw n'est pas haché et le résultat n'est pas copié
+      (partagé entre sessions : ne pas le modifier en place).
+    """
+    as_of = as_of_date(as_of)
+    if dataset_id is not None:
+        return _clean_and_prepare_shared(dataset_id, as_of, df_raw)
+    return _clean_and_prepare_cached(df_raw, as_of)
+
+@cache_data(show_spinner="Nettoyage/processing en cours…")
+def _clean_and_prepare_cached(df_raw, as_of):
+    return _clean_and_prepare(df_raw, as_of=as_of)
+
+# Clé = (dataset_id, as_of) ; _df_raw (préfixe _) n'est pas haché par Streamlit
+@cache_resource(show_spinner="Nettoyage/processing en cours…", max_entries=8)
+def _clean_and_prepare_shared(dataset_id, as_of, _df_raw):
+    return _clean_and_prepare(_df_raw, as_of=as_of)
+
+def clean_and_prepare_stream(chunks, as_of=None):
+    """
+    Version streaming de clean_and_prepare : nettoie et applique les règles de retard
+    bloc par bloc (ex. blocs produits par ingestion.iter_excel_chunks), sans copie
+    ni chargement complet du classeur. Toutes les règles étant ligne à ligne,
+    la concaténation des blocs produits est identique au traitement en un seul passage.
+    """
+    as_of = as_of_date(as_of)
+    for chunk in chunks:
+        processed = _clean_and_prepare(chunk, copy=False, as_of=as_of)
+        if not processed.empty:
+            yield processed
+
+def _clean_and_prepare(df_raw, copy=True, as_of=None):
+    backend = _polars()
+    if backend is not None:
+        return backend.clean_and_prepare(df_raw, as_of_date(as_of))
+    df = df_raw.copy() if copy else df_raw
     # Nettoyage des montants (format FR)
     montant_cols = [' H.T ', ' T.V.A ', ' T.R ', ' T.T.C ', ' Caution ', ' Montant ']
+    invalid = {}
     for col in montant_cols:
+        # Colonnes déjà typées à la lecture (schéma déclaré) : laissées telles quelles
         if col in df.columns:
-            df[col] = (
-                df[col].astype(str)
-                .str.replace(',', '.', regex=False)
-                .str.replace(' ', '', regex=False)
-            )
-            df[col] = pd.to_numeric(df[col], errors='coerce')
+            df[col], invalid[col] = parse_fr_amounts(df[col])
+    record_invalid_amounts(df, invalid)
     # Conversion dates
     date_cols = ["Date d'Emission", 'échéance', 'Date Encaissement']
     for col in date_cols:
         if col in df.columns:
             df[col] = pd.to_datetime(df[col], errors='coerce')
-    # Suppression factures TTC <= 0
+    # Validation (TTC > 0, dates renseignées, émission <= échéance) : un seul filtrage
+    mask = validation_mask(df)
+    report = ValidationReport.from_mask(mask, df.index)
+    if report.nb_rejetees:
+        df = df[mask == 0]
+    df.attrs['validation'] = report
+    # Application règles métiers retards
+    df = apply_payment_delay_rules(df, as_of)
+    return df
+
+# Règles de validation des factures : nom -> bit du masque de rejet (cf. validation_mask)
+VALIDATION_RULES = {
+    'TTC manquant ou <= 0': 1,
+    "Date d'émission manquante": 2,
+    'Échéance manquante': 4,
+    'Émission après échéance': 8,
+}
+
+def validation_mask(df):
+    """
+    Règles enfreintes par chaque ligne, calculées en une passe : un masque uint8
+    (un bit par règle de VALIDATION_RULES), 0 pour une ligne valide.
+    Les règles de dates ne s'appliquent que si les deux colonnes de dates sont présentes.
+    """
+    ttc_bit, emission_bit, echeance_bit, order_bit = VALIDATION_RULES.values()
+    mask = np.zeros(len(df), dtype='uint8')
     if ' T.T.C ' in df.columns:
-        df = df[df[' T.T.C '] > 0]
-    # Logique date émission < échéance
+        ttc = df[' T.T.C '].to_numpy(dtype=float)
+        mask |= np.where(ttc > 0, 0, ttc_bit).astype('uint8')
     if "Date d'Emission" in df.columns and 'échéance' in df.columns:
-        df = df[(df["Date d'Emission"].notna()) & (df["échéance"].notna())]
-        df = df[df["Date d'Emission"] <= df["échéance"]]
-    # Application règles métiers retards
-    df = apply_payment_delay_rules(df)
+        emission = pd.to_datetime(df["Date d'Emission"], errors='coerce')
+        echeance = pd.to_datetime(df['échéance'], errors='coerce')
+        mask |= np.where(emission.isna().to_numpy(), emission_bit, 0).astype('uint8')
+        mask |= np.where(echeance.isna().to_numpy(), echeance_bit, 0).astype('uint8')
+        mask |= np.where((emission > echeance).to_numpy(), order_bit, 0).astype('uint8')
+    return mask
+
+@dataclass(frozen=True, eq=False)
+class ValidationReport:
+    """
+    Lignes rejetées par la validation, conservé dans df.attrs['validation'] :
+    index des lignes rejetées et masque des règles enfreintes par chacune (tableaux numpy,
+    copiés à moindre coût par pandas avec les attrs).
+    """
+    nb_lignes: int
+    index: np.ndarray
+    regles: np.ndarray
+
+    @classmethod
+    def from_mask(cls, mask, index):
+        rejected = mask != 0
+        return cls(len(mask), np.asarray(index[rejected]), mask[rejected])
+
+    @classmethod
+    def merge(cls, reports):
+        """Rapport cumulé de plusieurs blocs / fichiers."""
+        reports = [report for report in reports if report is not None]
+        if not reports:
+            return None
+        return cls(
+            sum(report.nb_lignes for report in reports),
+            np.concatenate([report.index for report in reports]),
+            np.concatenate([report.regles for report in reports]),
+        )
+
+    @property
+    def nb_rejetees(self):
+        return len(self.index)
+
+    def rejets(self):
+        """Nombre de lignes rejetées par règle (une ligne peut enfreindre plusieurs règles)."""
+        return {rule: int(np.count_nonzero(self.regles & bit)) for rule, bit in VALIDATION_RULES.items()
+                if np.count_nonzero(self.regles & bit)}
+
+    def rows(self, rule):
+        """Index des lignes rejetées pour une règle."""
+        return self.index[(self.regles & VALIDATION_RULES[rule]) != 0]
+
+    def to_frame(self):
+        """Une ligne par règle enfreinte : nombre de lignes et premiers index concernés."""
+        rejets = self.rejets()
+        return pd.DataFrame({
+            'Règle': list(rejets),
+            'Lignes rejetées': list(rejets.values()),
+            'Exemples (index)': [', '.join(map(str, self.rows(rule)[:10])) for rule in rejets],
+        })
+
+def validation_report(df):
+    """Rapport de validation d'un résultat de clean_and_prepare (None si absent)."""
+    return df.attrs.get('validation')
+
+# Règles métier : (borne haute de jours de retard, statut détaillé, catégorie)
+DELAY_RULES = [
+    (-1, 'Payée avant échéance', 'Aucun retard'),
+    (30, 'Dans les délais', 'Pas de retard'),
+    (60, 'En retard', 'Retard'),
+]
+DELAY_RULE_ABOVE = ('Retard exagéré', 'Retard exagéré')
+DELAY_RULE_MISSING = ('Échéance manquante', 'Indéterminé')
+ON_TIME_CATEGORIES = ['Pas de retard', 'Aucun retard']
+
+def compute_delay_status(df, as_of):
+    """
+    Calcul vectorisé des règles de retard : renvoie (statut, jours_retard, catégorie)
+    sous forme de tableaux numpy alignés sur les lignes de df.
+    Retard = encaissement - échéance pour les factures encaissées, as_of - échéance sinon.
+    """
+    if 'échéance' in df.columns:
+        echeance = pd.to_datetime(df['échéance'], errors='coerce')
+    else:
+        echeance = pd.Series(pd.NaT, index=df.index, dtype='datetime64[ns]')
+    reference = pd.Series(as_of, index=df.index)
+    if 'Encaissement' in df.columns and 'Date Encaissement' in df.columns:
+        encaissement = pd.to_datetime(df['Date Encaissement'], errors='coerce')
+        paid = (df['Encaissement'] == 'OUI') & encaissement.notna()
+        reference = encaissement.where(paid, reference)
+    missing = echeance.isna().to_numpy()
+    days = (reference - echeance).dt.days.fillna(0).to_numpy(dtype='int64')
+    conditions = [missing] + [days <= bound for bound, _, _ in DELAY_RULES]
+    statut = np.select(conditions, [DELAY_RULE_MISSING[0]] + [r[1] for r in DELAY_RULES], DELAY_RULE_ABOVE[0])
+    categorie = np.select(conditions, [DELAY_RULE_MISSING[1]] + [r[2] for r in DELAY_RULES], DELAY_RULE_ABOVE[1])
+    return statut.astype(object), days, categorie.astype(object)
+
+def apply_payment_delay_rules(df, as_of=None):
+    statut, days, categorie = compute_delay_status(df, as_of_date(as_of))
+    df['Statut_Détaillé'] = statut
+    df['Jours_Retard'] = days
+    df['Catégorie_Règle'] = categorie
+    df['Est_En_Retard'] = (~np.isin(categorie, ON_TIME_CATEGORIES)).astype(int)
+    df['Est_Retard_Exagéré'] = (categorie == DELAY_RULE_ABOVE[1]).astype(int)
     return df
 
-def apply_payment_delay_rules(df):
-    today = pd.Timestamp.now()
-    def calculate_delay_status(row):
-        echeance = row.get('échéance', pd.NaT)
-        if pd.isna(echeance): return 'Échéance manquante', 0, 'Indéterminé'
-        if row.get('Encaissement', '') == 'OUI' and pd.notna(row.get('Date Encaissement', pd.NaT)):
-            days_late = (row['Date Encaissement'] - echeance).days
-        else:
-            days_late = (today - echeance).days
-        if days_late < 0:
-            return 'Payée avant échéance', days_late, 'Aucun retard'
-        elif days_late <= 30:
-            return 'Dans les délais', days_late, 'Pas de retard'
-        elif days_late <= 60:
-            return 'En retard', days_late, 'Retard'
+def open_invoices(df):
+    """Masque des factures ouvertes (non encaissées) : les seules dont le retard évolue avec as_of."""
+    if 'Encaissement' not in df.columns or 'Date Encaissement' not in df.columns:
+        return pd.Series(True, index=df.index)
+    paid = (df['Encaissement'] == 'OUI') & pd.to_datetime(df['Date Encaissement'], errors='coerce').notna()
+    return ~paid
+
+def _set_rows(df, mask, col, values):
+    # Écriture partielle compatible avec compact_frame (category, entiers réduits)
+    column = df[col]
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        new = pd.Index(pd.unique(values)).difference(column.cat.categories)
+        if len(new):
+            df[col] = column.cat.add_categories(new)
+    elif pd.api.types.is_integer_dtype(column) and len(values):
+        info = np.iinfo(column.dtype)
+        if values.min() < info.min or values.max() > info.max:
+            df[col] = column.astype('int64')
         else:
-            return 'Retard exagéré', days_late, 'Retard exagéré'
-    df[['Statut_Détaillé', 'Jours_Retard', 'Catégorie_Règle']] = df.apply(
-        calculate_delay_status, axis=1, result_type='expand'
-    )
-    df['Est_En_Retard'] = df['Catégorie_Règle'].apply(lambda x: 0 if x in ['Pas de retard', 'Aucun retard'] else 1)
-    df['Est_Retard_Exagéré'] = (df['Catégorie_Règle'] == 'Retard exagéré').astype(int)
-    return df
+            values = values.astype(column.dtype)
+    df.loc[mask, col] = values
+
+def reage_open_invoices(df, as_of=None):
+    """
+    Vieillissement quotidien : recalcule Jours_Retard, Statut_Détaillé, Catégorie_Règle et
+    les indicateurs de retard des seules factures ouvertes (le retard d'une facture encaissée
+    est figé par sa date d'encaissement), à la date de référence as_of. df (résultat de
+    clean_and_prepare, éventuellement compacté) est modifié en place.
+    Retourne l'index des factures dont la catégorie a changé (scores et actions à rafraîchir).
+    """
+    as_of = as_of_date(as_of)
+    mask = open_invoices(df).to_numpy()
+    if not mask.any():
+        return df.index[:0]
+    statut, days, categorie = compute_delay_status(df[mask], as_of)
+    previous = df.loc[mask, 'Catégorie_Règle'].astype(object).to_numpy() if 'Catégorie_Règle' in df.columns else None
+    if previous is None:
+        apply_payment_delay_rules(df, as_of)
+        return df.index
+    _set_rows(df, mask, 'Statut_Détaillé', statut)
+    _set_rows(df, mask, 'Jours_Retard', days)
+    _set_rows(df, mask, 'Catégorie_Règle', categorie)
+    _set_rows(df, mask, 'Est_En_Retard', (~np.isin(categorie, ON_TIME_CATEGORIES)).astype(int))
+    _set_rows(df, mask, 'Est_Retard_Exagéré', (categorie == DELAY_RULE_ABOVE[1]).astype(int))
+    return df.index[mask][previous != categorie]
+
+def compact_frame(df, max_unique_ratio=0.5):
+    """
+    Représentation compacte en mémoire d'un DataFrame de factures :
+    - colonnes texte peu variées (Client, Code Client, Statut_Détaillé, Catégorie_Règle,
+      Encaissement, ...) -> category
+    - colonnes entières (Jours_Retard, indicateurs, N° Facture) -> plus petit type entier
+    Les montants restent en float64 pour que les totaux restent exacts au centime.
+    Retourne un nouveau DataFrame, df n'est pas modifié.
+    """
+    compact = df.copy(deep=False)
+    for col in compact.columns:
+        values = compact[col]
+        if values.dtype == object and len(values) > 0:
+            if values.nunique(dropna=True) <= max_unique_ratio * len(values):
+                compact[col] = values.astype('category')
+        elif pd.api.types.is_integer_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            compact[col] = pd.to_numeric(values, downcast='integer')
+    return compact
+
+def memory_report(before, after):
+    """Empreinte mémoire par colonne (Mo) avant / après compact_frame, avec une ligne de total."""
+    mem_before = before.memory_usage(deep=True, index=False) / 1024 ** 2
+    mem_after = after.memory_usage(deep=True, index=False) / 1024 ** 2
+    report = pd.DataFrame({
+        'Type avant': before.dtypes.astype(str),
+        'Type après': after.dtypes.astype(str),
+        'Mo avant': mem_before,
+        'Mo après': mem_after,
+    })
+    report.loc['TOTAL'] = ['', '', mem_before.sum(), mem_after.sum()]
+    report['Gain (%)'] = (100 * (1 - report['Mo après'] / report['Mo avant'])).fillna(0)
+    return report.round(3)
+
+# Catégories de règle possibles, chacune associée à un bit (masque Types_Retard)
+RULE_CATEGORIES = [DELAY_RULE_MISSING[1]] + [r[2] for r in DELAY_RULES] + [DELAY_RULE_ABOVE[1]]
+
+def encode_rule_categories(categories):
+    """Catégorie_Règle -> bit de la catégorie dans RULE_CATEGORIES (0 si inconnue)."""
+    codes = pd.Categorical(categories, categories=RULE_CATEGORIES).codes
+    return np.where(codes >= 0, np.left_shift(1, codes.astype('int64')), 0)
+
+def decode_rule_categories(mask):
+    """Masque Types_Retard -> liste des catégories présentes (ordre de RULE_CATEGORIES)."""
+    return [cat for i, cat in enumerate(RULE_CATEGORIES) if int(mask) >> i & 1]
 
-def analyze_cautions(df):
-    # Analyse du respect des limites de caution selon vos règles
-    if not all(col in df.columns for col in ['Code Client', 'Client', ' T.T.C ', ' Caution ', 'Est_En_Retard', 'N° Facture', 'Jours_Retard', 'Date d\'Emission', 'Catégorie_Règle']):
+# Score de risque client -> classification (seuils décroissants)
+CAUTION_CLASSES = [(7, ' BLOCAGE IMMÉDIAT'), (5, ' HAUT RISQUE'), (3, ' SURVEILLANCE')]
+CAUTION_CLASS_DEFAULT = ' NORMAL'
+
+def classify_cautions(retard_moyen, depassement, caution_disponible):
+    """
+    Classification vectorisée des clients :
+    retard moyen > 60 j : +5, > 30 j : +3 ; dépassement de caution : +4 si caution, +2 sinon.
+    """
+    retard_moyen = np.asarray(retard_moyen, dtype=float)
+    depassement = np.asarray(depassement, dtype=float)
+    score = np.select([retard_moyen > 60, retard_moyen > 30], [5, 3], 0)
+    score = score + np.where(depassement > 0, np.where(np.asarray(caution_disponible) > 0, 4, 2), 0)
+    return np.select([score >= seuil for seuil, _ in CAUTION_CLASSES],
+                     [label for _, label in CAUTION_CLASSES], CAUTION_CLASS_DEFAULT).astype(object)
+
+CAUTION_COLUMNS = ['Code Client', 'Client', ' T.T.C ', ' Caution ', 'Est_En_Retard', 'N° Facture', 'Jours_Retard', 'Date d\'Emission', 'Catégorie_Règle']
+
+def _category_flags(categories):
+    # Une colonne indicatrice par catégorie de RULE_CATEGORIES (OU par client = max)
+    bits = encode_rule_categories(categories)
+    return {f'_cat_{i}': (bits & (1 << i)) > 0 for i in range(len(RULE_CATEGORIES))}
+
+def _client_encours_from_cube(cube):
+    flags = _category_flags(cube.cells['Catégorie_Règle'])
+    agg = cube.cells.assign(**flags).groupby(['Code Client', 'Client'], observed=True).agg({
+        'ttc': 'sum', 'en_retard': 'sum', 'n_factures': 'sum', 'retard': 'sum', 'retard_n': 'sum',
+        'premiere_emission': 'min', **{flag: 'max' for flag in flags},
+    })
+    client_encours = pd.DataFrame({
+        'Encours_Total': agg['ttc'],
+        'Caution': cube.cautions.reindex(agg.index),
+        'Nb_Retards': agg['en_retard'],
+        'Nb_Factures': agg['n_factures'],
+        'Retard_Moyen': mean_of(agg, 'retard'),
+        'Première_Facture': agg['premiere_emission'],
+    }, index=agg.index).round(2)
+    return client_encours, agg[list(flags)]
+
+def analyze_cautions(df, cube=None):
+    """
+    Analyse du respect des limites de caution selon vos règles (une ligne par client).
+    - cube : cube.InvoiceCube déjà construit sur df ; l'analyse lit alors le cube
+      au lieu de regrouper les factures.
+    """
+    if cube is not None and cube.cautions is not None and cube.has('Code Client', 'Client', 'Catégorie_Règle', 'ttc', 'en_retard', 'retard'):
+        client_encours, flags = _client_encours_from_cube(cube)
+    elif df is not None and all(col in df.columns for col in CAUTION_COLUMNS):
+        # Types de retard du client : OU des bits de ses catégories
+        flags = _category_flags(df['Catégorie_Règle'])
+        client_encours = df.assign(**flags).groupby(['Code Client', 'Client'], observed=True).agg({
+            ' T.T.C ': 'sum',
+            ' Caution ': 'first',
+            'Est_En_Retard': 'sum',
+            'N° Facture': 'count',
+            'Jours_Retard': 'mean',
+            'Date d\'Emission': 'min',
+            **{flag: 'max' for flag in flags},
+        }).round(2)
+        flags = client_encours[list(flags)]
+        client_encours = client_encours.drop(columns=list(flags))
+        client_encours.columns = ['Encours_Total', 'Caution', 'Nb_Retards',
+                                 'Nb_Factures', 'Retard_Moyen', 'Première_Facture']
+    else:
         return pd.DataFrame()
-    client_encours = df.groupby(['Code Client', 'Client']).agg({
-        ' T.T.C ': 'sum',
-        ' Caution ': 'first',
-        'Est_En_Retard': 'sum',
-        'N° Facture': 'count',
-        'Jours_Retard': 'mean',
-        'Date d\'Emission': 'min',
-        'Catégorie_Règle': lambda x: list(x.unique())
-    }).round(2)
-    client_encours.columns = ['Encours_Total', 'Caution', 'Nb_Retards',
-                             'Nb_Factures', 'Retard_Moyen', 'Première_Facture', 'Types_Retard']
+    # Compteurs en int64 quelle que soit la source (cube, factures compactées : int8)
+    client_encours[['Nb_Retards', 'Nb_Factures']] = client_encours[['Nb_Retards', 'Nb_Factures']].astype('int64')
+    client_encours['Types_Retard'] = (flags.to_numpy().astype('int64') @ (1 << np.arange(flags.shape[1]))).astype('int8')
     client_encours['Caution_Disponible'] = client_encours['Caution'].fillna(0)
     client_encours['Dépassement'] = np.maximum(0, client_encours['Encours_Total'] - client_encours['Caution_Disponible'])
-    def classify_client_situation(row):
-        score_risque = 0
-        if row['Retard_Moyen'] > 60:
-            score_risque += 5
-        elif row['Retard_Moyen'] > 30:
-            score_risque += 3
-        if row['Dépassement'] > 0:
-            if row['Caution_Disponible'] > 0:
-                score_risque += 4
-            else:
-                score_risque += 2
-        if score_risque >= 7:
-            return ' BLOCAGE IMMÉDIAT'
-        elif score_risque >= 5:
-            return ' HAUT RISQUE'
-        elif score_risque >= 3:
-            return ' SURVEILLANCE'
-        else:
-            return ' NORMAL'
-    client_encours['Classification'] = client_encours.apply(classify_client_situation, axis=1)
+    client_encours['Classification'] = classify_cautions(
+        client_encours['Retard_Moyen'], client_encours['Dépassement'], client_encours['Caution_Disponible']
+    )
     return client_encours
 
-def identify_priority_actions(df, client_analysis):
+def _action_records(rows, columns, action):
+    # Construction en bloc des fiches d'action (une par ligne), colonnes absentes -> None
+    records = pd.DataFrame({
+        key: rows[col] if col in rows.columns else None for key, col in columns.items()
+    }, index=rows.index)
+    records['action'] = action
+    return records.to_dict('records')
+
+def _top(df, top_n, columns):
+    # Tri partiel : seules les top_n premières lignes sont ordonnées (toutes si top_n est None)
+    columns = [col for col in columns if col in df.columns]
+    if not columns:
+        return df if top_n is None else df.head(top_n)
+    if top_n is None:
+        return df.sort_values(columns, ascending=False, kind='stable')
+    return df.nlargest(top_n, columns)
+
+INVOICE_ACTION_COLUMNS = {'facture': 'N° Facture', 'client': 'Client', 'montant': ' T.T.C ', 'jours_retard': 'Jours_Retard'}
+
+def identify_priority_actions(df, client_analysis, top_n=10, seuil_min=45, seuil_max=60, top_n_clients=None):
+    """
+    Centre d'actions : clients à bloquer, factures en retard exagéré à relancer,
+    factures approchant le seuil (entre seuil_min et seuil_max jours de retard).
+    Chaque liste est classée par montant puis retard décroissants (dépassement puis encours
+    pour les clients) et limitée aux top_n premières (top_n_clients pour les blocages) ;
+    None = tout le portefeuille.
+    """
     actions = {'urgentes': [], 'importantes': [], 'surveillance': []}
     # 1. Actions URGENTES (blocage immédiat)
     if not client_analysis.empty:
         blocage_clients = client_analysis[client_analysis['Classification'] == ' BLOCAGE IMMÉDIAT']
-        for _, client in blocage_clients.iterrows():
-            actions['urgentes'].append({
-                'client': client.name[1],
-                'code': client.name[0],
-                'encours': client['Encours_Total'],
-                'depassement': client['Dépassement'],
-                'action': 'BLOQUER - Suspension livraisons immédiate'
-            })
+        blocage_clients = _top(blocage_clients, top_n_clients, ['Dépassement', 'Encours_Total'])
+        actions['urgentes'] = _action_records(
+            blocage_clients.reset_index(),
+            {'client': 'Client', 'code': 'Code Client', 'encours': 'Encours_Total', 'depassement': 'Dépassement'},
+            'BLOQUER - Suspension livraisons immédiate'
+        )
+    unpaid = df['Encaissement'] != 'OUI' if 'Encaissement' in df.columns else None
     # 2. Actions IMPORTANTES (retards exagérés sans blocage)
-    if 'Catégorie_Règle' in df.columns and 'Encaissement' in df.columns:
-        retards_exageres = df[
-            (df['Catégorie_Règle'] == 'Retard exagéré') & (df['Encaissement'] != 'OUI')
-        ]
-        for _, facture in retards_exageres.head(10).iterrows():
-            actions['importantes'].append({
-                'facture': facture['N° Facture'],
-                'client': facture['Client'],
-                'montant': facture[' T.T.C '] if ' T.T.C ' in facture else None,
-                'jours_retard': facture['Jours_Retard'],
-                'action': 'RELANCE DIRECTE - Contact téléphonique direction'
-            })
+    if 'Catégorie_Règle' in df.columns and unpaid is not None:
+        retards_exageres = df[(df['Catégorie_Règle'] == 'Retard exagéré') & unpaid]
+        actions['importantes'] = _action_records(
+            _top(retards_exageres, top_n, [' T.T.C ', 'Jours_Retard']), INVOICE_ACTION_COLUMNS,
+            'RELANCE DIRECTE - Contact téléphonique direction'
+        )
     # 3. SURVEILLANCE (approche des seuils)
     if 'Jours_Retard' in df.columns:
-        approche_60j = df[
-            (df['Jours_Retard'] >= 45) & (df['Jours_Retard'] <= 60) &
-            (df['Encaissement'] != 'OUI')
-        ]
-        for _, facture in approche_60j.head(10).iterrows():
-            actions['surveillance'].append({
-                'facture': facture['N° Facture'],
-                'client': facture['Client'],
-                'montant': facture[' T.T.C '] if ' T.T.C ' in facture else None,
-                'jours_retard': facture['Jours_Retard'],
-                'action': 'PRÉVENTIF - Relance avant passage retard exagéré'
-            })
+        approche = df['Jours_Retard'].between(seuil_min, seuil_max)
+        if unpaid is not None:
+            approche &= unpaid
+        actions['surveillance'] = _action_records(
+            _top(df[approche], top_n, [' T.T.C ', 'Jours_Retard']), INVOICE_ACTION_COLUMNS,
+            'PRÉVENTIF - Relance avant passage retard exagéré'
+        )
     return actions
 
+def kpi_engine(df, cube=None):
+    """
+    Moteur de KPIs du dataset (totals, by) : requêtes Polars si le backend Polars est actif,
+    sinon kpis.KpiEngine, sur le cube d'agrégats s'il est fourni (cf. cube.InvoiceCube).
+    """
+    backend = _polars()
+    if backend is not None:
+        return backend.PolarsKpiEngine(df)
+    return KpiEngine.from_cube(cube) if cube is not None else KpiEngine(df)
+
 def generate_kpis(df):
-    kpis = {}
-    kpis['general'] = {
-        'total_factures': len(df),
-        'total_ttc': round(df[' T.T.C '].sum(), 2) if ' T.T.C ' in df.columns else None,
-        'nb_clients': df['Code Client'].nunique() if 'Code Client' in df.columns else None,
-        'montant_moyen_facture': round(df[' T.T.C '].mean(), 2) if ' T.T.C ' in df.columns else None
-    }
-    kpis['retards'] = {
-        'factures_dans_delais': int((df['Catégorie_Règle'] == 'Pas de retard').sum()) if 'Catégorie_Règle' in df.columns else None,
-        'factures_retard_simple': int((df['Catégorie_Règle'] == 'Retard').sum()) if 'Catégorie_Règle' in df.columns else None,
-        'factures_retard_exagere': int((df['Catégorie_Règle'] == 'Retard exagéré').sum()) if 'Catégorie_Règle' in df.columns else None,
-        'taux_retard_global': float(df['Est_En_Retard'].mean()*100) if 'Est_En_Retard' in df.columns else None
-    }
+    """
+    KPIs généraux / retards / temporels (dictionnaire) et factures impayées.
+    Calcul en une passe par kpis.KpiEngine, qui permet aussi les découpages par client, mois ou catégorie.
+    """
+    backend = _polars()
+    kpis = backend.generate_kpis(df) if backend is not None else KpiEngine(df).totals().to_dict()
     factures_impayees = df[df['Encaissement'] != 'OUI'] if 'Encaissement' in df.columns else df
-    kpis['temporel'] = {
-        'factures_impayees': len(factures_impayees),
-        'montant_impaye': round(factures_impayees[' T.T.C '].sum(), 2) if ' T.T.C ' in factures_impayees.columns else None,
-        'retard_moyen_jours': round(factures_impayees['Jours_Retard'].mean(), 1) if 'Jours_Retard' in factures_impayees.columns else None,
-        'plus_ancien_impaye': float(factures_impayees['Jours_Retard'].max()) if 'Jours_Retard' in factures_impayees.columns and not factures_impayees.empty else None
-    }
-    return kpis, factures_impayees
\ No newline at end of file
+    return kpis, factures_impayees
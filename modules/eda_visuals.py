@@ -3,37 +3,39 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 
-def evolution_retard_moyen_et_taux(df):
-    st.subheader("📈 Évolution du retard moyen et du taux de retard par mois")
-    st.caption("Visualisez la courbe du retard moyen (en jours) et du taux de retard (%), global ou par client.")
+from modules.cube import InvoiceCube, mean_of
 
-    # Sélecteur client
-    clients = ["Tous"] + sorted(df["Client"].dropna().unique())
-    selected_client = st.selectbox("Sélectionnez un client pour filtrer :", clients, key="client_evo_retard")
+def _counts(cube, dimension):
+    # Équivalent de value_counts() sur les factures, lu dans le cube
+    return cube.aggregate([dimension])['n'].sort_values(ascending=False, kind='stable').rename('count')
 
-    # Sous-ensemble selon le client choisi
-    if selected_client != "Tous":
-        df_ = df[df["Client"] == selected_client].copy()
-    else:
-        df_ = df.copy()
+def evolution_retard_moyen_et_taux(df, cube=None):
+    st.subheader("📈 Évolution du retard moyen et du taux de retard par mois")
+    st.caption("Visualisez la courbe du retard moyen (en jours) et du taux de retard (%), global ou par client.")
 
     # Vérification des colonnes nécessaires
     required_cols = ["Date d'Emission", "Jours_Retard", "Est_En_Retard"]
-    if not all(col in df_.columns for col in required_cols):
+    if not all(col in df.columns for col in required_cols):
         st.warning("Colonnes nécessaires manquantes.")
         return
+    cube = cube if cube is not None else InvoiceCube.build(df)
+
+    # Sélecteur client
+    clients = ["Tous"] + sorted(cube.cells["Client"].dropna().unique())
+    selected_client = st.selectbox("Sélectionnez un client pour filtrer :", clients, key="client_evo_retard")
 
-    # Préparation des données temporelles
-    df_ = df_.dropna(subset=["Date d'Emission"])
-    df_["Mois_Emission"] = pd.to_datetime(df_["Date d'Emission"]).dt.to_period('M').astype(str)
+    # Sous-cube selon le client choisi
+    if selected_client != "Tous":
+        cube = cube.select(cube.cells["Client"] == selected_client)
 
-    # Agrégation par mois
-    grouped = df_.groupby("Mois_Emission").agg(
-        Retard_moyen=("Jours_Retard", "mean"),
-        Taux_retard=("Est_En_Retard", "mean"),
-        Nb_factures=("Jours_Retard", "count")
-    ).reset_index()
-    grouped["Taux_retard"] = grouped["Taux_retard"] * 100  # passage en %
+    # Agrégation par mois d'émission (factures sans date exclues)
+    by_month = cube.aggregate(["Mois"])
+    grouped = pd.DataFrame({
+        "Mois_Emission": by_month.index.astype(str),
+        "Retard_moyen": mean_of(by_month, "retard").to_numpy(),
+        "Taux_retard": mean_of(by_month, "en_retard").to_numpy() * 100,  # passage en %
+        "Nb_factures": by_month["retard_n"].to_numpy(),
+    })
 
     # Plotly : double axe Y
     fig = go.Figure()
@@ -75,7 +77,13 @@ def evolution_retard_moyen_et_taux(df):
     st.dataframe(grouped[["Mois_Emission", "Nb_factures"]])
 
 
-def display_eda(df):
+def display_eda(df, cube=None):
+    """
+    - cube : cube.InvoiceCube de df (construit si absent) ; tous les agrégats affichés
+      en sont tirés, seul l'histogramme des retards lit les factures.
+    """
+    cube = cube if cube is not None else InvoiceCube.build(df)
+    unpaid_cube = cube.select(cube.cells['Encaissement'] != 'OUI') if 'Encaissement' in cube.cells.columns else cube
     st.title("Analyse exploratoire des retards de paiement")
     st.caption("Visualisations dynamiques pour explorer votre portefeuille de factures.")
 
@@ -88,15 +96,18 @@ def display_eda(df):
     )
     if 'Encaissement' in df.columns and show_only_unpaid == "Seulement les impayées":
         data_plot = df[df['Encaissement'] != 'OUI']
+        cube_plot = unpaid_cube
     else:
-        data_plot = df.copy()
+        data_plot = df
+        cube_plot = cube
 
     # --------- Diagnostic : diversité des catégories (avant et après filtre) -------------
     st.markdown("**Diagnostic des catégories de retard**")
-    st.write("Catégories présentes dans TOUTES les factures :", df['Catégorie_Règle'].value_counts())
-    st.write("Catégories présentes dans ce sous-ensemble :", data_plot['Catégorie_Règle'].value_counts())
-    if data_plot['Catégorie_Règle'].nunique() == 1:
-        st.warning(f"Attention : une seule catégorie détectée dans ce sous-ensemble ({data_plot['Catégorie_Règle'].unique()[0]}).")
+    subset_counts = _counts(cube_plot, 'Catégorie_Règle')
+    st.write("Catégories présentes dans TOUTES les factures :", _counts(cube, 'Catégorie_Règle'))
+    st.write("Catégories présentes dans ce sous-ensemble :", subset_counts)
+    if len(subset_counts) == 1:
+        st.warning(f"Attention : une seule catégorie détectée dans ce sous-ensemble ({subset_counts.index[0]}).")
 
     st.divider()
 
@@ -128,7 +139,7 @@ def display_eda(df):
         if col not in df.columns:
             st.info("Pas assez d'informations clients pour ce graphique.")
             return
-    top_clients = df.groupby(['Code Client', 'Client'])[' T.T.C '].sum().nlargest(10).reset_index()
+    top_clients = cube.aggregate(['Code Client', 'Client'])['ttc'].nlargest(10).rename(' T.T.C ').reset_index()
     if not top_clients.empty:
         fig2 = px.bar(
             top_clients,
@@ -150,7 +161,7 @@ def display_eda(df):
     if 'Classification' in df.columns and 'Code Client' in df.columns:
         st.subheader("🧩 Répartition des clients par niveau de risque")
         st.caption("Pie chart des clients classés selon leur niveau de risque (normal, surveillance, haut risque, blocage).")
-        pie_data = df.groupby('Classification')['Code Client'].nunique().reset_index()
+        pie_data = df.groupby('Classification', observed=True)['Code Client'].nunique().reset_index()
         pie_data = pie_data.rename(columns={'Code Client': 'Nb Clients'})
         fig_pie = px.pie(
             pie_data, names='Classification', values='Nb Clients',
@@ -167,7 +178,7 @@ def display_eda(df):
 
     # --------- Evolution du retard moyen & taux de retard (nouveau) -------------
     if all(col in df.columns for col in ["Date d'Emission", "Jours_Retard", "Est_En_Retard", "Client"]):
-        evolution_retard_moyen_et_taux(df)
+        evolution_retard_moyen_et_taux(df, cube)
 
     st.divider()
 
@@ -175,9 +186,9 @@ def display_eda(df):
     if all(col in df.columns for col in [" T.T.C ", "Encaissement"]):
         st.subheader("💧 Cascade de recouvrement")
         st.caption("Waterfall chart illustrant la décomposition du total facturé en parts payées et impayées.")
-        total = df[" T.T.C "].sum()
-        paye = df[df['Encaissement'] == 'OUI'][" T.T.C "].sum()
-        impaye = total - paye
+        total = cube.total("ttc")
+        impaye = unpaid_cube.total("ttc")
+        paye = total - impaye
         fig_waterfall = go.Figure(go.Waterfall(
             x=["Total Facturé", "Payé", "Impayé"],
             y=[total, -paye, -impaye],
@@ -197,7 +208,7 @@ def display_eda(df):
     if 'Est_En_Retard' in df.columns:
         st.subheader("⏰ Taux global de retard")
         st.caption("Indicateur du pourcentage de factures en retard sur l'ensemble du portefeuille.")
-        taux = df['Est_En_Retard'].mean() * 100
+        taux = mean_of(cube.aggregate(), 'en_retard') * 100
         fig_gauge = go.Figure(go.Indicator(
             mode="gauge+number",
             value=taux,
@@ -224,12 +235,13 @@ def display_eda(df):
     if "N° Facture" in df.columns and "Est_En_Retard" in df.columns and "Client" in df.columns:
         st.subheader("📋 Analyse dynamique du risque client")
         st.caption(f"Profilage automatique : clients avec au moins {seuil_min} factures, classement haut risque ≥{seuil_haut}%, moyen risque ≥{seuil_moyen}%")
-        client_profiles = df.groupby("Client").agg(
-            Nb_factures_total=('N° Facture', 'count'),
-            Nb_factures_retard=('Est_En_Retard', 'sum'),
-            Retard_moyen=('Jours_Retard', 'mean'),
-            CA_total=(' T.T.C ', 'sum')
-        ).reset_index()
+        by_client = cube.aggregate(["Client"])
+        client_profiles = pd.DataFrame({
+            'Nb_factures_total': by_client['n_factures'],
+            'Nb_factures_retard': by_client['en_retard'].astype('int64'),
+            'Retard_moyen': mean_of(by_client, 'retard'),
+            'CA_total': by_client['ttc'],
+        }).reset_index()
         client_profiles['Taux_retard'] = 100 * client_profiles['Nb_factures_retard'] / client_profiles['Nb_factures_total']
         filtered = client_profiles[client_profiles['Nb_factures_total'] >= seuil_min]
         st.markdown("**Clients analysés (filtrage automatique)**")
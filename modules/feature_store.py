@@ -0,0 +1,168 @@
+"""
+Feature store des historiques clients (features glissantes de ml_predict, cf. rolling) :
+pour chaque Code Client, seules les factures qui peuvent encore entrer dans une fenêtre
+sont conservées (les N dernières, N = plus grande fenêtre en nombre de factures, et
+celles des D derniers jours d'émission, D = plus grande fenêtre calendaire), avec les
+colonnes nécessaires à leur vieillissement (cf. data_processing.reage_open_invoices).
+Scorer de nouvelles factures ne relit que ces fins d'historique et les met à jour :
+coût proportionnel aux nouvelles lignes, et non à tout l'historique des clients.
+Fichier stocké avec le stock des factures (invoice_store), vidé avec lui ; reconstruit
+à la demande à partir d'un historique complet (rebuild, cf. pipeline --feature-store).
+"""
+import numpy as np
+import pandas as pd
+
+from modules import data_processing
+from modules.invoice_store import FEATURES_FILE, KEY, PROCESSED_ON, STORE_DIR
+from modules.parquet_store import read_parquet, write_parquet
+from modules.rolling import client_order, client_window_features
+from utils.utils import as_of_date
+
+CLIENT = 'Code Client'
+EMISSION = "Date d'Emission"
+# Colonnes conservées : clé, tri, vieillissement des retards (en plus des colonnes des fenêtres)
+STATE_COLUMNS = [KEY, CLIENT, EMISSION, 'échéance', 'Encaissement', 'Date Encaissement',
+                 'Statut_Détaillé', 'Jours_Retard', 'Catégorie_Règle', 'Est_En_Retard', 'Est_Retard_Exagéré']
+
+
+def _depth(features):
+    # (plus grande fenêtre en factures, plus grande fenêtre calendaire en jours)
+    counts = [w for _, _, w in features.values() if not isinstance(w, str)]
+    spans = [pd.Timedelta(w).days for _, _, w in features.values() if isinstance(w, str)]
+    return max(counts, default=0), max(spans, default=0)
+
+
+def _columns(df, features):
+    wanted = dict.fromkeys(STATE_COLUMNS + [col for col, _, _ in features.values()])
+    return [col for col in wanted if col in df.columns]
+
+
+def _changed_tails(stored, history, features):
+    """
+    Clients dont la fin d'historique stockée ne correspond plus à history : facture supprimée,
+    passée à un autre client ou modifiée (date, colonnes des fenêtres) depuis son stockage.
+    """
+    compared = [col for col in dict.fromkeys([EMISSION] + [col for col, _, _ in features.values()])
+                if col in stored.columns and col in history.columns]
+    keys = stored[KEY].astype(str)
+    current = history[[KEY, CLIENT] + compared]
+    current = current[current[KEY].astype(str).isin(keys).to_numpy()]
+    current = current.set_index(current[KEY].astype(str)).pipe(lambda d: d[~d.index.duplicated(keep='last')])
+    aligned = current.reindex(keys)
+    differs = aligned[KEY].isna().to_numpy() | (aligned[CLIENT].astype(str).to_numpy() != stored[CLIENT].to_numpy())
+    for col in compared:
+        if col == EMISSION:
+            old = pd.to_datetime(stored[col], errors='coerce', cache=False).to_numpy()
+            new = pd.to_datetime(aligned[col], errors='coerce', cache=False).to_numpy()
+        else:
+            old = pd.to_numeric(stored[col], errors='coerce').to_numpy(dtype=float)
+            new = pd.to_numeric(aligned[col], errors='coerce').to_numpy(dtype=float)
+        differs |= ~((old == new) | (pd.isna(old) & pd.isna(new)))
+    return pd.Index(stored.loc[differs, CLIENT].unique())
+
+
+def tails(df, features):
+    """Fins d'historique de chaque client (lignes de df utiles aux fenêtres des factures à venir)."""
+    count, span = _depth(features)
+    order, starts = client_order(df[CLIENT], df[EMISSION])
+    n = len(order)
+    if not n:
+        return df.iloc[:0]
+    blocks = np.unique(starts)
+    sizes = np.diff(np.r_[blocks, n])
+    days = pd.to_datetime(df[EMISSION], errors='coerce', cache=False).to_numpy()[order].astype('datetime64[D]').view('int64')
+    dated = days != np.iinfo('int64').min
+    # Rang depuis la fin du client et dernier jour d'émission du client
+    from_end = np.repeat(blocks + sizes - 1, sizes) - np.arange(n)
+    last_day = np.repeat(np.maximum.reduceat(days, blocks), sizes)
+    keep = from_end < count
+    if span:
+        keep |= days > last_day - span
+    # Dates manquantes : hors des fenêtres des factures à venir
+    return df.iloc[order[keep & dated]]
+
+
+def rebuild(df, features, as_of=None, store_dir=STORE_DIR):
+    """Reconstruit le feature store à partir de l'historique complet df (traité pour as_of)."""
+    state = tails(df[_columns(df, features)], features).assign(**{PROCESSED_ON: as_of_date(as_of)})
+    write_parquet(state, store_dir, FEATURES_FILE)
+    return len(state)
+
+
+def update(df, features, as_of=None, history=None, store_dir=STORE_DIR):
+    """
+    Features glissantes des factures de df (traitées pour as_of) à partir des fins d'historique
+    stockées de leurs clients, puis mise à jour du store (factures de df ajoutées ou remplacées,
+    même N° Facture). Un client est recalculé à partir de `history` (historique complet, ex. le
+    dataset traité) si l'une de ses nouvelles factures est antérieure à sa fin d'historique,
+    s'il est absent du store ou si sa fin d'historique ne correspond plus à history (facture
+    supprimée ou modifiée sur place) : résultat identique à client_window_features sur
+    history. Sans history, seule la fin d'historique stockée est utilisée (factures
+    antérieures : stats['approchees'], modifications sur place non détectées).
+    Retourne (dict nom -> tableau aligné sur df, stats).
+    """
+    as_of = as_of_date(as_of)
+    if KEY not in df.columns:
+        return client_window_features(df, features, client=CLIENT, date=EMISSION), {'clients': 0, 'reconstruits': 0, 'approchees': 0}
+    columns = _columns(df, features)
+    new = df[columns].reset_index(drop=True).assign(_pos=np.arange(len(df)))
+    new = new[new[CLIENT].notna()]
+    result = {name: np.full(len(df), np.nan) for name in features}
+    stats = {'clients': 0, 'reconstruits': 0, 'approchees': 0}
+    if new.empty:
+        return result, stats
+    # Codes clients en texte : même regroupement pour le store (Parquet) et les nouvelles lignes
+    new[CLIENT] = new[CLIENT].astype(str)
+    clients = pd.Index(new[CLIENT].unique())
+    stats['clients'] = len(clients)
+    store = read_parquet(store_dir, FEATURES_FILE)
+    if store is None or store.empty or CLIENT not in store.columns:
+        store = pd.DataFrame(columns=columns + [PROCESSED_ON])
+    concerned = store[CLIENT].astype(str).isin(clients).to_numpy()
+    replaced = store[KEY].astype(str).isin(new[KEY].astype(str)).to_numpy()
+    stored = store[concerned & ~replaced].copy()
+    # Fins d'historique traitées pour une autre date : vieillies comme le stock des factures
+    stale = (stored[PROCESSED_ON] != as_of).to_numpy()
+    if stale.any():
+        aged = stored[stale].copy()
+        data_processing.reage_open_invoices(aged, as_of)
+        stored = pd.concat([stored[~stale], aged]) if not stale.all() else aged
+    stored = stored.drop(columns=PROCESSED_ON).assign(_pos=-1)
+    stored[CLIENT] = stored[CLIENT].astype(str)
+    # Nouvelles factures antérieures à la fin d'historique de leur client (ou factures
+    # remplacées du même jour : leur place parmi les factures de ce jour est inconnue)
+    last = pd.to_datetime(stored[EMISSION], cache=False).groupby(stored[CLIENT]).max()
+    emission = pd.to_datetime(new[EMISSION], errors='coerce', cache=False)
+    last = new[CLIENT].map(last)
+    known = new[KEY].astype(str).isin(store.loc[replaced, KEY].astype(str))
+    late = ((emission < last) | (known & (emission == last))).to_numpy()
+    rebuilt = pd.Index(new.loc[late, CLIENT].unique())
+    parts = [stored, new]
+    if history is not None and CLIENT in history.columns:
+        # Clients sans fin d'historique stockée (store vidé ou nouveaux) : repris de history
+        rebuilt = rebuilt.union(clients.difference(pd.Index(store.loc[concerned, CLIENT].astype(str).unique())))
+        # Fin d'historique périmée (facture antérieure supprimée ou modifiée sur place)
+        if not stored.empty and KEY in history.columns:
+            rebuilt = rebuilt.union(_changed_tails(stored, history, features))
+    if len(rebuilt) and history is not None and CLIENT in history.columns:
+        full = history[_columns(history, features)].reset_index(drop=True)
+        full = full[full[CLIENT].astype(str).isin(rebuilt).to_numpy()]
+        full[CLIENT] = full[CLIENT].astype(str)
+        # Factures de df présentes dans history : gardées à leur place (ordre des dates égales)
+        positions = new.drop_duplicates(KEY, keep='last').set_index(new[KEY].astype(str).drop_duplicates(keep='last'))['_pos']
+        full['_pos'] = full[KEY].astype(str).map(positions).fillna(-1).astype('int64').to_numpy()
+        # Historique complet des clients recalculés (remplace leur fin d'historique)
+        parts = [stored[~stored[CLIENT].isin(rebuilt).to_numpy()], full, new[~new['_pos'].isin(full['_pos']).to_numpy()]]
+        stats['reconstruits'] = len(rebuilt)
+    else:
+        stats['approchees'] = int(late.sum())
+    context = pd.concat([part for part in parts if not part.empty], ignore_index=True)
+    computed = client_window_features(context, features, client=CLIENT, date=EMISSION)
+    positions = context['_pos'].to_numpy()
+    rows = positions >= 0
+    for name, values in computed.items():
+        result[name][positions[rows]] = values[rows]
+    state = tails(context.drop(columns='_pos'), features).assign(**{PROCESSED_ON: as_of})
+    kept = store[~concerned]
+    write_parquet(pd.concat([kept, state], ignore_index=True) if not kept.empty else state, store_dir, FEATURES_FILE)
+    return result, stats
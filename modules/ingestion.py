@@ -0,0 +1,311 @@
+import csv
+import glob
+import importlib.util
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from openpyxl import load_workbook
+
+from modules import schema as invoice_schema
+from utils.utils import COLUMN_MAPPING, harmonize_columns
+
+PYARROW_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+
+DEFAULT_CHUNKSIZE = 50_000
+SUPPORTED_FORMATS = ["xlsx", "csv", "parquet", "feather"]
+DATE_COLS = ["Date d'Emission", 'échéance', 'Date Encaissement']
+INVOICE_KEY = 'N° Facture'
+
+_EXTENSIONS = {
+    ".xlsx": "xlsx", ".xlsm": "xlsx",
+    ".csv": "csv", ".txt": "csv",
+    ".parquet": "parquet", ".pq": "parquet",
+    ".feather": "feather", ".arrow": "feather",
+}
+
+
+def detect_format(source, name=None):
+    """
+    Détermine le format d'un fichier de factures (xlsx, csv, parquet ou feather),
+    d'après l'extension de `name` (ou du chemin), sinon d'après sa signature binaire.
+    """
+    if name is None and isinstance(source, (str, os.PathLike)):
+        name = os.fspath(source)
+    if name:
+        fmt = _EXTENSIONS.get(os.path.splitext(name)[1].lower())
+        if fmt:
+            return fmt
+    head = _peek(source, 8)
+    if head.startswith(b"PK"):
+        return "xlsx"
+    if head.startswith(b"PAR1"):
+        return "parquet"
+    if head.startswith(b"ARROW1"):
+        return "feather"
+    return "csv"
+
+
+def _peek(source, size):
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            return f.read(size)
+    pos = source.tell()
+    head = source.read(size)
+    source.seek(pos)
+    return head if isinstance(head, bytes) else head.encode()
+
+
+def _csv_separator(source):
+    sample = _peek(source, 64 * 1024).decode("utf-8", errors="ignore")
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=";,\t|").delimiter
+    except csv.Error:
+        return ","
+
+
+def _parse_csv_dates(df, mapping):
+    # Dates exportées en texte (format FR jj/mm/aaaa) : même typage que la lecture Excel
+    for col in df.columns:
+        if mapping.get(col, col) in DATE_COLS and df[col].dtype == object:
+            df[col] = pd.to_datetime(df[col], dayfirst=True, errors='coerce')
+    return df
+
+
+def read_header(source, fmt):
+    """En-têtes (bruts) d'un fichier de factures, sans lire les données."""
+    if fmt == "xlsx":
+        pos = None if isinstance(source, (str, os.PathLike)) else source.tell()
+        wb = load_workbook(source, read_only=True, data_only=True)
+        try:
+            header = next(wb.worksheets[0].iter_rows(max_row=1, values_only=True), ())
+        finally:
+            wb.close()
+            if pos is not None:
+                source.seek(pos)
+        return [str(col) if col is not None else f"Unnamed: {i}" for i, col in enumerate(header)]
+    if fmt == "csv":
+        sep = _csv_separator(source)
+        first_line = _peek(source, 64 * 1024).decode("utf-8", errors="ignore").splitlines()[:1]
+        return next(csv.reader(first_line, delimiter=sep), [])
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+    pos = None if isinstance(source, (str, os.PathLike)) else source.tell()
+    names = pq.read_schema(source).names if fmt == "parquet" else ipc.open_file(source).schema.names
+    if pos is not None:
+        source.seek(pos)
+    return names
+
+
+def load_invoices(source, fmt=None, name=None, mapping=COLUMN_MAPPING, schema=None):
+    """
+    Point d'entrée unique de chargement des factures (app, scripts, notebooks).
+    - source : chemin ou objet fichier binaire (ex. io.BytesIO d'un fichier importé)
+    - fmt : 'xlsx', 'csv', 'parquet' ou 'feather' (détecté automatiquement si absent)
+    - name : nom du fichier d'origine, utilisé pour la détection du format
+    - schema : registre des colonnes attendues (ex. schema.INVOICE_SCHEMA) ; si fourni,
+      seules ces colonnes sont lues, directement typées. Sinon toutes les colonnes sont lues.
+    Retourne le DataFrame brut aux colonnes harmonisées, tel qu'attendu par clean_and_prepare.
+    """
+    fmt = fmt or detect_format(source, name)
+    options = {}
+    if schema is not None:
+        options = invoice_schema.reader_options(read_header(source, fmt), fmt, schema, mapping)
+    if fmt == "xlsx":
+        df = pd.read_excel(source, **options)
+    elif fmt == "csv":
+        df = pd.read_csv(
+            source, sep=_csv_separator(source),
+            engine="pyarrow" if PYARROW_AVAILABLE else "c", **options
+        )
+        df = _parse_csv_dates(df, mapping)
+    elif fmt == "parquet":
+        df = pd.read_parquet(source, **options)
+    elif fmt == "feather":
+        df = pd.read_feather(source, **options)
+    else:
+        raise ValueError(f"Format non supporté : {fmt} (formats acceptés : {', '.join(SUPPORTED_FORMATS)})")
+    df = harmonize_columns(df, mapping)
+    return invoice_schema.conform(df, schema) if schema is not None else df
+
+
+def iter_chunks(source, fmt=None, name=None, chunksize=DEFAULT_CHUNKSIZE, mapping=COLUMN_MAPPING, schema=None):
+    """Lecture par blocs, quel que soit le format (voir iter_excel_chunks et load_invoices pour `schema`)."""
+    fmt = fmt or detect_format(source, name)
+    for chunk in _iter_raw_chunks(source, fmt, chunksize, mapping):
+        yield invoice_schema.conform(chunk, schema) if schema is not None else chunk
+
+
+def _iter_raw_chunks(source, fmt, chunksize, mapping):
+    if fmt == "xlsx":
+        yield from iter_excel_chunks(source, chunksize, mapping)
+    elif fmt == "csv":
+        reader = pd.read_csv(source, sep=_csv_separator(source), chunksize=chunksize)
+        for chunk in reader:
+            yield harmonize_columns(_parse_csv_dates(chunk, mapping), mapping)
+    elif fmt == "parquet":
+        import pyarrow.parquet as pq
+        start = 0
+        for batch in pq.ParquetFile(source).iter_batches(batch_size=chunksize):
+            chunk = batch.to_pandas()
+            chunk.index = pd.RangeIndex(start, start + len(chunk))
+            start += len(chunk)
+            yield harmonize_columns(chunk, mapping)
+    else:
+        yield load_invoices(source, fmt=fmt, mapping=mapping)
+
+
+def iter_excel_chunks(source, chunksize=DEFAULT_CHUNKSIZE, mapping=COLUMN_MAPPING):
+    """
+    Lit la première feuille d'un classeur Excel en mode streaming (openpyxl read-only)
+    et produit des DataFrames de `chunksize` lignes, colonnes déjà harmonisées.
+    L'index est continu d'un bloc à l'autre, comme avec pd.read_excel.
+    - source : chemin ou objet fichier (ex. io.BytesIO)
+    """
+    wb = load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [
+            str(col) if col is not None else f"Unnamed: {i}"
+            for i, col in enumerate(header)
+        ]
+        start = 0
+        buffer = []
+        for row in rows:
+            buffer.append(row)
+            if len(buffer) >= chunksize:
+                yield _to_frame(buffer, columns, start, mapping)
+                start += len(buffer)
+                buffer = []
+        if buffer:
+            yield _to_frame(buffer, columns, start, mapping)
+    finally:
+        wb.close()
+
+
+def _to_frame(rows, columns, start, mapping):
+    df = pd.DataFrame.from_records(rows, columns=columns)
+    df.index = pd.RangeIndex(start, start + len(df))
+    return harmonize_columns(df, mapping)
+
+
+def _load_timed(job):
+    # Exécuté dans un processus du pool : source = chemin ou contenu brut (bytes)
+    source, name, schema = job
+    start = time.perf_counter()
+    df = load_invoices(io.BytesIO(source) if isinstance(source, bytes) else source, name=name, schema=schema)
+    return df, time.perf_counter() - start
+
+
+def parse_files(sources, names=None, max_workers=None, schema=None):
+    """
+    Lit plusieurs fichiers en parallèle (un processus par fichier, au plus `max_workers`).
+    - sources : chemins ou contenus bruts (bytes)
+    - names : noms d'origine (détection du format pour les contenus bruts)
+    Retourne la liste [(df, durée_s), ...] dans l'ordre des sources.
+    """
+    names = names or [s if isinstance(s, (str, os.PathLike)) else None for s in sources]
+    jobs = [(source, name, schema) for source, name in zip(sources, names)]
+    if len(jobs) <= 1 or max_workers == 1:
+        return [_load_timed(job) for job in jobs]
+    workers = min(len(jobs), max_workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_load_timed, jobs))
+
+
+def drop_duplicate_invoices(df, key=INVOICE_KEY):
+    """Supprime les factures en double (même N° Facture), en gardant la dernière occurrence."""
+    if key not in df.columns:
+        return df
+    duplicated = df[key].notna() & df.duplicated(subset=key, keep='last')
+    return df[~duplicated] if duplicated.any() else df
+
+
+def numbered_chunks(sources, keys, key=INVOICE_KEY):
+    """
+    Blocs de plusieurs fichiers lus par blocs (un itérateur par fichier, dans l'ordre d'import),
+    renumérotés en continu : index = position de la ligne brute dans l'ensemble des fichiers.
+    Le N° Facture de chaque ligne brute est ajouté à `keys` (liste) avant tout nettoyage,
+    pour dédoublonner ensuite comme combine (cf. keep_last_invoices).
+    """
+    start = 0
+    for chunks in sources:
+        for chunk in chunks:
+            chunk.index = pd.RangeIndex(start, start + len(chunk))
+            start += len(chunk)
+            # Copie : le bloc est ensuite nettoyé en place (clean_and_prepare_stream)
+            keys.append(chunk[key].copy() if key in chunk.columns else pd.Series(None, index=chunk.index, dtype=object))
+            yield chunk
+
+
+def keep_last_invoices(df, keys):
+    """
+    Lignes nettoyées de df (index = positions brutes, cf. numbered_chunks) qui sont la dernière
+    occurrence brute de leur N° Facture, lignes rejetées comprises : même résultat que
+    combine (dédoublonnage avant le nettoyage) suivi de clean_and_prepare. Une facture dont
+    la dernière version est rejetée n'est donc pas remplacée par une version précédente.
+    """
+    if not keys:
+        return df
+    raw = pd.concat(keys)
+    last = (raw.isna() | ~raw.duplicated(keep='last')).to_numpy()
+    return df[last[df.index.to_numpy()]]
+
+
+def combine(frames, names, durations=None, key=INVOICE_KEY):
+    """
+    Concatène les fichiers lus (dans l'ordre : en cas de doublon, le fichier le plus
+    récent doit être le dernier) et dédoublonne sur le N° Facture.
+    Retourne (df, rapport) avec, par fichier, le nombre de lignes et la durée de lecture.
+    """
+    report = pd.DataFrame({
+        "Fichier": [os.path.basename(os.fspath(n)) if n else f"fichier {i + 1}" for i, n in enumerate(names)],
+        "Lignes": [len(f) for f in frames],
+        "Durée (s)": [round(d, 3) for d in durations] if durations is not None else None,
+    })
+    if not frames:
+        return pd.DataFrame(), report
+    df = pd.concat(frames, ignore_index=True)
+    df.attrs['montants_invalides'] = invoice_schema.merge_invalid_amounts(frames)
+    before = len(df)
+    df = drop_duplicate_invoices(df, key).reset_index(drop=True)
+    report.attrs['doublons_supprimes'] = before - len(df)
+    return df, report
+
+
+def load_many(sources, names=None, max_workers=None, schema=None):
+    """Lecture parallèle + harmonisation + dédoublonnage de plusieurs fichiers. Retourne (df, rapport)."""
+    names = names or [s if isinstance(s, (str, os.PathLike)) else None for s in sources]
+    results = parse_files(sources, names, max_workers, schema)
+    return combine([df for df, _ in results], names, [d for _, d in results])
+
+
+def list_invoice_files(directory):
+    """Fichiers de factures d'un dossier (formats supportés), triés par nom."""
+    paths = sorted(glob.glob(os.path.join(directory, "*")))
+    return [p for p in paths if os.path.isfile(p) and os.path.splitext(p)[1].lower() in _EXTENSIONS]
+
+
+def load_directory(directory, max_workers=None, schema=None):
+    """Mode dossier (scripts) : charge tous les fichiers de factures d'un dossier. Retourne (df, rapport)."""
+    return load_many(list_invoice_files(directory), max_workers=max_workers, schema=schema)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Chargement parallèle d'un dossier de fichiers de factures")
+    parser.add_argument("directory")
+    parser.add_argument("-j", "--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    df, report = load_directory(args.directory, max_workers=args.workers)
+    print(report.to_string(index=False))
+    print(f"Total : {len(df)} factures ({report.attrs.get('doublons_supprimes', 0)} doublons supprimés) "
+          f"en {time.perf_counter() - start:.2f} s")
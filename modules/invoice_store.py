@@ -0,0 +1,189 @@
+import os
+
+import numpy as np
+import pandas as pd
+from pandas.util import hash_pandas_object
+
+from modules import data_processing
+from modules.rolling import client_order
+from modules.parquet_store import read_parquet, store_path, write_parquet
+from modules.upload_cache import BASE_DIR
+from utils.utils import as_of_date
+
+# Stock persistant des factures déjà traitées (règles de retard) et déjà scorées (ML)
+STORE_DIR = os.path.join(BASE_DIR, "cache", "invoice_store")
+PROCESSED_FILE = "processed.parquet"
+SCORES_FILE = "scores.parquet"
+FEATURES_FILE = "features.parquet"  # fins d'historique des clients (cf. feature_store)
+
+KEY = 'N° Facture'
+FINGERPRINT = '_empreinte'
+PROCESSED_ON = '_traitee_le'  # date de référence (as_of) du traitement / du scoring
+# Colonnes qui déterminent le score ML d'une facture traitée
+SCORED_COLUMNS = [
+    KEY, 'Code Client', 'Client', "Date d'Emission", 'échéance', 'Date Encaissement', 'Encaissement',
+    ' H.T ', ' T.V.A ', ' T.R ', ' T.T.C ', ' Caution ', 'Jours_Retard', 'Catégorie_Règle',
+]
+
+
+def row_fingerprints(df, columns=None):
+    """Empreinte (uint64) de chaque ligne : change dès qu'une valeur de la ligne change."""
+    if columns is not None:
+        df = df[[col for col in columns if col in df.columns]]
+    return hash_pandas_object(df, index=False)
+
+
+def client_history_fingerprints(df, fingerprints, client='Code Client', date="Date d'Emission"):
+    """
+    Empreinte de chaque ligne combinée à celles des factures qui la précèdent chez le même
+    client (ordre client, date des features glissantes, cf. rolling.client_order) : elle change
+    dès qu'une facture antérieure du client est ajoutée, modifiée ou supprimée.
+    Lignes sans client (ou sans ces colonnes) : empreinte de la ligne seule.
+    """
+    if client not in df.columns or date not in df.columns:
+        return fingerprints
+    order, starts = client_order(df[client], df[date])
+    own = fingerprints.to_numpy(dtype='uint64')
+    values = own[order]
+    # Somme des empreintes du client jusqu'à la ligne exclue (modulo 2**64)
+    cumulated = np.cumsum(values) - values
+    previous = cumulated - cumulated[starts]
+    combined = own.copy()
+    combined[order] = hash_pandas_object(pd.DataFrame({'ligne': values, 'avant': previous}), index=False).to_numpy()
+    return pd.Series(combined, index=fingerprints.index)
+
+
+def _merge_into_store(store, rows):
+    """Remplace dans le stock les factures présentes dans `rows` (même N° Facture) et ajoute les nouvelles."""
+    if store is None or store.empty:
+        return rows
+    # N° Facture comparé en texte, comme dans _match (stock Parquet : type éventuellement converti)
+    kept = store[~store[KEY].astype(str).isin(rows[KEY].astype(str)).to_numpy()]
+    return pd.concat([kept, rows], ignore_index=True) if not kept.empty else rows.reset_index(drop=True)
+
+
+def _match(df, fingerprints, store, columns):
+    """
+    Lignes du stock correspondant aux lignes de df (même N° Facture et même empreinte),
+    réindexées sur l'index de df.
+    """
+    # N° Facture comparé en texte : le stock Parquet peut l'avoir converti (cf. arrow_safe)
+    current = pd.DataFrame({'_cle': df[KEY].astype(str).to_numpy(), FINGERPRINT: fingerprints.to_numpy(),
+                            '_pos': np.arange(len(df))})
+    store = store.assign(_cle=store[KEY].astype(str)).drop_duplicates(['_cle', FINGERPRINT], keep='last')
+    matched = current.merge(store[['_cle', FINGERPRINT] + columns], on=['_cle', FINGERPRINT], how='inner')
+    matched.index = df.index[matched.pop('_pos').to_numpy()]
+    return matched[columns]
+
+
+def _fresh_only(store, as_of):
+    # Stock limité aux lignes calculées pour la même date de référence
+    if store is None or store.empty:
+        return None
+    return store[store[PROCESSED_ON] == as_of]
+
+
+def process_incremental(df_raw, store_dir=STORE_DIR, as_of=None):
+    """
+    Nettoyage + règles de retard incrémentaux : seules les factures nouvelles ou modifiées
+    depuis le dernier import (N° Facture + empreinte de la ligne brute) passent par
+    clean_and_prepare ; les autres sont reprises du stock. Les factures non encaissées
+    traitées pour une autre date de référence sont seulement vieillies
+    (data_processing.reage_open_invoices), sans repasser par le nettoyage.
+    Retourne (df_processed, stats) ; df_processed est identique à clean_and_prepare(df_raw, as_of).
+    stats['categorie_changee'] : N° Facture reprises dont la catégorie a changé en vieillissant.
+    """
+    as_of = as_of_date(as_of)
+    if KEY not in df_raw.columns:
+        return data_processing.clean_and_prepare(df_raw, as_of), {'reprises': 0, 'traitees': len(df_raw), 'categorie_changee': []}
+    fingerprints = row_fingerprints(df_raw)
+    store = read_parquet(store_dir, PROCESSED_FILE)
+    reused = pd.DataFrame()
+    changed = []
+    if store is not None and not store.empty:
+        reused = _match(df_raw, fingerprints, store, [col for col in store.columns if col != FINGERPRINT])
+        reused[FINGERPRINT] = fingerprints[reused.index]
+        # Factures traitées pour une autre date : seules les non encaissées vieillissent
+        stale = (reused[PROCESSED_ON] != as_of).to_numpy()
+        if stale.any():
+            aged = reused[stale].copy()
+            changed = aged.loc[data_processing.reage_open_invoices(aged, as_of), KEY].tolist()
+            aged[PROCESSED_ON] = as_of
+            reused = pd.concat([reused[~stale], aged]) if not stale.all() else aged
+    todo = ~df_raw.index.isin(reused.index)
+    fresh = data_processing.clean_and_prepare(df_raw[todo], as_of) if todo.any() else None
+    parts = [reused]
+    if fresh is not None:
+        parts.append(fresh.assign(**{FINGERPRINT: fingerprints[fresh.index], PROCESSED_ON: as_of}))
+    parts = [part for part in parts if not part.empty]
+    if not parts:
+        return data_processing.clean_and_prepare(df_raw.iloc[:0], as_of), {'reprises': 0, 'traitees': int(todo.sum()), 'categorie_changee': []}
+    result = pd.concat(parts).sort_index()
+    write_parquet(_merge_into_store(store, result), store_dir, PROCESSED_FILE)
+    result = result.drop(columns=[FINGERPRINT, PROCESSED_ON])
+    # Compteurs de montants invalides : lignes nettoyées lors de cet import
+    result.attrs = dict(fresh.attrs) if fresh is not None else {}
+    stats = {'reprises': len(reused), 'traitees': int(todo.sum()), 'categorie_changee': changed}
+    return result, stats
+
+
+def score_incremental(df_processed, score, store_dir=STORE_DIR, as_of=None, features=False):
+    """
+    Scoring ML incrémental : seules les factures dont les données traitées ont changé
+    (nouvelles, modifiées ou dont le retard a évolué), ou dont une facture antérieure du même
+    client a changé (features glissantes, cf. client_history_fingerprints), sont re-scorées ;
+    les autres reprennent leur prédiction stockée. Les features dépendant de la date de référence,
+    seuls les scores calculés pour le même as_of sont réutilisés.
+    - score : fonction (df, as_of) -> df prédit (ex. ml_predict.run_prediction). Elle reçoit
+      les factures à scorer avec tout l'historique de leurs clients (features glissantes).
+      Résultat identique au scoring complet si le score d'une facture ne dépend que de son
+      client (pas d'un modèle sans prétraitement sauvegardé : médianes du lot prédit).
+    - features : historique des clients tenu par le feature store (cf. feature_store) : score
+      reçoit seulement les factures à scorer, avec store_dir et history=df_processed.
+    Retourne (df_preds, stats).
+    """
+    as_of = as_of_date(as_of)
+    if KEY not in df_processed.columns:
+        return score(df_processed, as_of), {'reprises': 0, 'scorees': len(df_processed)}
+    fingerprints = client_history_fingerprints(df_processed, row_fingerprints(df_processed, SCORED_COLUMNS))
+    store = _fresh_only(read_parquet(store_dir, SCORES_FILE), as_of)
+    reused = pd.DataFrame()
+    if store is not None and not store.empty:
+        columns = [col for col in store.columns if col not in (KEY, FINGERPRINT, PROCESSED_ON)]
+        reused = _match(df_processed, fingerprints, store, columns)
+    todo = ~df_processed.index.isin(reused.index)
+    scored = pd.DataFrame()
+    if todo.any():
+        # Contexte : historique complet des clients concernés (features glissantes par client)
+        in_context = todo
+        if 'Code Client' in df_processed.columns and not features:
+            clients = df_processed.loc[todo, 'Code Client'].unique()
+            in_context = df_processed['Code Client'].isin(clients).to_numpy() | todo
+        context = df_processed[in_context]
+        if features:
+            predicted = score(context, as_of, store_dir=store_dir, history=df_processed)
+        else:
+            predicted = score(context, as_of)
+        added = [col for col in predicted.columns if col not in context.columns]
+        if not added:
+            # Modèle indisponible : rien à stocker
+            return predicted, {'reprises': 0, 'scorees': 0}
+        # run_prediction renumérote les lignes : réalignement par position
+        predicted.index = context.index
+        scored = predicted.loc[todo[in_context], added]
+        write_parquet(_merge_into_store(store, scored.assign(**{
+            KEY: df_processed.loc[scored.index, KEY],
+            FINGERPRINT: fingerprints[scored.index],
+            PROCESSED_ON: as_of,
+        })), store_dir, SCORES_FILE)
+    predictions = pd.concat([df for df in (reused, scored) if not df.empty]).reindex(df_processed.index)
+    stats = {'reprises': len(reused), 'scorees': int(todo.sum())}
+    return df_processed.join(predictions), stats
+
+
+def clear_store(store_dir=STORE_DIR):
+    """Supprime le stock (les prochains imports seront entièrement retraités)."""
+    for name in (PROCESSED_FILE, SCORES_FILE, FEATURES_FILE):
+        path = store_path(store_dir, name)
+        if os.path.exists(path):
+            os.remove(path)
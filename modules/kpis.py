@@ -0,0 +1,221 @@
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+# Axes de découpage des KPIs : nom -> colonne source
+DIMENSIONS = {
+    'client': 'Code Client',
+    'mois': "Date d'Emission",
+    'categorie': 'Catégorie_Règle',
+}
+# Mêmes axes sur un cube d'agrégats (cf. cube.InvoiceCube)
+CUBE_DIMENSIONS = dict(DIMENSIONS, mois='Mois')
+# Catégories comptées dans les KPIs de retard (cf. generate_kpis)
+DELAY_KPI_CATEGORIES = {
+    'factures_dans_delais': 'Pas de retard',
+    'factures_retard_simple': 'Retard',
+    'factures_retard_exagere': 'Retard exagéré',
+}
+
+
+@dataclass(frozen=True)
+class GeneralKpis:
+    total_factures: int
+    total_ttc: Optional[float]
+    nb_clients: Optional[int]
+    montant_moyen_facture: Optional[float]
+
+
+@dataclass(frozen=True)
+class DelayKpis:
+    factures_dans_delais: Optional[int]
+    factures_retard_simple: Optional[int]
+    factures_retard_exagere: Optional[int]
+    taux_retard_global: Optional[float]
+
+
+@dataclass(frozen=True)
+class TimeKpis:
+    factures_impayees: int
+    montant_impaye: Optional[float]
+    retard_moyen_jours: Optional[float]
+    plus_ancien_impaye: Optional[float]
+
+
+@dataclass(frozen=True)
+class KpiResult:
+    general: GeneralKpis
+    retards: DelayKpis
+    temporel: TimeKpis
+
+    def to_dict(self):
+        """Même structure que le dictionnaire historique de generate_kpis."""
+        return {'general': asdict(self.general), 'retards': asdict(self.retards), 'temporel': asdict(self.temporel)}
+
+
+def _measures(df):
+    """
+    Mesures additives par facture (une colonne par agrégat nécessaire aux KPIs),
+    calculées une seule fois : tous les KPIs s'en déduisent par une somme (ou un max).
+    """
+    unpaid = (df['Encaissement'] != 'OUI').to_numpy() if 'Encaissement' in df.columns else np.ones(len(df), bool)
+    m = {'n': np.ones(len(df), dtype='int64'), 'unpaid': unpaid.astype('int64')}
+    if ' T.T.C ' in df.columns:
+        ttc = df[' T.T.C '].to_numpy(dtype=float)
+        known = ~np.isnan(ttc)
+        m['ttc'] = np.where(known, ttc, 0.0)
+        m['ttc_n'] = known.astype('int64')
+        m['ttc_unpaid'] = np.where(known & unpaid, ttc, 0.0)
+    if 'Catégorie_Règle' in df.columns:
+        codes = pd.Categorical(df['Catégorie_Règle'], categories=list(DELAY_KPI_CATEGORIES.values())).codes
+        for i, name in enumerate(DELAY_KPI_CATEGORIES):
+            m[name] = (codes == i).astype('int64')
+    if 'Est_En_Retard' in df.columns:
+        late = df['Est_En_Retard'].to_numpy(dtype=float)
+        m['late'] = np.nan_to_num(late)
+        m['late_n'] = (~np.isnan(late)).astype('int64')
+    if 'Jours_Retard' in df.columns:
+        delay = np.where(unpaid, df['Jours_Retard'].to_numpy(dtype=float), np.nan)
+        m['delay_unpaid'] = np.nan_to_num(delay)
+        m['delay_unpaid_n'] = (~np.isnan(delay)).astype('int64')
+        m['delay_unpaid_max'] = delay
+    return pd.DataFrame(m, index=df.index)
+
+
+def _cube_measures(cells):
+    """Mêmes mesures que _measures, déduites des cellules d'un cube (une ligne par cellule)."""
+    unpaid = (cells['Encaissement'] != 'OUI').to_numpy() if 'Encaissement' in cells.columns else np.ones(len(cells), bool)
+    n = cells['n'].to_numpy()
+    m = {'n': n, 'unpaid': np.where(unpaid, n, 0)}
+    if 'ttc' in cells.columns:
+        m['ttc'] = cells['ttc'].to_numpy()
+        m['ttc_n'] = cells['ttc_n'].to_numpy()
+        m['ttc_unpaid'] = np.where(unpaid, m['ttc'], 0.0)
+    if 'Catégorie_Règle' in cells.columns:
+        codes = pd.Categorical(cells['Catégorie_Règle'], categories=list(DELAY_KPI_CATEGORIES.values())).codes
+        for i, name in enumerate(DELAY_KPI_CATEGORIES):
+            m[name] = np.where(codes == i, n, 0)
+    if 'en_retard' in cells.columns:
+        m['late'] = cells['en_retard'].to_numpy()
+        m['late_n'] = cells['en_retard_n'].to_numpy()
+    if 'retard' in cells.columns:
+        m['delay_unpaid'] = np.where(unpaid, cells['retard'].to_numpy(), 0.0)
+        m['delay_unpaid_n'] = np.where(unpaid, cells['retard_n'].to_numpy(), 0)
+        m['delay_unpaid_max'] = np.where(unpaid, cells['retard_max'].to_numpy(dtype=float), np.nan)
+    return pd.DataFrame(m, index=cells.index)
+
+
+def _ratio(num, den):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(den > 0, num / np.where(den > 0, den, 1), np.nan)
+
+
+def _kpi_table(agg, nb_clients):
+    """Agrégats (une ligne par tranche) -> KPIs (une colonne par indicateur), calcul vectorisé."""
+    table = pd.DataFrame(index=agg.index)
+    table['total_factures'] = agg['n']
+    if 'ttc' in agg:
+        table['total_ttc'] = agg['ttc'].round(2)
+        table['montant_moyen_facture'] = np.round(_ratio(agg['ttc'], agg['ttc_n']), 2)
+    if nb_clients is not None:
+        table['nb_clients'] = nb_clients
+    for name in DELAY_KPI_CATEGORIES:
+        if name in agg:
+            table[name] = agg[name]
+    if 'late' in agg:
+        table['taux_retard_global'] = _ratio(agg['late'], agg['late_n']) * 100
+    table['factures_impayees'] = agg['unpaid']
+    if 'ttc_unpaid' in agg:
+        table['montant_impaye'] = agg['ttc_unpaid'].round(2)
+    if 'delay_unpaid' in agg:
+        table['retard_moyen_jours'] = np.round(_ratio(agg['delay_unpaid'], agg['delay_unpaid_n']), 1)
+        table['plus_ancien_impaye'] = agg['delay_unpaid_max'].where(agg['unpaid'] > 0)
+    return table
+
+
+def _value(row, name, cast):
+    if name not in row.index or pd.isna(row[name]) and cast is int:
+        return None
+    return cast(row[name])
+
+
+def _result(row):
+    return KpiResult(
+        general=GeneralKpis(
+            total_factures=int(row['total_factures']),
+            total_ttc=_value(row, 'total_ttc', float),
+            nb_clients=_value(row, 'nb_clients', int),
+            montant_moyen_facture=_value(row, 'montant_moyen_facture', float),
+        ),
+        retards=DelayKpis(
+            **{name: _value(row, name, int) for name in DELAY_KPI_CATEGORIES},
+            taux_retard_global=_value(row, 'taux_retard_global', float),
+        ),
+        temporel=TimeKpis(
+            factures_impayees=int(row['factures_impayees']),
+            montant_impaye=_value(row, 'montant_impaye', float),
+            retard_moyen_jours=_value(row, 'retard_moyen_jours', float),
+            plus_ancien_impaye=_value(row, 'plus_ancien_impaye', float) if row['factures_impayees'] > 0 else None,
+        ),
+    )
+
+
+class KpiEngine:
+    """
+    KPIs généraux, de retard et temporels calculés en une passe : les mesures par facture
+    sont construites une fois, puis réduites globalement (totals) ou par tranche (by).
+    Les tableaux par tranche sont mémorisés : un nouveau découpage ne relit pas les factures.
+    Construit sur un cube d'agrégats (from_cube), le coût ne dépend plus du nombre de factures.
+    """
+
+    def __init__(self, df, measures=None, dimensions=DIMENSIONS):
+        self.source = df
+        self._measures = _measures(df) if measures is None else measures
+        self._dimensions = dimensions
+        self._clients = df['Code Client'] if 'Code Client' in df.columns else None
+        self._keys = {}
+        self._tables = {}
+        self._totals = None
+
+    @classmethod
+    def from_cube(cls, cube):
+        """KPIs lus dans un cube.InvoiceCube plutôt que dans les factures."""
+        return cls(cube.cells, _cube_measures(cube.cells), CUBE_DIMENSIONS)
+
+    def _key(self, dimension):
+        if dimension not in self._keys:
+            column = self._dimensions.get(dimension, dimension)
+            if column not in self.source.columns:
+                raise KeyError(f"Axe de découpage inconnu ou absent : {dimension}")
+            values = self.source[column]
+            if pd.api.types.is_datetime64_any_dtype(values):
+                values = values.dt.to_period('M')
+            self._keys[dimension] = values.rename(dimension)
+        return self._keys[dimension]
+
+    def totals(self):
+        """KPIs sur tout le portefeuille (KpiResult)."""
+        if self._totals is None:
+            agg = self._measures.drop(columns=['delay_unpaid_max'], errors='ignore').sum().to_frame().T
+            if 'delay_unpaid_max' in self._measures:
+                agg['delay_unpaid_max'] = self._measures['delay_unpaid_max'].max()
+            nb_clients = self._clients.nunique() if self._clients is not None else None
+            self._totals = _result(_kpi_table(agg, nb_clients).iloc[0])
+        return self._totals
+
+    def by(self, dimension):
+        """
+        Tableau des KPIs par tranche : une ligne par client ('client'), mois d'émission
+        ('mois') ou catégorie de règle ('categorie') - ou toute autre colonne du dataset.
+        """
+        if dimension not in self._tables:
+            key = self._key(dimension)
+            aggregations = {col: 'max' if col == 'delay_unpaid_max' else 'sum' for col in self._measures.columns}
+            agg = self._measures.groupby(key, observed=True, sort=True).agg(aggregations)
+            nb_clients = None
+            if self._clients is not None:
+                nb_clients = self._clients.groupby(key, observed=True, sort=True).nunique()
+            self._tables[dimension] = _kpi_table(agg, nb_clients)
+        return self._tables[dimension]
@@ -1,31 +1,154 @@
 import pandas as pd
 import numpy as np
-import streamlit as st
 import joblib
+import logging
 import os
 import lightgbm as lgb
 from sklearn.model_selection import train_test_split
-from imblearn.over_sampling import BorderlineSMOTE
+from imblearn.over_sampling import SMOTENC, BorderlineSMOTE
 from sklearn.metrics import accuracy_score, classification_report, confusion_matrix
 
-MODEL_PATH = "assets/model_lgbm_multi.pkl"
-FEATURES_PATH = "assets/model_lgbm_multi_features.pkl"
+from modules import feature_store
+from modules.rolling import client_window_features
+from utils.utils import as_of_date, cache_resource
+
+logger = logging.getLogger(__name__)
+
+# Chemins absolus : le modèle est trouvé quel que soit le répertoire courant (cron, scripts)
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ASSETS_DIR = os.path.join(BASE_DIR, "assets")
+MODEL_PATH = os.path.join(ASSETS_DIR, "model_lgbm_multi.pkl")
+FEATURES_PATH = os.path.join(ASSETS_DIR, "model_lgbm_multi_features.pkl")
+PREPROCESSING_PATH = os.path.join(ASSETS_DIR, "model_lgbm_multi_preprocessing.pkl")
+# Colonnes ajoutées par la prédiction
+PREDICTION_COLUMNS = ['ML_Prediction_Num', 'ML_Prediction', 'amount_at_risk_prediction']
+# Colonnes clients en catégories natives LightGBM (codes entiers, cf. FeaturePreprocessor)
+NATIVE_CATEGORICAL = ['Code Client', 'Client']
+# Fenêtres des features glissantes par client : nombre de factures et durées calendaires
+# (jours d'émission), calculées ensemble sur un seul tri (cf. rolling)
+CLIENT_COUNT_WINDOWS = (5, 10, 20)
+CLIENT_TIME_WINDOWS = ('30D', '90D', '365D')
+# Régularité : écart-type des retards sur un an ramené à cette échelle (jours)
+REGULARITY_SCALE_DAYS = 30
+
+
+def client_history_features(count_windows=CLIENT_COUNT_WINDOWS, time_windows=CLIENT_TIME_WINDOWS):
+    """Features glissantes par client : nom -> (colonne, statistique, fenêtre)."""
+    features = {}
+    for w in count_windows:
+        features.update({
+            f'client_delay_mean_{w}': ('Est_En_Retard', 'mean', w),
+            f'client_delay_std_{w}': ('Est_En_Retard', 'std', w),
+            f'client_avg_delay_{w}': ('Jours_Retard', 'mean', w),
+            f'client_max_delay_{w}': ('Jours_Retard', 'max', w),
+            f'client_avg_ttc_{w}': (' T.T.C ', 'mean', w),
+            f'client_sum_ttc_{w}': (' T.T.C ', 'sum', w),
+        })
+    for span in time_windows:
+        d = span.lower()
+        features.update({
+            f'client_nb_invoices_{d}': ('Jours_Retard', 'count', span),
+            f'client_late_rate_{d}': ('Est_En_Retard', 'mean', span),
+            f'client_avg_delay_{d}': ('Jours_Retard', 'mean', span),
+            f'client_std_delay_{d}': ('Jours_Retard', 'std', span),
+            f'client_sum_ttc_{d}': (' T.T.C ', 'sum', span),
+        })
+    return features
+
+
+CLIENT_WINDOW_FEATURES = client_history_features()
+
+
+class FeaturePreprocessor:
+    """
+    Prétraitement appris par train_model et sauvegardé avec le modèle (PREPROCESSING_PATH) :
+    valeurs de remplacement des NaN numériques (médianes d'entraînement), codes entiers des
+    colonnes catégorielles natives LightGBM (clients : 0 = client inconnu ou manquant) et,
+    pour les autres colonnes texte, position de la colonne indicatrice de chaque valeur connue.
+    À la prédiction, la matrice du modèle est remplie directement (ni get_dummies ni reindex).
+    """
+
+    def __init__(self, feature_columns, fill_values, vocabularies, categories=None):
+        self.feature_columns = list(feature_columns)
+        self.fill_values = fill_values      # colonne numérique -> valeur de remplacement
+        self.vocabularies = vocabularies    # colonne indicatrice -> {valeur (texte): position}
+        self.categories = categories or {}  # colonne catégorielle native -> {valeur (texte): code}
+        self.positions = {col: i for i, col in enumerate(self.feature_columns)}
+
+    @classmethod
+    def fit(cls, X, categorical=()):
+        """
+        X : features avant encodage. Colonnes de `categorical` : codes entiers (1..n, ordre
+        des valeurs ; 0 réservé aux valeurs inconnues) ; autres colonnes texte : indicatrices.
+        """
+        fill_values = {col: X[col].median() for col in X.select_dtypes(include=np.number).columns}
+        text = X.select_dtypes(include=['object', 'category']).columns
+        categories, dummies = {}, {}
+        for col in text:
+            if col in categorical:
+                values = sorted({str(v) for v in X[col].dropna().unique()})
+                categories[col] = {v: code for code, v in enumerate(values, start=1)}
+            else:
+                dummies[col] = sorted({str(v) for v in X[col].astype(object).fillna('Missing').unique()})
+        feature_columns = [col for col in X.columns if col in fill_values or col in categories]
+        vocabularies = {}
+        for col, values in dummies.items():
+            vocabularies[col] = {v: len(feature_columns) + i for i, v in enumerate(values)}
+            feature_columns += [f"{col}_{v}" for v in values]
+        return cls(feature_columns, fill_values, vocabularies, categories)
+
+    @property
+    def categorical_features(self):
+        """Colonnes à déclarer catégorielles à LightGBM (categorical_feature)."""
+        return [col for col in self.feature_columns if col in getattr(self, 'categories', {})]
+
+    def transform(self, df):
+        X = np.zeros((len(df), len(self.feature_columns)))
+        for col, value in self.fill_values.items():
+            if col in df.columns:
+                X[:, self.positions[col]] = df[col].to_numpy(dtype=float, na_value=np.nan)
+                column = X[:, self.positions[col]]
+                column[np.isnan(column)] = value
+        rows = np.arange(len(df))
+        for col, vocabulary in self.vocabularies.items():
+            if col not in df.columns:
+                continue
+            target = self._lookup(df[col], vocabulary, vocabulary.get('Missing', -1), -1)
+            known = target >= 0
+            X[rows[known], target[known]] = 1.0
+        for col, codes in getattr(self, 'categories', {}).items():
+            if col in df.columns:
+                X[:, self.positions[col]] = self._lookup(df[col], codes, 0, 0)
+        return pd.DataFrame(X, columns=self.feature_columns, index=df.index)
+
+    @staticmethod
+    def _lookup(values, mapping, missing, unknown):
+        # Une recherche par valeur distincte (dernière entrée : valeur manquante)
+        codes, uniques = pd.factorize(values)
+        lookup = np.array([mapping.get(str(v), unknown) for v in uniques] + [missing])
+        return lookup[codes]
+
 
 class PaymentDelayAI:
-    def __init__(self, multi_class_classifier_model=None, feature_columns=None):
+    def __init__(self, multi_class_classifier_model=None, feature_columns=None, preprocessor=None):
         self.ml_multi_classifier = multi_class_classifier_model
         self.feature_columns = feature_columns
+        # Prétraitement appris à l'entraînement (None : modèle antérieur, cf. preprocess_features)
+        self.preprocessor = preprocessor
         self.category_names = {
             0: "Aucun retard (ML)",
             1: "Est en retard (ML)",
             2: "Retard exagere (ML)"
         }
 
-    def predict_payment_behavior(self, df):
-        df_featured = self.create_advanced_features(df.copy())
+    def predict_payment_behavior(self, df, as_of=None, store_dir=None, history=None):
+        return self.predict_from_features(self.create_advanced_features(df.copy(), as_of, store_dir, history))
+
+    def predict_from_features(self, df_featured):
+        # df_featured : sortie de create_advanced_features
         X_pred = self.preprocess_features(df_featured)
         if X_pred is None:
-            st.error("Erreur: Impossible de preparer les features pour la prediction")
+            logger.error("Impossible de preparer les features pour la prediction")
             return df_featured
         pred_cat_num = self.ml_multi_classifier.predict(X_pred)
         df_featured['ML_Prediction_Num'] = pred_cat_num
@@ -40,58 +163,62 @@ class PaymentDelayAI:
 
     def preprocess_features(self, df):
         if self.feature_columns is None:
-            st.error("Erreur: feature_columns non defini")
+            logger.error("feature_columns non defini")
             return None
+        if self.preprocessor is not None:
+            return self.preprocessor.transform(df)
+        # Modèle sans prétraitement sauvegardé : médianes du lot, get_dummies puis reindex
         common_cols = [col for col in df.columns if col in self.feature_columns]
         X_pred = df[common_cols].copy()
     # NaN numeriques -> mediane
         num_cols = X_pred.select_dtypes(include=np.number).columns
         for col in num_cols:
             X_pred[col] = X_pred[col].fillna(X_pred[col].median())
-        # NaN cat -> 'Missing'
-        cat_cols = X_pred.select_dtypes(include='object').columns
+        # NaN cat -> 'Missing' (colonnes compactées en category : même encodage que le texte)
+        cat_cols = X_pred.select_dtypes(include=['object', 'category']).columns
         for col in cat_cols:
-            X_pred[col] = X_pred[col].fillna('Missing')
+            X_pred[col] = X_pred[col].astype(object).fillna('Missing')
         X_pred = pd.get_dummies(X_pred, columns=cat_cols, dummy_na=False)
         X_pred = X_pred.reindex(columns=self.feature_columns, fill_value=0)
         return X_pred
 
-    def create_advanced_features(self, df):
+    def create_advanced_features(self, df, as_of=None, store_dir=None, history=None):
+        # as_of : date de référence des features d'ancienneté (défaut : aujourd'hui)
+        # store_dir : features glissantes reprises du feature store et mises à jour (df = nouvelles
+        # factures seulement, history = historique complet si disponible, cf. feature_store.update)
+        as_of = as_of_date(as_of)
         if 'echeance' in df.columns:
             df['echeance'] = pd.to_datetime(df['echeance'], errors='coerce')
         df["Date d'Emission"] = pd.to_datetime(df["Date d'Emission"], errors='coerce')
-        df['days_since_invoice'] = (pd.Timestamp.now() - df["Date d'Emission"]).dt.days
-        df['days_to_due'] = (df['échéance'] - pd.Timestamp.now()).dt.days
+        df['days_since_invoice'] = (as_of - df["Date d'Emission"]).dt.days
+        df['days_to_due'] = (df['échéance'] - as_of).dt.days
         df['invoice_month'] = df["Date d'Emission"].dt.month
         df['due_day_of_week'] = df['échéance'].dt.dayofweek
-        # Rolling features client
+        # Rolling features client (5/10/20 dernières factures, 30/90/365 jours, cf. rolling)
         cols_rolling = ['Code Client', 'Est_En_Retard', 'Jours_Retard', ' T.T.C ']
         if all(c in df.columns for c in cols_rolling):
-            df_sorted = df.sort_values(by=['Code Client', "Date d'Emission"]).copy()
-            client_feats = df_sorted.groupby('Code Client').rolling(window=5)[
-                ['Est_En_Retard', 'Jours_Retard', ' T.T.C ']].agg(['mean', 'std', 'max', 'sum'])
-            client_feats.columns = ['_'.join(x) for x in client_feats.columns]
-            client_feats = client_feats.reset_index().rename(columns={'level_1': 'original_index'})
-            df = df.reset_index().rename(columns={'index': 'original_index'})
-            df = df.merge(client_feats.drop(columns=['Code Client']), on='original_index', how='left').drop('original_index', axis=1)
-            rename_map = {
-                'Est_En_Retard_mean': 'client_delay_mean_5',
-                'Est_En_Retard_std': 'client_delay_std_5',
-                'Jours_Retard_mean': 'client_avg_delay_5',
-                'Jours_Retard_max': 'client_max_delay_5',
-                ' T.T.C _mean': 'client_avg_ttc_5',
-                ' T.T.C _sum': 'client_sum_ttc_5'
-            }
-            df.rename(columns=rename_map, inplace=True)
+            # Lignes renumérotées comme avant (résultats réécrits par position)
+            df = df.reset_index(drop=True)
+            if store_dir is None:
+                features = client_window_features(df, CLIENT_WINDOW_FEATURES)
+            else:
+                features, stats = feature_store.update(df, CLIENT_WINDOW_FEATURES, as_of, history, store_dir)
+                logger.info("Feature store : %d client(s), %d reconstruit(s), %d facture(s) approchée(s)",
+                            stats['clients'], stats['reconstruits'], stats['approchees'])
+            df = pd.concat([df, pd.DataFrame(features, index=df.index)], axis=1)
         if ' Caution ' in df.columns and ' T.T.C ' in df.columns:
             df['caution_utilization_rate'] = df[' T.T.C '] / df[' Caution '].replace(0, np.inf)
             df['caution_buffer'] = df[' Caution '] - df[' T.T.C ']
-        df['payment_regularity'] = 0.8
-        df['client_risk_trend'] = 0.2
+        # Régularité (1 = retards constants sur un an) et tendance du risque
+        # (taux de retard des 90 derniers jours - taux sur un an, > 0 : dégradation)
+        if 'client_std_delay_365d' in df.columns:
+            df['payment_regularity'] = 1 / (1 + df['client_std_delay_365d'] / REGULARITY_SCALE_DAYS)
+        if 'client_late_rate_90d' in df.columns and 'client_late_rate_365d' in df.columns:
+            df['client_risk_trend'] = df['client_late_rate_90d'] - df['client_late_rate_365d']
         return df
 
 # ----------- Partie ENTRAINEMENT -----------
-def train_model(df):
+def train_model(df, as_of=None):
     # 1. Construction de la cible
     def new_cat(row):
         if row.get('Est_Retard_Exagéré', 0) == 1:
@@ -100,70 +227,70 @@ def train_model(df):
             return 1
         else:
             return 0
-    df['nouvelle_categorie_retard'] = df.apply(new_cat, axis=1)
+    # Nouvelle colonne sur une copie : df peut être un résultat partagé (cf. clean_and_prepare)
+    df = df.assign(nouvelle_categorie_retard=df.apply(new_cat, axis=1))
 
     # 2. Feature engineering
     temp_ai = PaymentDelayAI()
-    df_fe = temp_ai.create_advanced_features(df.copy())
+    df_fe = temp_ai.create_advanced_features(df.copy(), as_of)
 
     # 3. Sélection features
     feature_cols = [
         'days_since_invoice', 'days_to_due', 'invoice_month', 'due_day_of_week',
-        'client_delay_mean_5', 'client_delay_std_5', 'client_avg_delay_5',
-        'client_max_delay_5', 'client_avg_ttc_5', 'client_sum_ttc_5',
+        *CLIENT_WINDOW_FEATURES,
         'caution_utilization_rate', 'caution_buffer', 'payment_regularity',
         'client_risk_trend', ' T.T.C ', ' H.T ', ' T.V.A ', ' T.R ',
-        'Code Client', 'Client', 'Catégorie_Règle'
+        'Code Client', 'Client'
     ]
     feature_cols = [c for c in feature_cols if c in df_fe.columns]
     X_multi = df_fe[feature_cols].copy()
     y_multi = df_fe['nouvelle_categorie_retard']
 
-    # 4. Remplacement des NaN
-    for c in X_multi.select_dtypes(include=np.number).columns:
-        X_multi[c].fillna(X_multi[c].median(), inplace=True)
-    for c in X_multi.select_dtypes(include='object').columns:
-        X_multi[c].fillna('Missing', inplace=True)
-
-    # 5. One-hot encoding
-    X_multi = pd.get_dummies(X_multi, columns=X_multi.select_dtypes(include='object').columns, dummy_na=False)
-    # Supprimer colonnes liées à 'Catégorie_Règle' si présentes
-    cols_to_drop = [col for col in X_multi.columns if col.startswith('Catégorie_Règle_')]
-    X_multi.drop(columns=cols_to_drop, inplace=True, errors='ignore')
+    # 4-5. Prétraitement appris (NaN -> médianes d'entraînement, clients -> codes entiers),
+    # appliqué tel quel à la prédiction
+    preprocessor = FeaturePreprocessor.fit(X_multi, categorical=NATIVE_CATEGORICAL)
+    X_multi = preprocessor.transform(X_multi)
+    categorical = preprocessor.categorical_features
 
-    # 6. Split et SMOTE
+    # 6. Split et sur-échantillonnage (SMOTENC : codes clients non interpolés)
     X_train_multi, X_test_multi, y_train_multi, y_test_multi = train_test_split(
         X_multi, y_multi, test_size=0.2, random_state=42, stratify=y_multi
     )
-    smote = BorderlineSMOTE(random_state=42)
+    if categorical:
+        smote = SMOTENC(categorical_features=[X_multi.columns.get_loc(c) for c in categorical], random_state=42)
+    else:
+        smote = BorderlineSMOTE(random_state=42)
     X_train_bal, y_train_bal = smote.fit_resample(X_train_multi, y_train_multi)
 
     # 7. Entraînement LightGBM
     lgb_multi = lgb.LGBMClassifier(objective='multiclass', num_class=3, random_state=42, n_jobs=-1)
-    lgb_multi.fit(X_train_bal, y_train_bal)
+    lgb_multi.fit(X_train_bal, y_train_bal, categorical_feature=categorical or 'auto')
 
     # 8. Évaluation rapide
     y_pred = lgb_multi.predict(X_test_multi)
     acc = accuracy_score(y_test_multi, y_pred)
     report = classification_report(y_test_multi, y_pred)
     cm = confusion_matrix(y_test_multi, y_pred)
-    st.success(f"Modèle entraîné avec {acc:.2%} de précision sur le test.")
-    st.text("Matrice de confusion :\n" + str(cm))
-    st.text("Rapport de classification :\n" + report)
+    logger.info("Modèle entraîné avec %.2f%% de précision sur le test", 100 * acc)
 
     # 9. Sauvegarde
-    os.makedirs('assets', exist_ok=True)
+    os.makedirs(ASSETS_DIR, exist_ok=True)
     joblib.dump(lgb_multi, MODEL_PATH)
     joblib.dump(X_train_multi.columns.tolist(), FEATURES_PATH)
-    st.success("Modèle et features sauvegardés dans assets/.")
+    joblib.dump(preprocessor, PREPROCESSING_PATH)
+    load_model.clear()
+    load_preprocessor.clear()
+    logger.info("Modèle et features sauvegardés dans %s", ASSETS_DIR)
 
-    return lgb_multi, X_train_multi.columns.tolist()
+    # Métriques renvoyées à l'appelant (affichage dans l'application, logs en batch)
+    metrics = {'accuracy': acc, 'confusion_matrix': cm, 'classification_report': report}
+    return lgb_multi, X_train_multi.columns.tolist(), metrics
 
 # ----------- Partie PRÉDICTION -----------
-@st.cache_resource(show_spinner="Chargement du modèle ML…")
+@cache_resource(show_spinner="Chargement du modèle ML…")
 def load_model():
     if not os.path.exists(MODEL_PATH):
-        st.warning("Modèle non trouvé. Merci d'entraîner d'abord.")
+        logger.warning("Modèle non trouvé (%s). Merci d'entraîner d'abord.", MODEL_PATH)
         return None, None
     model = joblib.load(MODEL_PATH)
     if os.path.exists(FEATURES_PATH):
@@ -172,11 +299,27 @@ def load_model():
         features = None
     return model, features
 
-def run_prediction(df):
+@cache_resource(show_spinner=False)
+def load_preprocessor():
+    """
+    Prétraitement sauvegardé avec le modèle, None s'il est absent (modèle entraîné avant
+    son introduction) ou s'il ne correspond pas aux features du modèle.
+    """
+    if not os.path.exists(PREPROCESSING_PATH):
+        return None
+    preprocessor = joblib.load(PREPROCESSING_PATH)
+    _, feature_columns = load_model()
+    if feature_columns is not None and preprocessor.feature_columns != list(feature_columns):
+        logger.warning("Prétraitement %s obsolète (features différentes du modèle) : ignoré.", PREPROCESSING_PATH)
+        return None
+    return preprocessor
+
+def run_prediction(df, as_of=None, store_dir=None, history=None):
     model, feature_cols = load_model()
     if model is None or feature_cols is None:
-        st.warning("Modèle non disponible. Merci de l'entraîner d'abord.")
+        logger.warning("Modèle non disponible. Merci de l'entraîner d'abord.")
         return df
-    payment_ai = PaymentDelayAI(multi_class_classifier_model=model, feature_columns=feature_cols)
-    df_pred = payment_ai.predict_payment_behavior(df)
+    payment_ai = PaymentDelayAI(multi_class_classifier_model=model, feature_columns=feature_cols,
+                                preprocessor=load_preprocessor())
+    df_pred = payment_ai.predict_payment_behavior(df, as_of, store_dir, history)
     return df_pred
\ No newline at end of file
@@ -0,0 +1,33 @@
+"""
+Fichiers Parquet des stocks persistants (invoice_store, feature_store) : un fichier par
+nom dans un dossier de stock, écriture atomique (fichier temporaire puis remplacement).
+Sans pyarrow, rien n'est lu ni écrit (stocks vides).
+"""
+import os
+
+import pandas as pd
+
+from modules.upload_cache import PARQUET_AVAILABLE, arrow_safe
+
+
+def store_path(store_dir, name):
+    return os.path.join(store_dir, name)
+
+
+def read_parquet(store_dir, name):
+    """Contenu du fichier `name` du stock, ou None s'il n'existe pas."""
+    path = store_path(store_dir, name)
+    if not PARQUET_AVAILABLE or not os.path.exists(path):
+        return None
+    return pd.read_parquet(path)
+
+
+def write_parquet(df, store_dir, name):
+    """Remplace le fichier `name` du stock par `df`."""
+    if not PARQUET_AVAILABLE:
+        return
+    os.makedirs(store_dir, exist_ok=True)
+    path = store_path(store_dir, name)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    arrow_safe(df.reset_index(drop=True)).to_parquet(tmp_path)
+    os.replace(tmp_path, path)
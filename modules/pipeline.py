@@ -0,0 +1,175 @@
+"""
+Traitement batch (sans Streamlit) : ingestion -> nettoyage / règles de retard ->
+features -> prédiction ML -> export. Prévu pour un lancement planifié (cron) ;
+l'application ne fait ensuite que relire le fichier produit.
+Les résultats sont calculés pour une date de référence (--as-of, défaut : aujourd'hui),
+ce qui permet de préparer la nuit les résultats du lendemain.
+
+    python -m modules.pipeline data/ --as-of 2025-07-01
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+from modules import data_processing, feature_store, ingestion, ml_predict, warehouse
+from modules.schema import INVOICE_SCHEMA
+from modules.upload_cache import BASE_DIR, arrow_safe
+from utils.utils import as_of_date
+
+logger = logging.getLogger("pipeline")
+
+OUTPUT_DIR = os.path.join(BASE_DIR, "output")
+EXPORT_FORMATS = (".parquet", ".csv", ".xlsx")
+
+
+def output_path(as_of=None):
+    """Fichier de résultats par défaut pour une date de référence : output/predictions_AAAA-MM-JJ.parquet."""
+    return os.path.join(OUTPUT_DIR, f"predictions_{as_of_date(as_of):%Y-%m-%d}.parquet")
+
+
+@contextmanager
+def stage(name, timings):
+    """Chronomètre une étape du traitement (durée loguée et ajoutée à `timings`)."""
+    start = time.perf_counter()
+    yield
+    timings[name] = time.perf_counter() - start
+    logger.info("%-12s %8.3f s", name, timings[name])
+
+
+def ingest(source, max_workers=None):
+    """Fichier ou dossier de fichiers de factures -> DataFrame brut harmonisé."""
+    if os.path.isdir(source):
+        df, report = ingestion.load_directory(source, max_workers=max_workers, schema=INVOICE_SCHEMA)
+        for row in report.itertuples(index=False):
+            logger.info("  %s : %d lignes", row.Fichier, row.Lignes)
+        logger.info("  %d doublon(s) supprimé(s)", report.attrs.get('doublons_supprimes', 0))
+        return df
+    return ingestion.load_invoices(source, schema=INVOICE_SCHEMA)
+
+
+def export(df, path):
+    """Écrit le résultat au format donné par l'extension (parquet, csv ou xlsx)."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in EXPORT_FORMATS:
+        raise ValueError(f"Format d'export non supporté : {ext} (formats acceptés : {', '.join(EXPORT_FORMATS)})")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{os.path.splitext(path)[0]}.{os.getpid()}.tmp{ext}"
+    if ext == ".parquet":
+        arrow_safe(df.copy()).to_parquet(tmp_path, index=False)
+    elif ext == ".csv":
+        df.to_csv(tmp_path, index=False)
+    else:
+        df.to_excel(tmp_path, index=False, engine="openpyxl")
+    # Remplacement atomique : l'application ne lit jamais un fichier à moitié écrit
+    os.replace(tmp_path, path)
+
+
+def run(source, output=None, max_workers=None, keep_features=False, as_of=None, to_warehouse=False,
+        rebuild_features=False):
+    """
+    Enchaîne toutes les étapes sur un fichier ou un dossier, pour la date de référence
+    as_of (défaut : aujourd'hui) ; output par défaut : output_path(as_of).
+    - keep_features : exporte aussi les features intermédiaires (sinon : colonnes
+      traitées + colonnes de prédiction, cf. ml_predict.PREDICTION_COLUMNS)
+    - to_warehouse : ajoute aussi le résultat à l'entrepôt DuckDB (cf. warehouse)
+    - rebuild_features : reconstruit le feature store des historiques clients à partir
+      des factures traitées (cf. feature_store)
+    Retourne (df_résultat, durées par étape en secondes).
+    """
+    as_of = as_of_date(as_of)
+    output = output or output_path(as_of)
+    logger.info("Date de référence : %s", f"{as_of:%Y-%m-%d}")
+    timings = {}
+    with stage("ingestion", timings):
+        df_raw = ingest(source, max_workers)
+    logger.info("  %d factures lues", len(df_raw))
+    with stage("nettoyage", timings):
+        df = data_processing.clean_and_prepare(df_raw, as_of)
+    logger.info("  %d factures retenues", len(df))
+    invalid = {col.strip(): n for col, n in df.attrs.get('montants_invalides', {}).items() if n}
+    if invalid:
+        logger.warning("  montants non reconnus : %s", invalid)
+    report = data_processing.validation_report(df)
+    if report is not None and report.nb_rejetees:
+        logger.warning("  %d ligne(s) rejetée(s) à la validation : %s", report.nb_rejetees, report.rejets())
+
+    model, feature_cols = ml_predict.load_model()
+    payment_ai = ml_predict.PaymentDelayAI(multi_class_classifier_model=model, feature_columns=feature_cols,
+                                           preprocessor=ml_predict.load_preprocessor())
+    with stage("features", timings):
+        df_featured = payment_ai.create_advanced_features(df.copy(), as_of)
+    if model is None or feature_cols is None:
+        result = df
+    else:
+        with stage("prediction", timings):
+            result = payment_ai.predict_from_features(df_featured)
+        if not keep_features:
+            columns = list(df.columns) + [col for col in ml_predict.PREDICTION_COLUMNS if col in result.columns]
+            result = result[columns]
+    with stage("export", timings):
+        export(result, output)
+    if to_warehouse:
+        columns = list(df.columns) + [col for col in ml_predict.PREDICTION_COLUMNS if col in result.columns]
+        with stage("entrepôt", timings):
+            total = warehouse.save(result[columns], as_of)
+        logger.info("  %d factures dans l'entrepôt %s", total, warehouse.WAREHOUSE_PATH)
+    if rebuild_features:
+        with stage("historiques", timings):
+            kept = feature_store.rebuild(df, ml_predict.CLIENT_WINDOW_FEATURES, as_of)
+        logger.info("  %d factures conservées dans le feature store", kept)
+    logger.info("%d lignes exportées dans %s (total %.3f s)", len(result), output, sum(timings.values()))
+    return result, timings
+
+
+def load_results(path=None, as_of=None):
+    """
+    Relit le résultat batch d'une date de référence (ou le fichier `path`).
+    Retourne (df_traité, df_prédictions) ou None si absent.
+    """
+    path = path or output_path(as_of)
+    if not os.path.exists(path):
+        return None
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".parquet":
+        preds = pd.read_parquet(path)
+    elif ext == ".csv":
+        preds = pd.read_csv(path)
+    else:
+        preds = pd.read_excel(path)
+    processed = preds.drop(columns=ml_predict.PREDICTION_COLUMNS, errors='ignore')
+    return processed, preds if 'ML_Prediction' in preds.columns else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Traitement batch des factures (ingestion -> prédiction -> export)")
+    parser.add_argument("source", help="fichier de factures ou dossier de fichiers")
+    parser.add_argument("-o", "--output", default=None,
+                        help=f"fichier de sortie ({', '.join(EXPORT_FORMATS)}), défaut : output/predictions_<as-of>.parquet")
+    parser.add_argument("--as-of", default=None, help="date de référence AAAA-MM-JJ (défaut : aujourd'hui)")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="processus de lecture (mode dossier)")
+    parser.add_argument("--features", action="store_true", help="exporter aussi les features intermédiaires")
+    parser.add_argument("--warehouse", action="store_true", help="ajouter le résultat à l'entrepôt DuckDB (historique)")
+    parser.add_argument("--feature-store", action="store_true",
+                        help="reconstruire le feature store des historiques clients (scoring incrémental)")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
+    if args.warehouse and not warehouse.DUCKDB_AVAILABLE:
+        parser.error("--warehouse nécessite duckdb (pip install duckdb)")
+    result, _ = run(args.source, args.output, args.workers, args.features, args.as_of, args.warehouse,
+                    args.feature_store)
+    # Code retour non nul si la prédiction n'a pas pu être faite (modèle absent) : visible par cron
+    return 0 if 'ML_Prediction' in result.columns else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
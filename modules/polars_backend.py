@@ -0,0 +1,204 @@
+"""
+Backend Polars (optionnel) du nettoyage, des règles de retard et des KPIs : plans lazy
+exécutés sur tous les cœurs, conversion en pandas uniquement à la sortie (interface).
+La conversion des montants FR et des dates texte reste faite avant le plan, colonne par
+colonne (schema.parse_fr_amounts sur Arrow, pd.to_datetime : cf. _typed), pour garder les
+mêmes compteurs de montants invalides que le backend pandas.
+Sélectionné par la variable d'environnement DATA_BACKEND=polars (cf. data_processing.BACKEND) ;
+sans Polars installé, le backend pandas reste utilisé. Parité vérifiée par
+scripts/check_polars_parity.py.
+"""
+import numpy as np
+import pandas as pd
+
+try:
+    import polars as pl
+    POLARS_AVAILABLE = True
+except ImportError:
+    pl = None
+    POLARS_AVAILABLE = False
+
+from modules import data_processing
+from modules.kpis import DELAY_KPI_CATEGORIES, DIMENSIONS, _kpi_table, _result
+from modules.schema import parse_fr_amounts, record_invalid_amounts
+
+ROW = '_ligne'
+MASK = '_rejet'
+NS_PER_DAY = 86_400_000_000_000
+
+
+def _typed(df):
+    # Montants FR et dates texte : même conversion que le backend pandas (compteurs identiques)
+    df = df.copy(deep=False)
+    invalid = {}
+    for col in [' H.T ', ' T.V.A ', ' T.R ', ' T.T.C ', ' Caution ', ' Montant ']:
+        if col in df.columns:
+            df[col], invalid[col] = parse_fr_amounts(df[col])
+    for col in ["Date d'Emission", 'échéance', 'Date Encaissement']:
+        if col in df.columns and not pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = pd.to_datetime(df[col], errors='coerce')
+    return df, invalid
+
+
+def _validation_expr(columns):
+    """Masque de validation (un bit par règle, cf. data_processing.validation_mask)."""
+    ttc_bit, emission_bit, echeance_bit, order_bit = data_processing.VALIDATION_RULES.values()
+    mask = pl.lit(0, dtype=pl.UInt8)
+    if ' T.T.C ' in columns:
+        ttc = pl.col(' T.T.C ').cast(pl.Float64)
+        mask = mask | pl.when((ttc > 0).fill_null(False)).then(0).otherwise(ttc_bit).cast(pl.UInt8)
+    if "Date d'Emission" in columns and 'échéance' in columns:
+        emission, echeance = pl.col("Date d'Emission"), pl.col('échéance')
+        mask = (mask
+                | pl.when(emission.is_null()).then(emission_bit).otherwise(0).cast(pl.UInt8)
+                | pl.when(echeance.is_null()).then(echeance_bit).otherwise(0).cast(pl.UInt8)
+                | pl.when((emission > echeance).fill_null(False)).then(order_bit).otherwise(0).cast(pl.UInt8))
+    return mask.alias(MASK)
+
+
+def _delay_exprs(columns, as_of):
+    """Règles de retard (cf. data_processing.compute_delay_status) en expressions Polars."""
+    echeance = pl.col('échéance') if 'échéance' in columns else pl.lit(None, dtype=pl.Datetime('ns'))
+    reference = pl.lit(as_of.to_datetime64()).cast(pl.Datetime('ns'))
+    if 'Encaissement' in columns and 'Date Encaissement' in columns:
+        paid = (pl.col('Encaissement') == 'OUI').fill_null(False) & pl.col('Date Encaissement').is_not_null()
+        reference = pl.when(paid).then(pl.col('Date Encaissement')).otherwise(reference)
+    missing = echeance.is_null()
+    # Division entière arrondie vers le bas, comme Timedelta.days
+    days = ((reference.cast(pl.Datetime('ns')) - echeance.cast(pl.Datetime('ns')))
+            .dt.total_nanoseconds() // NS_PER_DAY).fill_null(0).cast(pl.Int64)
+
+    def select(values, default):
+        expr = pl.when(missing).then(pl.lit(values[0]))
+        for (bound, _, _), value in zip(data_processing.DELAY_RULES, values[1:]):
+            expr = expr.when(days <= bound).then(pl.lit(value))
+        return expr.otherwise(pl.lit(default))
+
+    rules = data_processing.DELAY_RULES
+    missing_rule, above_rule = data_processing.DELAY_RULE_MISSING, data_processing.DELAY_RULE_ABOVE
+    categorie = select([missing_rule[1]] + [r[2] for r in rules], above_rule[1])
+    return [
+        select([missing_rule[0]] + [r[1] for r in rules], above_rule[0]).alias('Statut_Détaillé'),
+        days.alias('Jours_Retard'),
+        categorie.alias('Catégorie_Règle'),
+        (~categorie.is_in(data_processing.ON_TIME_CATEGORIES)).cast(pl.Int64).alias('Est_En_Retard'),
+        (categorie == above_rule[1]).cast(pl.Int64).alias('Est_Retard_Exagéré'),
+    ]
+
+
+def clean_and_prepare(df_raw, as_of):
+    """Équivalent Polars de data_processing._clean_and_prepare (même résultat pandas, mêmes attrs)."""
+    df, invalid = _typed(df_raw)
+    columns = list(df.columns)
+    frame = (
+        pl.from_pandas(df.reset_index(drop=True)).lazy()
+        .with_row_index(ROW)
+        .with_columns(_validation_expr(columns))
+        .collect()
+    )
+    rejected = frame.filter(pl.col(MASK) != 0)
+    result = (
+        frame.lazy()
+        .filter(pl.col(MASK) == 0)
+        .with_columns(_delay_exprs(columns, as_of))
+        .drop(MASK)
+        .collect()
+    )
+    positions = result.get_column(ROW).to_numpy()
+    out = result.drop(ROW).to_pandas()
+    out.index = df.index[positions]
+    # Colonnes category : mêmes catégories que l'entrée (Polars ne garde que les valeurs présentes)
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype) and col in out.columns:
+            out[col] = pd.Categorical(out[col].astype(object), dtype=df[col].dtype)
+    # Compteurs déjà présents à la lecture (cf. schema.conform) cumulés comme avec pandas
+    out.attrs = dict(df.attrs)
+    record_invalid_amounts(out, invalid)
+    out.attrs['validation'] = data_processing.ValidationReport(
+        len(df), np.asarray(df.index[rejected.get_column(ROW).to_numpy()]), rejected.get_column(MASK).to_numpy()
+    )
+    return out
+
+
+def _measure_exprs(columns):
+    """Agrégats des KPIs (cf. kpis._measures) calculés en une seule requête."""
+    unpaid = (pl.col('Encaissement') != 'OUI').fill_null(True) if 'Encaissement' in columns else pl.lit(True)
+    exprs = [pl.len().cast(pl.Int64).alias('n'), unpaid.cast(pl.Int64).sum().alias('unpaid')]
+    if ' T.T.C ' in columns:
+        ttc = pl.col(' T.T.C ').cast(pl.Float64).fill_nan(None)
+        exprs += [
+            ttc.fill_null(0.0).sum().alias('ttc'),
+            ttc.is_not_null().cast(pl.Int64).sum().alias('ttc_n'),
+            pl.when(unpaid).then(ttc).otherwise(None).fill_null(0.0).sum().alias('ttc_unpaid'),
+        ]
+    if 'Catégorie_Règle' in columns:
+        category = pl.col('Catégorie_Règle').cast(pl.String)
+        exprs += [(category == value).fill_null(False).cast(pl.Int64).sum().alias(name)
+                  for name, value in DELAY_KPI_CATEGORIES.items()]
+    if 'Est_En_Retard' in columns:
+        late = pl.col('Est_En_Retard').cast(pl.Float64).fill_nan(None)
+        exprs += [late.fill_null(0.0).sum().alias('late'), late.is_not_null().cast(pl.Int64).sum().alias('late_n')]
+    if 'Jours_Retard' in columns:
+        delay = pl.when(unpaid).then(pl.col('Jours_Retard').cast(pl.Float64).fill_nan(None)).otherwise(None)
+        exprs += [delay.fill_null(0.0).sum().alias('delay_unpaid'),
+                  delay.is_not_null().cast(pl.Int64).sum().alias('delay_unpaid_n'),
+                  delay.max().alias('delay_unpaid_max')]
+    if 'Code Client' in columns:
+        exprs.append(pl.col('Code Client').drop_nulls().n_unique().alias('nb_clients'))
+    return exprs
+
+
+# Colonnes lues par les KPIs : seules celles-ci (et l'axe de découpage) sont converties
+KPI_COLUMNS = ['Encaissement', ' T.T.C ', 'Catégorie_Règle', 'Est_En_Retard', 'Jours_Retard', 'Code Client']
+
+
+def _frame(df, extra=()):
+    if isinstance(df, pd.DataFrame):
+        used = [col for col in df.columns if col in KPI_COLUMNS or col in extra]
+        return pl.from_pandas(df[used].reset_index(drop=True)).lazy()
+    return df.lazy()
+
+
+def kpi_table(df, dimension=None):
+    """
+    KPIs en une requête Polars : une ligne (dimension=None, cf. KpiEngine.totals)
+    ou une ligne par tranche (cf. KpiEngine.by). Seul le tableau agrégé repasse en pandas.
+    """
+    columns = list(df.columns)
+    frame = _frame(df, [DIMENSIONS.get(dimension, dimension)])
+    if dimension is None:
+        agg = frame.select(_measure_exprs(columns)).collect().to_pandas()
+    else:
+        column = DIMENSIONS.get(dimension, dimension)
+        if column not in columns:
+            raise KeyError(f"Axe de découpage inconnu ou absent : {dimension}")
+        # Dates découpées par mois, comme KpiEngine (période mensuelle)
+        temporal = frame.collect_schema()[column].is_temporal()
+        key = pl.col(column).dt.strftime('%Y-%m') if temporal else pl.col(column)
+        agg = (frame.filter(pl.col(column).is_not_null()).group_by(key.alias(dimension))
+               .agg(_measure_exprs(columns)).sort(dimension).collect().to_pandas().set_index(dimension))
+        if temporal:
+            agg.index = pd.PeriodIndex(agg.index, freq='M', name=dimension)
+    nb_clients = agg.pop('nb_clients') if 'nb_clients' in agg else None
+    return _kpi_table(agg, nb_clients)
+
+
+def generate_kpis(df):
+    """Équivalent Polars de data_processing.generate_kpis (même dictionnaire)."""
+    return _result(kpi_table(df).iloc[0]).to_dict()
+
+
+class PolarsKpiEngine:
+    """
+    Même interface que kpis.KpiEngine (totals, by) pour l'application : chaque appel est
+    une requête Polars sur les colonnes utiles du dataset (cf. kpi_table).
+    """
+
+    def __init__(self, df):
+        self.df = df
+
+    def totals(self):
+        return _result(kpi_table(self.df).iloc[0])
+
+    def by(self, dimension):
+        return kpi_table(self.df, dimension)
@@ -0,0 +1,189 @@
+"""
+Statistiques glissantes par client sur tableaux plats : un seul tri stable par
+(client, date d'émission), fenêtres calculées sur les tableaux triés, résultats
+réécrits par position. Remplace groupby().rolling() + reset_index + merge
+(plusieurs copies complètes et une jointure) dans ml_predict.create_advanced_features.
+Deux types de fenêtres, comme rolling() : un nombre de factures (5) ou une durée
+calendaire en jours d'émission ('30D').
+"""
+import numpy as np
+import pandas as pd
+
+STATS = ('mean', 'std', 'max', 'sum')
+TIME_STATS = ('count', 'mean', 'std', 'sum')
+# Jour d'émission manquant : après toutes les dates du client, hors de toute fenêtre calendaire
+_NO_DAY = 10 ** 6
+
+
+def client_order(clients, dates):
+    """
+    Ordre de tri (client, date) des lignes ayant un client, stable comme
+    df.sort_values(['Code Client', date]) (dates manquantes en fin de client).
+    Retourne (order, starts) : positions des lignes dans l'ordre trié et, pour chaque
+    position triée, la position triée de la première ligne de son client.
+    """
+    codes = pd.Categorical(clients).codes
+    stamps = pd.to_datetime(dates, errors='coerce', cache=False).to_numpy().view('int64')
+    # NaT (plus petit int64) placé après toutes les dates
+    stamps = np.where(stamps == np.iinfo('int64').min, np.iinfo('int64').max, stamps)
+    known = np.flatnonzero(codes >= 0)
+    order = known[np.lexsort((stamps[known], codes[known]))]
+    sorted_codes = codes[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = sorted_codes[1:] != sorted_codes[:-1]
+    starts = np.maximum.accumulate(np.where(first, np.arange(len(order)), 0))
+    return order, starts
+
+
+def window_stats(values, starts, window, stats=STATS):
+    """
+    Statistiques sur les `window` dernières valeurs (ligne courante incluse) de chaque
+    position triée, sans franchir le début du client ; NaN tant que la fenêtre n'est
+    pas complète ou si elle contient une valeur manquante (comme rolling(window)).
+    Les fenêtres sont cumulées sur `window` vues décalées du tableau plat (pas de copie
+    par fenêtre) ; l'écart-type est calculé en deux passes (ddof=1).
+    """
+    n = len(values)
+    out = {stat: np.full(n, np.nan) for stat in stats}
+    m = n - window + 1
+    if m <= 0:
+        return out
+    views = [values[k:k + m] for k in range(window)]
+    total = views[0].copy()
+    for view in views[1:]:
+        total += view
+    mean = total / window
+    result = {'sum': total, 'mean': mean}
+    if 'std' in stats:
+        squares = (views[0] - mean) ** 2
+        for view in views[1:]:
+            squares += (view - mean) ** 2
+        result['std'] = np.sqrt(squares / (window - 1)) if window > 1 else np.full(m, np.nan)
+    if 'max' in stats:
+        peak = views[0].copy()
+        for view in views[1:]:
+            np.maximum(peak, view, out=peak)
+        result['max'] = peak
+    # Fenêtre complète dans le même client
+    ends = np.arange(window - 1, n)
+    valid = ends - starts[window - 1:] >= window - 1
+    for stat in stats:
+        out[stat][window - 1:] = np.where(valid, result[stat], np.nan)
+    return out
+
+
+def _prefix(values):
+    out = np.zeros(len(values) + 1)
+    np.cumsum(values, out=out[1:])
+    return out
+
+
+def _client_prefix(values, blocks, slots):
+    """
+    Sommes cumulées remises à zéro au début de chaque client : une case de correction
+    (moins le total du client précédent) précède chaque client dans le tableau cumulé,
+    l'erreur d'arrondi reste à l'échelle du client et non de toutes les lignes qui le
+    précèdent. Retourne (jusqu'à i inclus, jusqu'à i exclu) ; somme de l..i = incl[i] - excl[l].
+    """
+    extended = np.zeros(len(values) + len(blocks))
+    extended[slots] = values
+    extended[blocks[1:] + np.arange(1, len(blocks))] = -np.add.reduceat(values, blocks)[:-1]
+    cumulated = np.cumsum(extended)
+    return cumulated[slots], cumulated[slots - 1]
+
+
+def time_window_stats(values, starts, lefts, stats=TIME_STATS):
+    """
+    Statistiques sur les positions triées lefts[i]..i (fenêtre calendaire, cf. time_lefts),
+    valeurs manquantes ignorées (comme rolling('30D')) ; NaN sans valeur dans la fenêtre
+    (écart-type : moins de deux valeurs).
+    Sommes cumulées par client (cf. _client_prefix) des valeurs centrées sur la moyenne
+    du client, pour limiter l'erreur d'arrondi sur les montants (différences de grandes
+    sommes cumulées).
+    """
+    known = ~np.isnan(values)
+    n = len(values)
+    if not n:
+        return {stat: np.zeros(0) for stat in stats}
+    # Moyenne du client (valeurs connues), répétée sur ses lignes
+    blocks = np.flatnonzero(np.r_[True, starts[1:] != starts[:-1]])
+    sizes = np.diff(np.r_[blocks, n])
+    sums = np.add.reduceat(np.where(known, values, 0.0), blocks)
+    counts = np.add.reduceat(known.astype('int64'), blocks)
+    means = np.divide(sums, counts, out=np.zeros(len(blocks)), where=counts > 0)
+    offset = np.repeat(means, sizes)
+    centered = np.where(known, values - offset, 0.0)
+    # Position de chaque ligne dans le tableau cumulé (après la case de son client)
+    slots = np.arange(n) + np.repeat(np.arange(1, len(blocks) + 1), sizes)
+    prefix = _prefix(known)
+    count = (prefix[np.arange(n) + 1] - prefix[lefts]).astype('int64')
+    upto, before = _client_prefix(centered, blocks, slots)
+    total = upto - before[lefts]
+    safe = np.maximum(count, 1)
+    out = {}
+    if 'count' in stats:
+        out['count'] = count.astype(float)
+    if 'sum' in stats:
+        out['sum'] = np.where(count > 0, total + count * offset, np.nan)
+    if 'mean' in stats:
+        out['mean'] = np.where(count > 0, total / safe + offset, np.nan)
+    if 'std' in stats:
+        upto, before = _client_prefix(centered ** 2, blocks, slots)
+        squares = upto - before[lefts]
+        spread = squares - total ** 2 / safe
+        # Écart d'arrondi des sommes cumulées du client (fenêtre constante) : variance nulle.
+        # Seuil relatif au cumul du client lui-même, pas à celui de tout le tableau
+        spread[spread <= 1e-10 * upto] = 0.0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            var = spread / (count - 1)
+        out['std'] = np.where(count > 1, np.sqrt(var), np.nan)
+    return out
+
+
+def time_lefts(codes, days, span):
+    """
+    Début (position triée) de la fenêtre calendaire de `span` jours de chaque position :
+    factures du même client émises dans (jour - span, jour]. Un seul searchsorted sur la
+    clé (client, jour) triée, équivalent vectorisé d'un balayage à deux pointeurs.
+    """
+    key = codes.astype('int64') * (2 * _NO_DAY) + days
+    return np.searchsorted(key, key - (span - 1), side='left')
+
+
+def client_window_features(df, features, client='Code Client', date="Date d'Emission"):
+    """
+    Features glissantes par client : features = {nom: (colonne, statistique, fenêtre)},
+    fenêtre = nombre de factures (int) ou durée calendaire ('30D').
+    Un seul tri pour toutes les fenêtres ; une passe par (colonne, fenêtre).
+    Retourne un dict nom -> tableau aligné sur les lignes de df (NaN sans client,
+    et sans date d'émission pour les fenêtres calendaires).
+    """
+    order, starts = client_order(df[client], df[date])
+    codes = pd.Categorical(df[client]).codes[order]
+    dates = pd.to_datetime(df[date], errors='coerce', cache=False).to_numpy()[order]
+    dated = ~np.isnat(dates)
+    days = np.where(dated, dates.astype('datetime64[D]').view('int64'), _NO_DAY)
+    wanted = {}
+    for column, stat, window in features.values():
+        wanted.setdefault((column, window), []).append(stat)
+    computed = {}
+    lefts = {}
+    sorted_values = {}
+    for (column, window), stats in wanted.items():
+        if column not in sorted_values:
+            sorted_values[column] = df[column].to_numpy(dtype=float)[order]
+        values = sorted_values[column]
+        if isinstance(window, str):
+            span = pd.Timedelta(window).days
+            if span not in lefts:
+                lefts[span] = time_lefts(codes, days, span)
+            result = time_window_stats(values, starts, lefts[span], stats)
+            computed[(column, window)] = {stat: np.where(dated, result[stat], np.nan) for stat in stats}
+        else:
+            computed[(column, window)] = window_stats(values, starts, window, stats)
+    result = {}
+    for name, (column, stat, window) in features.items():
+        values = np.full(len(df), np.nan)
+        values[order] = computed[(column, window)][stat]
+        result[name] = values
+    return result
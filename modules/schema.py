@@ -0,0 +1,163 @@
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+
+# Nature des colonnes attendues dans un fichier de factures
+ID = "id"          # identifiant, gardé tel quel
+CODE = "code"      # code / libellé (texte)
+AMOUNT = "amount"  # montant au format FR ("1 234,56")
+DATE = "date"
+FLAG = "flag"      # indicateur OUI / NON
+
+# Registre des colonnes utilisées par le traitement (noms harmonisés, cf. COLUMN_MAPPING).
+# Les autres colonnes du fichier (OBS, échéance 2, ...) ne sont pas lues.
+INVOICE_SCHEMA = {
+    'N° Facture': ID,
+    "Date d'Emission": DATE,
+    'Code Client': CODE,
+    'Client': CODE,
+    ' H.T ': AMOUNT,
+    ' T.V.A ': AMOUNT,
+    ' T.R ': AMOUNT,
+    ' T.T.C ': AMOUNT,
+    'échéance': DATE,
+    ' Caution ': AMOUNT,
+    'Encaissement': FLAG,
+    'Date Encaissement': DATE,
+    ' Montant ': AMOUNT,
+}
+
+
+def columns_of_kind(kind, schema=INVOICE_SCHEMA):
+    return [col for col, k in schema.items() if k == kind]
+
+
+# Espaces (dont insécables) utilisés comme séparateurs de milliers
+_BLANKS = [" ", "\u00a0", "\u202f", "\t"]
+# Nombre au format décimal point, une fois séparateurs retirés
+_NUMBER = r"^[+-]?(\d+(\.\d*)?|\.\d+)([eE][+-]?\d+)?$"
+
+
+def _arrow_text(values):
+    """
+    Colonne en tableau Arrow texte, convertie par Arrow (colonne texte, category, dtype
+    string) ; conversion Python cellule par cellule seulement pour une colonne object
+    mêlant texte et nombres.
+    """
+    try:
+        array = pa.array(values, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array(values.astype(str).to_numpy(dtype=object), type=pa.string(), mask=values.isna().to_numpy())
+    if isinstance(array, pa.ChunkedArray):
+        array = array.combine_chunks()
+    if pa.types.is_dictionary(array.type):
+        array = array.dictionary_decode()
+    return array if pa.types.is_string(array.type) else pc.cast(array, pa.string())
+
+
+def parse_fr_amounts(values):
+    """
+    Conversion vectorisée d'une colonne de montants au format FR ("1 234,56", "1.234,56",
+    espaces insécables) en float. Les opérations texte et la conversion sont exécutées
+    par Arrow sur la colonne entière, sans boucle Python par cellule.
+    Les colonnes déjà numériques sont renvoyées telles quelles.
+    Retourne (montants, nb_cellules_non_convertibles) ; les cellules vides ou réduites
+    à un tiret comptable (" -   ") ne sont pas comptées comme erreurs.
+    """
+    if pd.api.types.is_numeric_dtype(values):
+        return values, 0
+    if pa is None:
+        return _parse_fr_amounts_pandas(values)
+    text = _arrow_text(values)
+    for blank in _BLANKS:
+        text = pc.replace_substring(text, blank, "")
+    decimal_comma = pc.match_substring(text, ",")
+    if pc.any(decimal_comma).as_py():
+        fr = text
+        if pc.any(pc.and_(decimal_comma, pc.match_substring(text, "."))).as_py():
+            # "1.234,56" : points = séparateurs de milliers, virgule = décimale
+            fr = pc.replace_substring_regex(fr, r"\.(\d{3})", r"\1")
+        text = pc.if_else(decimal_comma, pc.replace_substring(fr, ",", "."), text)
+    empty = pc.is_in(text, value_set=pa.array(["", "-"]))
+    try:
+        # Cas courant : toutes les cellules renseignées sont des nombres
+        amounts = pc.cast(pc.if_else(empty, pa.scalar(None, pa.string()), text), pa.float64())
+        return pd.Series(amounts.to_numpy(zero_copy_only=False), index=values.index, name=values.name), 0
+    except pa.ArrowInvalid:
+        pass
+    valid = pc.match_substring_regex(text, _NUMBER)
+    amounts = pc.cast(pc.if_else(valid, text, pa.scalar(None, pa.string())), pa.float64())
+    invalid = pc.and_not(pc.invert(valid), empty)
+    n_invalid = pc.sum(invalid.fill_null(False)).as_py() or 0
+    return pd.Series(amounts.to_numpy(zero_copy_only=False), index=values.index, name=values.name), n_invalid
+
+
+def _parse_fr_amounts_pandas(values):
+    text = values.astype(str).str.replace(r"[\s\u00a0\u202f]", "", regex=True)
+    decimal_comma = text.str.contains(",", regex=False)
+    text = text.where(~decimal_comma, text.str.replace(r"\.(\d{3})", r"\1", regex=True).str.replace(",", ".", regex=False))
+    amounts = pd.to_numeric(text, errors='coerce')
+    invalid = amounts.isna() & values.notna() & ~text.isin(["", "-"])
+    return amounts, int(invalid.sum())
+
+
+def merge_invalid_amounts(frames):
+    """Somme des compteurs montants_invalides de plusieurs DataFrames (blocs, fichiers)."""
+    merged = {}
+    for frame in frames:
+        for col, n in frame.attrs.get('montants_invalides', {}).items():
+            merged[col] = merged.get(col, 0) + n
+    return merged
+
+
+def record_invalid_amounts(df, counts):
+    """Cumule dans df.attrs['montants_invalides'] le nombre de cellules non converties par colonne."""
+    merged = dict(df.attrs.get('montants_invalides', {}))
+    for col, n in counts.items():
+        merged[col] = merged.get(col, 0) + n
+    df.attrs['montants_invalides'] = merged
+    return df
+
+
+def _selected(raw_columns, schema, mapping):
+    return [col for col in raw_columns if mapping.get(col, col) in schema]
+
+
+def reader_options(raw_columns, fmt, schema, mapping):
+    """
+    Arguments à passer au lecteur pandas pour ne lire que les colonnes du schéma,
+    déjà typées : usecols/columns et dtype (codes en texte). Les montants sont convertis
+    ensuite, colonne entière, par conform().
+    - raw_columns : en-têtes du fichier, avant harmonisation
+    """
+    selected = _selected(raw_columns, schema, mapping)
+    if fmt in ("parquet", "feather"):
+        return {"columns": selected}
+    kinds = {col: schema[mapping.get(col, col)] for col in selected}
+    options = {
+        "usecols": selected,
+        "dtype": {col: str for col, kind in kinds.items() if kind in (CODE, FLAG)},
+    }
+    return options
+
+
+def conform(df, schema=INVOICE_SCHEMA):
+    """
+    Ne garde que les colonnes du schéma (noms harmonisés) et type celles que le lecteur
+    n'a pas pu typer : montants -> float, dates -> datetime, indicateurs sans espaces.
+    """
+    df = df.drop(columns=[col for col in df.columns if col not in schema])
+    invalid = {}
+    for col in df.columns:
+        kind = schema[col]
+        if kind == AMOUNT and not pd.api.types.is_numeric_dtype(df[col]):
+            df[col], invalid[col] = parse_fr_amounts(df[col])
+        elif kind == DATE and not pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = pd.to_datetime(df[col], errors='coerce')
+        elif kind == FLAG and df[col].dtype == object:
+            df[col] = df[col].str.strip()
+    return record_invalid_amounts(df, invalid)
@@ -0,0 +1,139 @@
+import hashlib
+import importlib.util
+import json
+import os
+import time
+
+import pandas as pd
+
+from modules.schema import INVOICE_SCHEMA
+from utils.utils import COLUMN_MAPPING
+
+PARQUET_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIR = os.path.join(BASE_DIR, "cache", "uploads")
+# Taille maximale du cache (Mo), au-delà les entrées les moins récemment utilisées sont supprimées
+CACHE_MAX_BYTES = int(os.environ.get("UPLOAD_CACHE_MAX_MB", "512")) * 1024 * 1024
+# Version de la lecture / harmonisation des fichiers : à incrémenter quand elle change
+# (en plus du schéma et de COLUMN_MAPPING, pris en compte automatiquement, cf. cache_key)
+PARSE_VERSION = 1
+
+
+def content_hash(data):
+    """Empreinte SHA-256 du contenu brut d'un fichier importé."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def _parse_fingerprint():
+    settings = json.dumps([PARSE_VERSION, INVOICE_SCHEMA, COLUMN_MAPPING], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(settings.encode("utf-8")).hexdigest()[:8]
+
+
+def cache_key(data):
+    """
+    Clé du cache pour le contenu `data` : empreinte du fichier suivie de celle de la lecture
+    (schéma, COLUMN_MAPPING, PARSE_VERSION). Une entrée produite avec une autre lecture
+    (ex. avant l'ajout d'une colonne au schéma) n'est jamais réutilisée.
+    """
+    return f"{content_hash(data)}-{_parse_fingerprint()}"
+
+
+def _entry_path(key):
+    return os.path.join(CACHE_DIR, f"{key}.parquet")
+
+
+def _json_safe(value):
+    try:
+        json.dumps(value)
+    except TypeError:
+        return False
+    return True
+
+
+def arrow_safe(df):
+    """Rend le DataFrame sérialisable en Parquet (colonnes texte/nombres mélangés -> texte)."""
+    df.columns = [str(c) for c in df.columns]
+    # Les attrs sont écrits en JSON dans les métadonnées Parquet (ex. ValidationReport : retiré)
+    df.attrs = {key: value for key, value in df.attrs.items() if _json_safe(value)}
+    for col in df.columns[df.dtypes == object]:
+        if pd.api.types.infer_dtype(df[col], skipna=True) in ("mixed", "mixed-integer"):
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return df
+
+
+def get(key):
+    """DataFrame en cache pour l'empreinte `key`, ou None."""
+    path = _entry_path(key)
+    if not PARQUET_AVAILABLE or not os.path.exists(path):
+        return None
+    try:
+        df = pd.read_parquet(path)
+        os.utime(path)  # marque l'entrée comme récemment utilisée (LRU)
+        return df
+    except Exception:
+        os.remove(path)  # entrée corrompue : elle sera reconstruite
+        return None
+
+
+def put(key, df):
+    """Enregistre `df` sous l'empreinte `key`. Retourne le DataFrame tel que stocké."""
+    df = arrow_safe(df)
+    if not PARQUET_AVAILABLE:
+        return df
+    path = _entry_path(key)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        df.to_parquet(tmp_path)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return df
+    evict(CACHE_MAX_BYTES)
+    return df
+
+
+def _entries():
+    if not os.path.isdir(CACHE_DIR):
+        return []
+    entries = []
+    for name in os.listdir(CACHE_DIR):
+        if name.endswith(".parquet"):
+            path = os.path.join(CACHE_DIR, name)
+            stat = os.stat(path)
+            entries.append((path, stat.st_size, stat.st_mtime))
+    return entries
+
+
+def evict(max_bytes=CACHE_MAX_BYTES):
+    """Supprime les entrées les moins récemment utilisées jusqu'à repasser sous `max_bytes`."""
+    entries = sorted(_entries(), key=lambda e: e[2])
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for path, size, _ in entries:
+        if total <= max_bytes:
+            break
+        os.remove(path)
+        total -= size
+        removed += 1
+    return removed
+
+
+def cache_info():
+    """Contenu du cache : une ligne par fichier importé (empreinte, taille, dernière utilisation)."""
+    entries = sorted(_entries(), key=lambda e: e[2], reverse=True)
+    return pd.DataFrame({
+        "Empreinte": [os.path.basename(p)[:-len(".parquet")] for p, _, _ in entries],
+        "Taille (Mo)": [round(size / 1024 / 1024, 2) for _, size, _ in entries],
+        "Dernière utilisation": [time.strftime("%Y-%m-%d %H:%M", time.localtime(m)) for _, _, m in entries],
+    })
+
+
+def purge_cache():
+    """Vide entièrement le cache des imports. Retourne le nombre d'entrées supprimées."""
+    entries = _entries()
+    for path, _, _ in entries:
+        os.remove(path)
+    return len(entries)
@@ -0,0 +1,236 @@
+"""
+Entrepôt DuckDB (optionnel) : fichier unique cache/warehouse.duckdb contenant les factures
+traitées (et leurs prédictions) de tous les imports, sans serveur. Les agrégations des KPIs,
+de l'analyse des cautions et de l'EDA s'y exécutent en SQL (parallèle, hors mémoire) et
+produisent un cube.InvoiceCube identique à InvoiceCube.build sur les mêmes factures.
+Connexions courtes (une par opération) : l'application et le traitement batch peuvent
+utiliser l'entrepôt tour à tour.
+"""
+import os
+from contextlib import contextmanager
+
+import pandas as pd
+
+try:
+    import duckdb
+    DUCKDB_AVAILABLE = True
+except ImportError:
+    duckdb = None
+    DUCKDB_AVAILABLE = False
+
+from modules.cube import CUBE_DIMENSIONS, InvoiceCube
+from modules.data_processing import DELAY_RULE_ABOVE, DELAY_RULE_MISSING, DELAY_RULES, ON_TIME_CATEGORIES
+from modules.schema import CODE, ID, columns_of_kind
+from modules.upload_cache import BASE_DIR, arrow_safe
+from utils.utils import as_of_date
+
+WAREHOUSE_PATH = os.path.join(BASE_DIR, "cache", "warehouse.duckdb")
+TABLE = "factures"
+KEY = 'N° Facture'
+ROW = '_ligne'            # ordre d'arrivée des factures (première caution renseignée)
+AS_OF = '_date_reference'  # date de référence des retards de la ligne
+EMISSION = "Date d'Emission"
+# Identifiants et codes toujours stockés en texte (N° Facture numérique puis alphanumérique)
+TEXT_COLUMNS = columns_of_kind(ID) + columns_of_kind(CODE)
+_NUMERIC = {'TINYINT', 'SMALLINT', 'INTEGER', 'BIGINT', 'HUGEINT', 'UTINYINT', 'USMALLINT',
+            'UINTEGER', 'UBIGINT', 'FLOAT', 'DOUBLE'}
+
+
+def _q(name):
+    """Identifiant SQL ("Date d'Emission", " T.T.C ", ...)."""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _text(value):
+    """Littéral texte SQL."""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+@contextmanager
+def connect(path=WAREHOUSE_PATH, read_only=False):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    con = duckdb.connect(path, read_only=read_only)
+    try:
+        yield con
+    finally:
+        con.close()
+
+
+def _types(con):
+    rows = con.execute(
+        "SELECT column_name, data_type FROM information_schema.columns WHERE table_name = ? ORDER BY ordinal_position", [TABLE]
+    ).fetchall()
+    return dict(rows)
+
+
+def _columns(con):
+    return list(_types(con))
+
+
+def _as_text(values):
+    # Codes lus comme nombres (1001, ou 1001.0 avec des manquants) -> "1001"
+    if pd.api.types.is_float_dtype(values) and (values.dropna() % 1 == 0).all():
+        values = values.astype('Int64')
+    return values.astype(object).where(values.notna(), None).map(str, na_action='ignore')
+
+
+def _wider(current, new):
+    """Type de colonne acceptant les valeurs des deux types (None : conversion implicite)."""
+    if current == new:
+        return None
+    if 'VARCHAR' in (current, new):
+        return 'VARCHAR'
+    if current in _NUMERIC and new in _NUMERIC:
+        return 'DOUBLE' if current != 'DOUBLE' else None
+    return None
+
+
+def count(path=WAREHOUSE_PATH):
+    """Nombre de factures de l'entrepôt (0 s'il n'existe pas)."""
+    if not DUCKDB_AVAILABLE or not os.path.exists(path):
+        return 0
+    with connect(path, read_only=True) as con:
+        if not _columns(con):
+            return 0
+        return con.execute(f"SELECT count(*) FROM {TABLE}").fetchone()[0]
+
+
+def save(df, as_of=None, path=WAREHOUSE_PATH):
+    """
+    Ajoute les factures de df (traitées, éventuellement avec leurs prédictions) à l'entrepôt :
+    une facture déjà présente (même N° Facture) est remplacée. Les colonnes nouvelles
+    (ex. prédictions) sont ajoutées à la table ; une colonne dont les valeurs ne tiennent plus
+    dans le type de la table (entiers puis décimaux, nombres puis texte) est élargie.
+    Retourne le nombre de factures de l'entrepôt.
+    """
+    # Types stables d'un import à l'autre : category -> texte, colonnes mixtes -> texte
+    frame = arrow_safe(df.astype({col: object for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)}))
+    frame = frame.reset_index(drop=True)
+    for col in TEXT_COLUMNS:
+        if col in frame.columns:
+            frame[col] = _as_text(frame[col])
+    if as_of is not None:
+        frame[AS_OF] = pd.Timestamp(as_of)
+    with connect(path) as con:
+        con.register("nouvelles", frame)
+        incoming = {row[0]: row[1] for row in con.execute("DESCRIBE nouvelles").fetchall()}
+        for col in TEXT_COLUMNS:
+            if col in incoming:
+                incoming[col] = 'VARCHAR'
+        types = _types(con)
+        if not types:
+            columns = ", ".join(f"{_q(col)} {kind}" for col, kind in incoming.items())
+            con.execute(f"CREATE TABLE {TABLE} ({columns}, {ROW} BIGINT)")
+            types = _types(con)
+        for col, kind in incoming.items():
+            if col not in types:
+                con.execute(f"ALTER TABLE {TABLE} ADD COLUMN {_q(col)} {kind}")
+            elif _wider(types[col], kind):
+                con.execute(f"ALTER TABLE {TABLE} ALTER {_q(col)} TYPE {_wider(types[col], kind)}")
+        if KEY in frame.columns:
+            con.execute(f"DELETE FROM {TABLE} WHERE CAST({_q(KEY)} AS VARCHAR) IN "
+                        f"(SELECT CAST({_q(KEY)} AS VARCHAR) FROM nouvelles)")
+        start = con.execute(f"SELECT coalesce(max({ROW}) + 1, 0) FROM {TABLE}").fetchone()[0]
+        con.execute(f"INSERT INTO {TABLE} BY NAME SELECT *, {start} + row_number() OVER () - 1 AS {ROW} FROM nouvelles")
+        con.unregister("nouvelles")
+        return con.execute(f"SELECT count(*) FROM {TABLE}").fetchone()[0]
+
+
+def clear(path=WAREHOUSE_PATH):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _measure_sql(columns):
+    # Mêmes mesures que cube._measures, dans le même ordre
+    sql = ["count(*)::BIGINT AS n"]
+    sql.append(f"count({_q(KEY)})::BIGINT AS n_factures" if KEY in columns else "count(*)::BIGINT AS n_factures")
+    for name, measure in ((' T.T.C ', 'ttc'), ('Jours_Retard', 'retard'), ('Est_En_Retard', 'en_retard')):
+        if name in columns:
+            value = f"CAST({_q(name)} AS DOUBLE)"
+            sql.append(f"coalesce(sum({value}), 0) AS {measure}")
+            sql.append(f"count({value})::BIGINT AS {measure}_n")
+            if measure == 'retard':
+                sql.append(f"max({value}) AS retard_max")
+    if 'Est_Retard_Exagéré' in columns:
+        sql.append(f"coalesce(sum(CAST({_q('Est_Retard_Exagéré')} AS DOUBLE)), 0) AS retard_exagere")
+    if EMISSION in columns:
+        sql.append(f"min({_q(EMISSION)}) AS premiere_emission")
+    return sql
+
+
+def _aged_sql(columns, as_of):
+    """
+    Table des factures avec les retards des factures ouvertes recalculés à la date as_of
+    (mêmes règles que data_processing.compute_delay_status / reage_open_invoices) : les
+    lignes enregistrées à des dates de référence différentes (_date_reference) deviennent
+    comparables. Les retards des factures encaissées sont figés et repris tels quels.
+    """
+    if 'échéance' not in columns or 'Jours_Retard' not in columns:
+        return TABLE
+    if 'Encaissement' in columns and 'Date Encaissement' in columns:
+        opened = f"NOT coalesce({_q('Encaissement')} = 'OUI' AND {_q('Date Encaissement')} IS NOT NULL, false)"
+    else:
+        opened = "true"
+    echeance = _q('échéance')
+    days = (f"CASE WHEN {echeance} IS NULL THEN 0 ELSE CAST(floor((epoch(TIMESTAMP {_text(as_of)}) - "
+            f"epoch({echeance})) / 86400) AS BIGINT) END")
+
+    def rule(index):
+        # index 0 : statut détaillé, 1 : catégorie (cf. DELAY_RULES)
+        cases = "".join(f" WHEN _jours <= {bound} THEN {_text(labels[index])}" for bound, *labels in DELAY_RULES)
+        return f"CASE WHEN {echeance} IS NULL THEN {_text(DELAY_RULE_MISSING[index])}{cases} ELSE {_text(DELAY_RULE_ABOVE[index])} END"
+
+    on_time = ", ".join(_text(category) for category in ON_TIME_CATEGORIES)
+    aged = {
+        'Jours_Retard': "_jours",
+        'Statut_Détaillé': "_statut",
+        'Catégorie_Règle': "_categorie",
+        'Est_En_Retard': f"CASE WHEN _categorie IN ({on_time}) THEN 0 ELSE 1 END",
+        'Est_Retard_Exagéré': f"CASE WHEN _categorie = {_text(DELAY_RULE_ABOVE[1])} THEN 1 ELSE 0 END",
+    }
+    replace = ", ".join(f"CASE WHEN _ouverte THEN {expr} ELSE {_q(col)} END AS {_q(col)}"
+                        for col, expr in aged.items() if col in columns)
+    return (f"(SELECT * EXCLUDE (_ouverte, _jours, _statut, _categorie) REPLACE ({replace}) FROM "
+            f"(SELECT *, {opened} AS _ouverte, {days} AS _jours, {rule(0)} AS _statut, {rule(1)} AS _categorie "
+            f"FROM {TABLE}))")
+
+
+def cube(extra_dimensions=(), where=None, params=None, as_of=None, path=WAREHOUSE_PATH):
+    """
+    Cube d'agrégats (cf. cube.InvoiceCube) calculé en SQL sur l'entrepôt, retards des
+    factures ouvertes vieillis à la date de référence as_of (défaut : aujourd'hui), quelle
+    que soit la date de leur import (cf. _aged_sql).
+    - where / params : filtre SQL optionnel (ex. where='"Date d\'Emission" >= ?', params=['2024-01-01'])
+    """
+    as_of = as_of_date(as_of)
+    with connect(path, read_only=True) as con:
+        columns = _columns(con)
+        source = _aged_sql(columns, as_of)
+        dimensions, select = [], []
+        for dim in CUBE_DIMENSIONS + list(extra_dimensions):
+            if dim == 'Mois' and EMISSION in columns:
+                select.append(f"date_trunc('month', {_q(EMISSION)}) AS {_q(dim)}")
+            elif dim in columns:
+                select.append(_q(dim))
+            else:
+                continue
+            dimensions.append(dim)
+        filter_sql = f" WHERE {where}" if where else ""
+        query = f"SELECT {', '.join(select + _measure_sql(columns))} FROM {source} AS factures{filter_sql}"
+        if dimensions:
+            query += f" GROUP BY {', '.join(str(i + 1) for i in range(len(dimensions)))}"
+        cells = con.execute(query, params or []).df()
+        cautions = None
+        if all(col in columns for col in ['Code Client', 'Client', ' Caution ']):
+            # Première caution renseignée du client, dans l'ordre d'arrivée des factures
+            caution_filter = f" AND ({where})" if where else ""
+            cautions = con.execute(
+                f"SELECT {_q('Code Client')}, {_q('Client')}, "
+                f"arg_min({_q(' Caution ')}, {ROW}) FILTER (WHERE {_q(' Caution ')} IS NOT NULL) AS caution "
+                f"FROM {source} AS factures WHERE {_q('Code Client')} IS NOT NULL AND {_q('Client')} IS NOT NULL{caution_filter} "
+                f"GROUP BY 1, 2", params or []
+            ).df().set_index(['Code Client', 'Client'])['caution'].rename(' Caution ')
+    if 'Mois' in cells.columns:
+        cells['Mois'] = pd.to_datetime(cells['Mois']).dt.to_period('M')
+    return InvoiceCube(cells, dimensions, cautions)
@@ -17,6 +17,9 @@ from imblearn.over_sampling import BorderlineSMOTE
 import lightgbm as lgb
 import warnings
 from IPython.display import display
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from modules.ingestion import load_invoices
 
 warnings.filterwarnings('ignore', category=UserWarning, module='sklearn')
 warnings.filterwarnings('ignore', category=FutureWarning)
@@ -135,7 +138,7 @@ class PaymentDelayAI:
 print("Chargement du fichier...")
 excel_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../data/BD_avec_regles_paiement_latest.xlsx'))
 print(f"Chemin absolu du fichier Excel : {excel_path}")
-df = pd.read_excel(excel_path)
+df = load_invoices(excel_path)
 
 for col in ["Date d'Emission", 'échéance', 'Date Encaissement']:
     if col in df.columns:
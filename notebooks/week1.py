@@ -15,6 +15,10 @@ import pandas as pd
 import numpy as np
 from datetime import datetime
 from IPython.display import display
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from modules.ingestion import load_invoices
 
 def explore_data_structure(file_path):
     """Exploration complète de la structure des données"""
@@ -25,7 +29,7 @@ def explore_data_structure(file_path):
     import os
     excel_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../data/updated_BD V2.xlsx'))
     print(f"Chemin absolu du fichier Excel : {excel_path}")
-    df = pd.read_excel(excel_path)
+    df = load_invoices(excel_path)
 
     print(f" INFORMATIONS GÉNÉRALES:")
     print(f"• Taille du dataset: {df.shape[0]} lignes, {df.shape[1]} colonnes")
@@ -464,7 +468,7 @@ def load_and_explore_data(file_path):
     import os
     excel_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../data/updated_BD V2.xlsx'))
     print(f"Chemin absolu du fichier Excel (main flow): {excel_path}")
-    df = pd.read_excel(excel_path)
+    df = load_invoices(excel_path)
     print(f"Data loaded successfully: {df.shape[0]} rows, {df.shape[1]} columns")
     # You can uncomment these lines if you want to see the full initial audit output
     # print("Available columns:", df.columns.tolist())
@@ -943,7 +947,7 @@ def load_and_explore_data(file_path):
     import os
     excel_path = os.path.abspath(os.path.join(os.path.dirname(__file__), file_path))
     print(f"Chemin absolu du fichier Excel (final flow): {excel_path}")
-    df = pd.read_excel(excel_path)
+    df = load_invoices(excel_path)
     print(f"Data loaded successfully: {df.shape[0]} rows, {df.shape[1]} columns")
     return df
 
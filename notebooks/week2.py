@@ -23,7 +23,12 @@ import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 
-df = pd.read_excel("BD_avec_regles_paiement_latest.xlsx")
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from modules.ingestion import load_invoices
+
+df = load_invoices("BD_avec_regles_paiement_latest.xlsx")
 # Conversion des colonnes de date
 date_cols = ["Date d'Emission", 'échéance', 'Date Encaissement']
 for col in date_cols:
@@ -351,7 +356,7 @@ def identify_risk_profiles(df):
 
 identify_risk_profiles(df)
 
-df = pd.read_excel("BD_avec_regles_paiement_latest.xlsx", sheet_name=0)  # Adjust sheet_name if needed
+df = load_invoices("BD_avec_regles_paiement_latest.xlsx")  # première feuille
 
 # Simple EDA summary with pandas
 df_summary = df.describe()
@@ -0,0 +1,76 @@
+"""
+Benchmark des règles de retard : ancienne version ligne à ligne (df.apply) contre
+data_processing.apply_payment_delay_rules (vectorisée), sur le fichier d'exemple
+répliqué jusqu'à N factures. Vérifie aussi que les deux sorties sont identiques.
+
+    python scripts/benchmark_delay_rules.py --rows 1000000
+"""
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root_dir)
+
+from modules import data_processing
+from modules.ingestion import load_invoices
+from modules.schema import INVOICE_SCHEMA
+
+
+def apply_payment_delay_rules_rowwise(df, as_of):
+    # Implémentation historique (un appel Python par facture), gardée comme référence
+    def calculate_delay_status(row):
+        echeance = row.get('échéance', pd.NaT)
+        if pd.isna(echeance): return 'Échéance manquante', 0, 'Indéterminé'
+        if row.get('Encaissement', '') == 'OUI' and pd.notna(row.get('Date Encaissement', pd.NaT)):
+            days_late = (row['Date Encaissement'] - echeance).days
+        else:
+            days_late = (as_of - echeance).days
+        if days_late < 0:
+            return 'Payée avant échéance', days_late, 'Aucun retard'
+        elif days_late <= 30:
+            return 'Dans les délais', days_late, 'Pas de retard'
+        elif days_late <= 60:
+            return 'En retard', days_late, 'Retard'
+        else:
+            return 'Retard exagéré', days_late, 'Retard exagéré'
+    df[['Statut_Détaillé', 'Jours_Retard', 'Catégorie_Règle']] = df.apply(
+        calculate_delay_status, axis=1, result_type='expand'
+    )
+    df['Est_En_Retard'] = df['Catégorie_Règle'].apply(lambda x: 0 if x in ['Pas de retard', 'Aucun retard'] else 1)
+    df['Est_Retard_Exagéré'] = (df['Catégorie_Règle'] == 'Retard exagéré').astype(int)
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--data", default=os.path.join(root_dir, "data", "updated_BD V2.xlsx"))
+    args = parser.parse_args()
+
+    sample = load_invoices(args.data, schema=INVOICE_SCHEMA)
+    sample = sample[['échéance', 'Encaissement', 'Date Encaissement']]
+    reps = -(-args.rows // len(sample))
+    df = pd.concat([sample] * reps, ignore_index=True).head(args.rows)
+
+    as_of = pd.Timestamp.now().normalize()
+    start = time.perf_counter()
+    expected = apply_payment_delay_rules_rowwise(df.copy(), as_of)
+    rowwise = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = data_processing.apply_payment_delay_rules(df.copy(), as_of)
+    vectorized = time.perf_counter() - start
+
+    pd.testing.assert_frame_equal(result, expected)
+    print(f"{len(df)} factures")
+    print(f"  ligne à ligne : {rowwise:8.3f} s")
+    print(f"  vectorisé     : {vectorized:8.3f} s")
+    print(f"  accélération  : x{rowwise / vectorized:.0f} (sorties identiques)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Parité du backend Polars (modules.polars_backend) avec le backend pandas : nettoyage +
+règles de retard, rapport de validation, KPIs globaux et par client / mois / catégorie,
+sur le fichier d'exemple (avec des lignes invalides ajoutées) répliqué jusqu'à N factures,
+puis sur des cas limites (tableau vide, montants tous manquants, colonnes category).
+Affiche aussi les durées des deux backends ; code retour 1 en cas d'écart.
+
+    python scripts/check_polars_parity.py --rows 1000000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root_dir)
+
+from modules import data_processing, polars_backend
+from modules.ingestion import load_invoices
+from modules.kpis import DIMENSIONS, KpiEngine
+from modules.schema import AMOUNT, INVOICE_SCHEMA, columns_of_kind
+
+
+def timed(label, timings, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    timings.setdefault(label, []).append(time.perf_counter() - start)
+    return result
+
+
+def check_cleaning(df, as_of, timings):
+    expected = timed("nettoyage pandas", timings, data_processing._clean_and_prepare, df, True, as_of)
+    result = timed("nettoyage polars", timings, polars_backend.clean_and_prepare, df, as_of)
+    pd.testing.assert_frame_equal(result, expected)
+    assert result.attrs['montants_invalides'] == expected.attrs['montants_invalides'], "montants_invalides"
+    report, expected_report = data_processing.validation_report(result), data_processing.validation_report(expected)
+    assert report.nb_lignes == expected_report.nb_lignes, "nb_lignes"
+    np.testing.assert_array_equal(report.index, expected_report.index)
+    np.testing.assert_array_equal(report.regles, expected_report.regles)
+    return expected
+
+
+def check_kpis(df, timings):
+    engine = timed("KPIs pandas", timings, KpiEngine, df)
+    kpis = timed("KPIs pandas", timings, engine.totals).to_dict()
+    result = timed("KPIs polars", timings, polars_backend.generate_kpis, df)
+    # Comparaison à plat : NaN (moyennes sans facture) égal à NaN
+    pd.testing.assert_series_equal(pd.json_normalize(result).iloc[0], pd.json_normalize(kpis).iloc[0])
+    # Moteur utilisé par l'application avec DATA_BACKEND=polars (cf. data_processing.kpi_engine)
+    polars_engine = polars_backend.PolarsKpiEngine(df)
+    pd.testing.assert_series_equal(pd.json_normalize(polars_engine.totals().to_dict()).iloc[0],
+                                   pd.json_normalize(kpis).iloc[0])
+    for dimension in DIMENSIONS:
+        expected_table = timed("KPIs pandas", timings, engine.by, dimension)
+        table = timed("KPIs polars", timings, polars_engine.by, dimension)
+        pd.testing.assert_frame_equal(table, expected_table, check_dtype=False, check_index_type=False)
+
+
+def run_case(label, steps, failures):
+    """Exécute une étape de contrôle ; tout écart (ou erreur d'un backend) est noté."""
+    try:
+        return steps()
+    except Exception as error:
+        message = str(error).strip().splitlines()[0] if str(error).strip() else type(error).__name__
+        failures.append(f"{label} : {type(error).__name__} {message}")
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--data", default=os.path.join(root_dir, "data", "updated_BD V2.xlsx"))
+    parser.add_argument("--as-of", default="2025-07-01")
+    args = parser.parse_args()
+    if not polars_backend.POLARS_AVAILABLE:
+        sys.exit("Polars n'est pas installé (pip install polars).")
+
+    sample = load_invoices(args.data, schema=INVOICE_SCHEMA)
+    reps = -(-args.rows // len(sample))
+    df = pd.concat([sample] * reps, ignore_index=True).head(args.rows)
+    # Lignes invalides et valeurs manquantes : toutes les règles de validation sont exercées
+    df.loc[::53, ' T.T.C '] = 0
+    df.loc[5::101, "Date d'Emission"] = pd.NaT
+    df.loc[9::211, 'échéance'] = df.loc[9::211, "Date d'Emission"] - pd.Timedelta(days=3)
+    df.loc[11::307, 'Encaissement'] = None
+    as_of = pd.Timestamp(args.as_of)
+    amounts = [col for col in columns_of_kind(AMOUNT) if col in df.columns]
+    texts = [col for col in df.columns if df[col].dtype == object]
+
+    timings, failures = {}, []
+    cleaned = run_case("fichier / nettoyage", lambda: check_cleaning(df, as_of, timings), failures)
+    if cleaned is None:
+        cleaned = data_processing._clean_and_prepare(df, True, as_of)
+    run_case("fichier / KPIs", lambda: check_kpis(cleaned, timings), failures)
+    # Cas limites : tableau vide, montants tous manquants, colonnes category (compact_frame)
+    edge_cases = {
+        "vide": (df.iloc[:0], cleaned.iloc[:0]),
+        "montants manquants": (df.assign(**{col: np.nan for col in amounts}),
+                               cleaned.assign(**{col: np.nan for col in amounts if col in cleaned.columns})),
+        "catégories": (df.astype({col: 'category' for col in texts}), data_processing.compact_frame(cleaned)),
+    }
+    for label, (raw, processed) in edge_cases.items():
+        run_case(f"{label} / nettoyage", lambda: check_cleaning(raw, as_of, {}), failures)
+        run_case(f"{label} / KPIs", lambda: check_kpis(processed, {}), failures)
+
+    print(f"{len(df)} factures ({len(cleaned)} retenues), cas limites : {', '.join(edge_cases)}")
+    for label, durations in timings.items():
+        print(f"  {label:<18}: {sum(durations):8.3f} s")
+    for failure in failures:
+        print(f"  ÉCART {failure}")
+    if failures:
+        sys.exit(1)
+    print("  sorties identiques")
+
+
+if __name__ == "__main__":
+    main()
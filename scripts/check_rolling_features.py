@@ -0,0 +1,200 @@
+"""
+Parité des features glissantes par client (ml_predict.CLIENT_WINDOW_FEATURES, calculées par
+modules/rolling.py) avec pandas sur un jeu synthétique de N factures : index mélangé,
+valeurs et dates manquantes, factures sans client.
+- fenêtres en nombre de factures : groupby().rolling(5)
+- fenêtres calendaires : groupby().rolling('30D', on=date d'émission)
+- feature store (modules/feature_store.py) : nouvelles factures scorées à partir des fins
+  d'historique stockées = calcul sur l'historique complet
+- scoring incrémental (invoice_store.score_incremental) après modification, suppression et
+  ajout de factures : scores repris + recalculés = calcul complet
+Code retour 1 en cas d'écart.
+
+    python scripts/check_rolling_features.py --rows 400000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root_dir)
+
+from modules import feature_store, invoice_store
+from modules.ml_predict import CLIENT_WINDOW_FEATURES
+from modules.rolling import client_window_features
+
+CLIENT = 'Code Client'
+EMISSION = "Date d'Emission"
+KEY = 'N° Facture'
+AS_OF = pd.Timestamp('2024-06-01')
+
+
+def synthetic(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    delays = rng.integers(-30, 2001, rows).astype(float)
+    df = pd.DataFrame({
+        KEY: np.arange(rows).astype(str),
+        CLIENT: rng.integers(0, max(rows // 200, 1), rows).astype(str),
+        EMISSION: pd.Timestamp('2020-01-01') + pd.to_timedelta(rng.integers(0, 1500, rows), unit='D'),
+        'Jours_Retard': delays,
+        'Est_En_Retard': (delays > 30).astype(int),
+        ' T.T.C ': np.round(rng.random(rows) * 1e6, 2),
+    })
+    df.loc[::977, EMISSION] = pd.NaT
+    df.loc[::1301, CLIENT] = None
+    df.loc[::703, 'Jours_Retard'] = np.nan
+    df.loc[::811, ' T.T.C '] = np.nan
+    # Faible dispersion en fin de tableau : ne doit pas disparaître dans l'arrondi des
+    # sommes cumulées des clients précédents (écart-type attendu 0,707 pour ZZZ, 0 pour ZZY)
+    tail = pd.DataFrame({
+        KEY: ['Z1', 'Z2', 'Z3', 'Z4'],
+        CLIENT: ['ZZZ', 'ZZZ', 'ZZY', 'ZZY'],
+        EMISSION: pd.to_datetime(['2024-01-01', '2024-02-01', '2024-01-01', '2024-02-01']),
+        'Jours_Retard': [10.0, 11.0, 1500.0, 1500.0],
+        'Est_En_Retard': [0, 0, 1, 1],
+        ' T.T.C ': [100.0, 100.0, 100.0, 100.0],
+    })
+    df = pd.concat([df, tail], ignore_index=True)
+    # Index mélangé et non contigu : résultats alignés par position
+    df = df.sample(frac=1, random_state=seed)
+    df.index = df.index * 3 + 7
+    return df
+
+
+def reference(df, features):
+    """Mêmes features avec groupby().rolling() (tri stable par client et date, dates manquantes en fin)."""
+    ordered = df[df[CLIENT].notna()].sort_values([CLIENT, EMISSION], kind='stable')
+    dated = ordered[ordered[EMISSION].notna()]
+    grouped, grouped_dated = ordered.groupby(CLIENT, sort=False), dated.groupby(CLIENT, sort=False)
+    out = {}
+    for name, (column, stat, window) in features.items():
+        if isinstance(window, str):
+            values = grouped_dated.rolling(window, on=EMISSION)[column].agg(stat).droplevel(0)
+            values.index = dated.index
+        else:
+            values = grouped[column].rolling(window).agg(stat).droplevel(0)
+        out[name] = values.reindex(df.index).to_numpy()
+    return out
+
+
+def compare(result, expected, label):
+    failures = []
+    for name, values in expected.items():
+        try:
+            np.testing.assert_allclose(result[name], values, rtol=1e-7, atol=1e-6, equal_nan=True)
+        except AssertionError as error:
+            failures.append(f"{label} {name} : {str(error).strip().splitlines()[0]}")
+    return failures
+
+
+def check_feature_store(df, features):
+    """
+    Historique (factures émises avant une date de coupure) stocké par feature_store.rebuild,
+    puis factures suivantes scorées par feature_store.update : mêmes valeurs que le calcul
+    sur le tableau complet. Quelques factures antérieures à la coupure arrivent avec les
+    nouvelles (clients recalculés à partir de l'historique complet).
+    """
+    cutoff = df[EMISSION].quantile(0.9)
+    late = df[EMISSION] >= cutoff
+    late |= (np.arange(len(df)) % 5000 == 0) & df[EMISSION].notna()
+    history, new = df[~late], df[late]
+    # Ordre des factures d'un même jour : historique puis nouvelles factures
+    full = pd.concat([history, new])
+    expected = reference(full, features)
+    with tempfile.TemporaryDirectory() as store_dir:
+        feature_store.rebuild(history, features, AS_OF, store_dir=store_dir)
+        start = time.perf_counter()
+        result, stats = feature_store.update(new, features, AS_OF, history=full, store_dir=store_dir)
+        elapsed = time.perf_counter() - start
+    positions = full.index.get_indexer(new.index)
+    failures = compare(result, {name: values[positions] for name, values in expected.items()}, "feature store")
+    print(f"  feature store : {len(new)} nouvelles factures en {elapsed:.3f} s, "
+          f"{stats['clients']} clients dont {stats['reconstruits']} recalculés")
+    return failures
+
+
+def edited(df, seed=1):
+    """
+    Import suivant : factures anciennes d'un client modifiées (encaissement enregistré), dernière
+    facture d'un autre client supprimée, dernière facture d'un troisième modifiée, nouvelles
+    factures ajoutées pour ces clients.
+    """
+    rng = np.random.default_rng(seed)
+    df = df.copy()
+    dated = df[df[CLIENT].notna() & df[EMISSION].notna()].sort_values([CLIENT, EMISSION], kind='stable')
+    clients = dated[CLIENT].value_counts().index[:3]
+    first = dated[dated[CLIENT] == clients[0]].index[:30]
+    df.loc[first, 'Jours_Retard'] = 0.0
+    df.loc[first, 'Est_En_Retard'] = 0
+    df = df.drop(dated[dated[CLIENT] == clients[1]].index[-1])
+    last = dated[dated[CLIENT] == clients[2]].index[-1]
+    df.loc[last, 'Jours_Retard'] = 1000.0
+    df.loc[last, 'Est_En_Retard'] = 1
+    added = pd.DataFrame({
+        KEY: [f'N{i}' for i in range(9)],
+        CLIENT: np.repeat(clients.to_numpy(), 3),
+        EMISSION: pd.Timestamp('2024-03-01') + pd.to_timedelta(np.tile([0, 0, 20], 3), unit='D'),
+        'Jours_Retard': rng.integers(0, 100, 9).astype(float),
+        'Est_En_Retard': rng.integers(0, 2, 9),
+        ' T.T.C ': np.round(rng.random(9) * 1e4, 2),
+    }, index=df.index.max() + 1 + np.arange(9))
+    return pd.concat([df, added])
+
+
+def check_incremental_scoring(df, features, use_store):
+    """
+    Deux imports successifs scorés par invoice_store.score_incremental, le score étant les
+    features glissantes elles-mêmes (calcul complet ou feature store) : après modification
+    d'anciennes factures, toutes les factures suivantes du client sont recalculées.
+    """
+    def score(context, as_of, store_dir=None, history=None):
+        if use_store:
+            values, _ = feature_store.update(context, features, as_of, history=history, store_dir=store_dir)
+        else:
+            values = client_window_features(context, features)
+        return context.assign(**values)
+
+    label = "scoring incrémental" + (" (feature store)" if use_store else "")
+    following = edited(df)
+    with tempfile.TemporaryDirectory() as store_dir:
+        invoice_store.score_incremental(df, score, store_dir, AS_OF, features=use_store)
+        result, stats = invoice_store.score_incremental(following, score, store_dir, AS_OF, features=use_store)
+    failures = compare({name: result[name].to_numpy() for name in features},
+                       client_window_features(following, features), label)
+    print(f"  {label} : {stats['reprises']} reprises, {stats['scorees']} recalculées")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=400_000)
+    args = parser.parse_args()
+
+    features = CLIENT_WINDOW_FEATURES
+    df = synthetic(args.rows)
+    start = time.perf_counter()
+    result = client_window_features(df, features)
+    elapsed = time.perf_counter() - start
+    print(f"{len(df)} factures, {len(features)} features : {elapsed:.3f} s")
+    failures = compare(result, reference(df, features), "rolling")
+
+    small = df[df[CLIENT].isin(['ZZY', 'ZZZ'])].sort_values([CLIENT, EMISSION])
+    last = df.index.get_indexer(small.index)
+    print(f"  écart-type 365D des clients ZZY / ZZZ : {np.round(result['client_std_delay_365d'][last], 3)}")
+    failures += check_feature_store(df, features)
+    for use_store in (False, True):
+        failures += check_incremental_scoring(df.head(100_000), features, use_store)
+    for failure in failures:
+        print(f"  ÉCART {failure}")
+    if failures:
+        sys.exit(1)
+    print("  parité pandas : OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,17 @@
 import os
-import pandas as pd
+import sys
 import joblib
 from lightgbm import LGBMClassifier
 
 # Chemin racine du projet
-root_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root_dir)
 
-# Chargement des données
+from modules.ingestion import load_invoices
+
+# Chargement des données (xlsx, csv, parquet ou feather)
 data_path = os.path.join(root_dir, "data", "BD_avec_regles_paiement_latest.xlsx")
-df = pd.read_excel(data_path)
+df = load_invoices(data_path)
 
 # Préparation des données (à adapter selon ton dataset réel)
 X = df.drop(df.columns[-1], axis=1)
@@ -1,5 +1,12 @@
+import functools
+
 import pandas as pd
 
+try:
+    import streamlit as st
+except ImportError:
+    st = None
+
 COLUMN_MAPPING = {
     "Client Name": "Client",
     "Nom Client": "Client",
@@ -16,4 +23,44 @@ def harmonize_columns(df, mapping):
     # Remplace les noms connus, garde les autres inchangés
     cols = [mapping.get(col, col) for col in df.columns]
     df.columns = cols
-    return df
\ No newline at end of file
+    return df
+
+def as_of_date(as_of=None):
+    """
+    Date de référence des calculs de retard et des features (minuit) : `as_of` si fourni
+    (date, chaîne 'AAAA-MM-JJ', Timestamp), sinon aujourd'hui.
+    Passée explicitement partout, elle fait partie des clés de cache.
+    """
+    return pd.Timestamp(as_of).normalize() if as_of is not None else pd.Timestamp.now().normalize()
+
+def _streamlit_cache(kind, **options):
+    # Cache Streamlit dans l'application ; appel direct hors Streamlit (batch, scripts).
+    # Le cache n'est créé qu'au premier appel dans l'application (pas d'avertissement en batch).
+    def decorator(func):
+        if st is None:
+            func.clear = lambda: None
+            return func
+        cached = []
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not st.runtime.exists():
+                return func(*args, **kwargs)
+            if not cached:
+                cached.append(getattr(st, kind)(**options)(func))
+            return cached[0](*args, **kwargs)
+
+        def clear():
+            if cached:
+                cached[0].clear()
+        wrapper.clear = clear
+        return wrapper
+    return decorator
+
+def cache_data(**options):
+    """Équivalent de st.cache_data, sans dépendance à Streamlit hors de l'application."""
+    return _streamlit_cache("cache_data", **options)
+
+def cache_resource(**options):
+    """Équivalent de st.cache_resource, sans dépendance à Streamlit hors de l'application."""
+    return _streamlit_cache("cache_resource", **options)